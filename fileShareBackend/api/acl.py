@@ -0,0 +1,118 @@
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, OuterRef, Subquery, Value, When
+from django.http import Http404
+from .models import EncryptedFile, FileShare
+
+# Cached decision for a user with no access to a file. Denials are cached too,
+# since sharing invalidates the exact (user, file) entry.
+NO_ACCESS = ""
+
+
+class AccessCache:
+    """
+    Per-(user, file) cache of access decisions ('owner', 'view', 'download' or
+    NO_ACCESS), stored in the default Django cache so every worker sees the
+    same entries. ENABLED, TTL and STRICT are read from settings.ACL_CACHE on
+    every call; in STRICT mode every lookup goes to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'ACL_CACHE', {})
+
+    @property
+    def enabled(self):
+        return (self.config.get('ENABLED', True)
+                and not self.config.get('STRICT', False))
+
+    @staticmethod
+    def key(user_id, file_id):
+        return f"acl:{user_id}:{file_id}"
+
+    def get(self, user_id, file_id):
+        """
+        Return the cached decision, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        access = cache.get(self.key(user_id, file_id))
+        with self._lock:
+            if access is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return access
+
+    def set(self, user_id, file_id, access):
+        if self.enabled:
+            cache.set(self.key(user_id, file_id), access,
+                      self.config.get('TTL', 300))
+
+    def invalidate(self, pairs):
+        """
+        Drop the decisions for an iterable of (user_id, file_id) pairs.
+        """
+        keys = [self.key(user_id, file_id) for user_id, file_id in pairs]
+        if keys:
+            cache.delete_many(keys)
+            with self._lock:
+                self.invalidations += len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+
+access_cache = AccessCache()
+
+
+def get_accessible_file(user, pk):
+    """
+    Return the file `pk` with an `access_type` attribute for `user`, raising
+    Http404 when it does not exist, is still being uploaded, or the user has
+    no access. A cache hit costs a primary-key lookup; a miss resolves the
+    file and the decision in one query and caches the result.
+    """
+    access = access_cache.get(user.pk, pk)
+    if access == NO_ACCESS:
+        raise Http404
+    if access is not None:
+        try:
+            file_instance = EncryptedFile.objects.exclude(
+                storage_format='pending').get(pk=pk)
+        except EncryptedFile.DoesNotExist:
+            raise Http404
+        file_instance.access_type = access
+        return file_instance
+
+    file_instance = EncryptedFile.objects.annotate(access_type=Case(
+        When(owner=user, then=Value("owner")),
+        default=Subquery(
+            FileShare.objects.filter(file=OuterRef('pk'),
+                                     user=user).values('access_type')[:1]),
+        output_field=CharField())).filter(pk=pk).exclude(
+            storage_format='pending').first()
+    if file_instance is None:
+        raise Http404
+    access_cache.set(user.pk, pk, file_instance.access_type or NO_ACCESS)
+    if not file_instance.access_type:
+        raise Http404
+    return file_instance
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .utlis import current_key_version, master_key
+
+        # Derive the key-wrapping master key once at startup so no request
+        # pays for it.
+        master_key(current_key_version())
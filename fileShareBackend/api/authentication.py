@@ -1,9 +1,86 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework.response import Response
+from .revocation import revocation_list
 
 
-class CookieJWTAuthentication(JWTAuthentication):
+class UserCache:
+    """
+    Users resolved from access tokens, kept in the default Django cache so
+    authenticated requests skip the auth_user query. Only users that passed
+    simplejwt's checks are stored, and every change to an account evicts its
+    entry (see api.signals). ENABLED and TTL are read from
+    settings.USER_CACHE on every call.
+
+    An entry holds only the fields in FIELDS (email because the profile
+    view returns it), plus the MD5 of the password hash that simplejwt puts
+    in tokens when CHECK_REVOKE_TOKEN is on; the hash itself never reaches
+    the shared cache. A hit is rebuilt as a user with every other field
+    deferred, loaded from the database only if a request reads it.
+    """
+    FIELDS = ('id', 'username', 'email', 'is_active', 'is_staff',
+              'is_superuser')
+
+    @property
+    def config(self):
+        return getattr(settings, 'USER_CACHE', {})
+
+    @staticmethod
+    def key(user_id):
+        return f"user:{user_id}"
+
+    def get(self, user_id):
+        """
+        Return (user, password MD5 or None) for a cached user, or None.
+        """
+        if not self.config.get('ENABLED', True):
+            return None
+        claims = cache.get(self.key(user_id))
+        if claims is None or (api_settings.CHECK_REVOKE_TOKEN
+                              and 'password_md5' not in claims):
+            return None
+        model = get_user_model()
+        # from_db() takes the values in the model's field order.
+        fields = [
+            field.attname for field in model._meta.concrete_fields
+            if field.attname in self.FIELDS
+        ]
+        user = model.from_db(None, fields,
+                             [claims[field] for field in fields])
+        return user, claims.get('password_md5')
+
+    def set(self, user_id, user):
+        if not self.config.get('ENABLED', True):
+            return
+        claims = {field: getattr(user, field) for field in self.FIELDS}
+        if api_settings.CHECK_REVOKE_TOKEN:
+            claims['password_md5'] = get_md5_hash_password(user.password)
+        cache.set(self.key(user_id), claims, self.config.get('TTL', 60))
+
+    def invalidate(self, user_id):
+        cache.delete(self.key(user_id))
+
+
+user_cache = UserCache()
+
+
+class RevocableJWTAuthentication(JWTAuthentication):
+    """JWT authentication that rejects tokens in the revocation list."""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        jti = validated_token.get(api_settings.JTI_CLAIM)
+        if jti is not None and revocation_list.is_revoked(jti):
+            raise InvalidToken("Token has been revoked.", code="token_revoked")
+        return validated_token
+
+
+class CookieJWTAuthentication(RevocableJWTAuthentication):
     """Custom JWT authentication that reads the token from an HTTP-only cookie."""
 
     def authenticate(self, request):
@@ -20,8 +97,27 @@ class CookieJWTAuthentication(JWTAuthentication):
 
             return (user, validated_token)
         except AuthenticationFailed:
-            # If token is invalid or expired, delete the invalid cookie
-            response = Response({"error": "Authentication failed"}, status=401)
-            response.delete_cookie("access_token")
-            response.delete_cookie("refresh_token")
-            return response
+            # An invalid, expired or revoked cookie makes the request
+            # anonymous: protected views answer 401, prompting the client to
+            # refresh, while login and the refresh endpoint keep working.
+            return None
+
+    def get_user(self, validated_token):
+        """
+        Return the token's user from the user cache, falling back to the
+        database lookup and its checks on a miss.
+        """
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        cached = user_cache.get(user_id) if user_id is not None else None
+        if cached is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+            return user
+        user, password_md5 = cached
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM) != password_md5:
+            # Repeat simplejwt's check: the token may predate a password
+            # change made after the user was cached.
+            raise AuthenticationFailed("The user's password has been changed.",
+                                       code="password_changed")
+        return user
@@ -0,0 +1,68 @@
+"""
+Helpers shared by the bench_* management commands.
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from .routers import BLOB_DATABASE, READ_ONLY_DATABASE
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Run the enclosed block against throwaway, fully migrated metadata and
+    blob databases in temporary files, so benchmarks never touch real data.
+    The read-only alias is pointed at the metadata file.
+    """
+    setup_test_environment()
+    created = []
+    try:
+        for alias in (DEFAULT_DB_ALIAS, BLOB_DATABASE):
+            fd, path = tempfile.mkstemp(suffix='.sqlite3', prefix='bench-')
+            os.close(fd)
+            database = connections[alias]
+            database.settings_dict.setdefault('TEST', {})['NAME'] = path
+            created.append((database,
+                            database.creation.create_test_db(
+                                verbosity=0, autoclobber=True,
+                                serialize=False)))
+        reader = connections[READ_ONLY_DATABASE]
+        reader_name = reader.settings_dict['NAME']
+        reader.close()
+        reader.settings_dict['NAME'] = (
+            f"file:{connection.settings_dict['NAME']}?mode=ro")
+        try:
+            yield
+        finally:
+            reader.close()
+            reader.settings_dict['NAME'] = reader_name
+    finally:
+        for database, old_name in reversed(created):
+            database.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def measure(trace_memory=True):
+    """
+    Record wall time, CPU time and, when `trace_memory` is set, peak traced
+    memory of the enclosed block into the yielded dict. Memory tracing slows
+    Python code down, so leave it off when CPU time is what matters.
+    """
+    result = {}
+    if trace_memory:
+        tracemalloc.start()
+    wall_started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        yield result
+    finally:
+        result['cpu'] = time.process_time() - cpu_started
+        result['wall'] = time.perf_counter() - wall_started
+        if trace_memory:
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
@@ -0,0 +1,292 @@
+"""
+Cache backends that can be shared by every worker process, each with an
+atomic pop() (get-and-delete) for one-time values such as MFA codes and an
+atomic take_token() for token-bucket rate limits.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from django.core.cache.backends import locmem, redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Writes between sweeps of expired entries, per process.
+SWEEP_EVERY = 1000
+
+
+def take_from_bucket(state, now, rate, capacity):
+    """
+    One token-bucket step. `state` is (tokens, updated_at), or None for a full
+    bucket. Returns the new state and 0 if a token was taken, otherwise the
+    unchanged state and the seconds until a token is available.
+    """
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens < 1:
+        return state, (1 - tokens) / rate
+    return (tokens - 1, now), 0
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache stored in a WAL-mode SQLite file, so every process on the node sees
+    the same entries and readers never block the writer. LOCATION is the path
+    of the file, which is created on first use.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _db(self):
+        # One connection per thread, reopened in children after a fork.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS cache_entries ("
+                       "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                       "expires REAL) WITHOUT ROWID")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % SWEEP_EVERY == 0:
+            self._cull()
+
+    def _cull(self):
+        db = self._db()
+        db.execute("DELETE FROM cache_entries WHERE expires <= ?",
+                   (time.time(), ))
+        (count, ) = db.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        if count > self._max_entries:
+            db.execute(
+                "DELETE FROM cache_entries WHERE key IN (SELECT key FROM "
+                "cache_entries ORDER BY expires LIMIT ?)",
+                (count // self._cull_frequency, ))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        # Insert, or overwrite only an expired entry, in one statement.
+        cursor = self._db().execute(
+            "INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+            "expires = excluded.expires WHERE cache_entries.expires <= ?",
+            (key, pickle.dumps(value, self.pickle_protocol),
+             self.get_backend_timeout(timeout), time.time()))
+        self._wrote()
+        return cursor.rowcount == 1
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db().execute(
+            "SELECT value FROM cache_entries WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (key, time.time())).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._db().execute(
+            "INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+            "expires = excluded.expires",
+            (key, pickle.dumps(value, self.pickle_protocol),
+             self.get_backend_timeout(timeout)))
+        self._wrote()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db().execute(
+            "UPDATE cache_entries SET expires = ? WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (self.get_backend_timeout(timeout), key, time.time()))
+        return cursor.rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db().execute("DELETE FROM cache_entries WHERE key = ?",
+                                    (key, ))
+        return cursor.rowcount == 1
+
+    def pop(self, key, default=None, version=None):
+        """
+        Atomically return and remove the value of `key`. Of several callers
+        racing for the same key, at most one gets the value.
+        """
+        key = self.make_and_validate_key(key, version=version)
+        row = self._db().execute(
+            "DELETE FROM cache_entries WHERE key = ? RETURNING value, expires",
+            (key, )).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def take_token(self, key, rate, capacity, version=None):
+        """
+        Take a token from the bucket at `key`, which holds up to `capacity`
+        tokens and gains `rate` per second. Returns 0 if one was taken,
+        otherwise the seconds until one is available.
+        """
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        db = self._db()
+        # The write lock makes the read-modify-write atomic across processes.
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT value FROM cache_entries WHERE key = ? "
+                "AND (expires IS NULL OR expires > ?)", (key, now)).fetchone()
+            state, wait = take_from_bucket(
+                None if row is None else pickle.loads(row[0]), now, rate,
+                capacity)
+            if not wait:
+                # A bucket left alone until it is full again can expire.
+                db.execute(
+                    "INSERT INTO cache_entries (key, value, expires) "
+                    "VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                    "value = excluded.value, expires = excluded.expires",
+                    (key, pickle.dumps(state, self.pickle_protocol),
+                     now + capacity / rate))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        if not wait:
+            self._wrote()
+        return wait
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (key, time.time())).fetchone() is not None
+
+    def get_many(self, keys, version=None):
+        key_map = {
+            self.make_and_validate_key(key, version=version): key
+            for key in keys
+        }
+        if not key_map:
+            return {}
+        rows = self._db().execute(
+            "SELECT key, value FROM cache_entries WHERE key IN "
+            f"({', '.join('?' * len(key_map))}) "
+            "AND (expires IS NULL OR expires > ?)",
+            (*key_map, time.time())).fetchall()
+        return {key_map[key]: pickle.loads(value) for key, value in rows}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "INSERT INTO cache_entries (key, value, expires) "
+                "VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "value = excluded.value, expires = excluded.expires",
+                [(self.make_and_validate_key(key, version=version),
+                  pickle.dumps(value, self.pickle_protocol), expires)
+                 for key, value in data.items()])
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self._wrote()
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if keys:
+            self._db().execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                f"({', '.join('?' * len(keys))})", keys)
+
+    def clear(self):
+        self._db().execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Connections are kept per thread for the life of the process.
+        pass
+
+
+# take_token() for Redis: the same step as take_from_bucket(), run
+# atomically on the server. Numbers are returned as strings, since Redis
+# truncates Lua numbers to integers.
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+if tokens < 1 then
+    return tostring((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'updated', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return '0'
+"""
+
+
+class RedisCache(redis.RedisCache):
+    """
+    Django's Redis backend with an atomic pop() and take_token().
+    """
+
+    def pop(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        client = self._cache.get_client(key, write=True)
+        # GET and DEL run in one MULTI/EXEC transaction.
+        pipeline = client.pipeline()
+        pipeline.get(key)
+        pipeline.delete(key)
+        value, _ = pipeline.execute()
+        return default if value is None else self._cache._serializer.loads(
+            value)
+
+    def take_token(self, key, rate, capacity, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        client = self._cache.get_client(key, write=True)
+        return float(
+            client.eval(TAKE_TOKEN_SCRIPT, 1, key, repr(rate), repr(capacity),
+                        repr(time.time())))
+
+
+class LocMemCache(locmem.LocMemCache):
+    """
+    Django's per-process memory cache with an atomic pop() and take_token(),
+    for development and tests only: entries are not shared between worker
+    processes.
+    """
+
+    def take_token(self, key, rate, capacity, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        with self._lock:
+            state = None if self._has_expired(key) else pickle.loads(
+                self._cache[key])
+            state, wait = take_from_bucket(state, now, rate, capacity)
+            if not wait:
+                self._set(key, pickle.dumps(state, self.pickle_protocol),
+                          capacity / rate)
+        return wait
+
+    def pop(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if self._has_expired(key):
+                self._delete(key)
+                return default
+            pickled = self._cache.pop(key)
+            self._expire_info.pop(key, None)
+        return pickle.loads(pickled)
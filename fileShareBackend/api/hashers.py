@@ -0,0 +1,144 @@
+"""
+Argon2 password hashing on a bounded pool of threads.
+
+Argon2 is memory-hard and takes a core for its full duration, so a burst of
+logins would otherwise occupy every worker. Hashes and verifications run on at
+most MAX_WORKERS threads per process (argon2-cffi releases the GIL), with up
+to QUEUE_SIZE more waiting; beyond that the request is rejected at once with
+a 503, before any hashing. The limits are per process and only matter when a
+process serves several requests at once, which is why the production image
+runs gunicorn's threaded workers and sizes the limits against WEB_THREADS.
+Limits are read from settings.PASSWORD_HASHING and the cost parameters from
+settings.ARGON2, which the calibrate_argon2 command tunes; hashes made with
+other parameters are upgraded at the next login.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many logins in progress, please retry shortly."
+    default_code = "password_hashing_busy"
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler.
+        self.wait = wait
+
+
+class BoundedExecutor:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._limits = None
+        self.reset_stats()
+
+    @property
+    def config(self):
+        return getattr(settings, 'PASSWORD_HASHING', {})
+
+    def _pool(self):
+        """
+        The executor and the semaphore bounding running plus queued calls,
+        created on first use in each process and again when the limits in
+        settings change.
+        """
+        limits = (self.config.get('MAX_WORKERS', 2),
+                  self.config.get('QUEUE_SIZE', 2))
+        with self._lock:
+            if self._pid != os.getpid() or self._limits != limits:
+                if self._executor is not None and self._pid == os.getpid():
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=limits[0], thread_name_prefix='argon2')
+                self._slots = threading.BoundedSemaphore(sum(limits))
+                self._pid = os.getpid()
+                self._limits = limits
+            return self._executor, self._slots
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool and return its result, or raise
+        PasswordHashingBusy if the pool and its queue are full.
+        """
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy(self.config.get('RETRY_AFTER', 1))
+        try:
+            with self._lock:
+                self.queued += 1
+                self.max_queued = max(self.max_queued, self.queued)
+            return executor.submit(self._timed, fn, args,
+                                   time.perf_counter()).result()
+        finally:
+            slots.release()
+
+    def _timed(self, fn, args, submitted):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds += time.perf_counter() - submitted
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "mean_wait": (self.wait_seconds / self.completed
+                              if self.completed else 0.0),
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.running = self.queued = self.max_queued = 0
+            self.completed = self.rejected = 0
+            self.wait_seconds = 0.0
+
+
+password_executor = BoundedExecutor()
+
+
+class BoundedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Django's Argon2 hasher with its work done on password_executor and its
+    cost parameters read from settings.ARGON2.
+    """
+
+    @property
+    def time_cost(self):
+        return settings.ARGON2.get('TIME_COST', super().time_cost)
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2.get('MEMORY_COST', super().memory_cost)
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2.get('PARALLELISM', super().parallelism)
+
+    def encode(self, password, salt):
+        return password_executor.run(super().encode, password, salt)
+
+    def verify(self, password, encoded):
+        return password_executor.run(super().verify, password, encoded)
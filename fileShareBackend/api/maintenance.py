@@ -0,0 +1,243 @@
+"""
+Periodic cleanup of rows nothing reads any more, and of the space they held.
+
+A sweep deletes expired or used-up public links, revoked tokens past their
+own expiry, expired upload sessions, finished or stale outbound email,
+abandoned pending files and blobs left without a parent. Deletes run MAINTENANCE['BATCH_SIZE'] rows at a time, each
+batch in its own short write transaction with a pause in between, so
+requests waiting for the SQLite write lock are never held up for more than
+one batch.
+
+Deleted rows only put their pages on SQLite's freelist. Databases created
+with auto_vacuum=INCREMENTAL (see SQLITE_PRAGMAS) hand those pages back to
+the filesystem in steps of MAINTENANCE['VACUUM_PAGES']; older files need one
+full VACUUM, which takes the write lock for its whole run, to switch mode.
+
+The sweep runs from the run_maintenance command, or in the web process when
+MAINTENANCE['IN_PROCESS'] is set, in which case a cache lock lets only one
+process per interval do the work.
+"""
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import (EncryptedFile, FilePayload, FileSegment, OutboundEmail,
+                     PublicLink, RevokedToken, UploadChunk, UploadSession)
+from .routers import READ_ONLY_DATABASE
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'maintenance:lock'
+
+# Value of PRAGMA auto_vacuum for incremental mode.
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _config(name):
+    defaults = {
+        'BATCH_SIZE': 500,
+        'BATCH_PAUSE': 0.05,
+        'VACUUM_PAGES': 1000,
+        'INTERVAL': 3600,
+        'IN_PROCESS': False,
+    }
+    return getattr(settings, 'MAINTENANCE', {}).get(name, defaults[name])
+
+
+def delete_in_batches(queryset, batch_size=None, pause=None):
+    """
+    Delete the rows matching `queryset` `batch_size` at a time, each batch in
+    its own transaction. Returns the number of rows of the queryset's model
+    deleted; rows removed by cascade are not counted.
+    """
+    batch_size = batch_size or _config('BATCH_SIZE')
+    pause = _config('BATCH_PAUSE') if pause is None else pause
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += model._default_manager.filter(
+            pk__in=pks).delete()[1].get(model._meta.label, 0)
+        if len(pks) < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def delete_orphans(model, field, parent, batch_size=None):
+    """
+    Delete rows of the blob model `model` whose `field` points at a `parent`
+    row that no longer exists. Returns the number of rows deleted.
+
+    Metadata rows are always committed before their blobs are written, so a
+    blob without one is left over from a deletion and never from an upload
+    in progress.
+    """
+    batch_size = batch_size or _config('BATCH_SIZE')
+    deleted = 0
+    last = None
+    while True:
+        owners = model.objects.order_by(field).values_list(field,
+                                                          flat=True).distinct()
+        if last is not None:
+            owners = owners.filter(**{f'{field}__gt': last})
+        owners = list(owners[:batch_size])
+        if not owners:
+            return deleted
+        last = owners[-1]
+        existing = set(
+            parent.objects.filter(pk__in=owners).values_list('pk', flat=True))
+        orphans = [owner for owner in owners if owner not in existing]
+        if orphans:
+            deleted += model.objects.filter(**{
+                f'{field}__in': orphans
+            }).delete()[0]
+
+
+def sweep_orphan_blobs(pending_ttl, batch_size=None):
+    """
+    Remove files whose upload was abandoned more than `pending_ttl` ago, then
+    every blob left without a file or upload session. Returns a dict of rows
+    deleted per model name.
+    """
+    stale = EncryptedFile.objects.filter(storage_format='pending',
+                                         uploaded_at__lt=timezone.now() -
+                                         pending_ttl)
+    counts = {'EncryptedFile': delete_in_batches(stale, batch_size)}
+    for model, field, parent in ((FileSegment, 'file_id', EncryptedFile),
+                                 (FilePayload, 'file_id', EncryptedFile),
+                                 (UploadChunk, 'session_id', UploadSession)):
+        counts[model.__name__] = delete_orphans(model, field, parent,
+                                                batch_size)
+    return counts
+
+
+def sweep_expired(batch_size=None):
+    """
+    Delete expired and used-up public links, revoked tokens that have
+    expired anyway, expired upload sessions, email sent or failed more than
+    EMAIL_OUTBOX['KEEP_FINISHED'] ago or past its discard_after, abandoned
+    uploads and orphaned blobs. Returns a dict of rows deleted per model
+    name.
+    """
+    now = timezone.now()
+    counts = {
+        'PublicLink':
+        delete_in_batches(
+            PublicLink.objects.filter(
+                Q(expires_at__lte=now)
+                | Q(remaining_downloads=0) & (Q(resume_until__isnull=True)
+                                              | Q(resume_until__lte=now))),
+            batch_size),
+        # The revocation list drops these at its next full reload.
+        'RevokedToken':
+        delete_in_batches(RevokedToken.objects.filter(expires_at__lte=now),
+                          batch_size),
+        'UploadSession':
+        delete_in_batches(UploadSession.objects.filter(expires_at__lt=now),
+                          batch_size),
+        'OutboundEmail':
+        delete_in_batches(
+            OutboundEmail.objects.filter(
+                Q(status__in=['sent', 'failed'],
+                  created_at__lt=now - settings.EMAIL_OUTBOX['KEEP_FINISHED'])
+                | Q(status='pending', discard_after__lte=now)), batch_size),
+    }
+    # Chunks of the sessions just deleted are picked up as orphans here.
+    counts.update(sweep_orphan_blobs(settings.PENDING_FILE_TTL, batch_size))
+    return counts
+
+
+def _pragma(cursor, name):
+    cursor.execute(f"PRAGMA {name}")
+    return cursor.fetchone()[0]
+
+
+def reclaim_space(full=False, pages=None, pause=None):
+    """
+    Return the free pages of every writable SQLite database to the
+    filesystem: a step of `pages` at a time when the database uses
+    incremental auto-vacuum, or with one VACUUM when `full` is set.
+
+    Returns {alias: (bytes reclaimed, bytes still free)}.
+    """
+    pages = pages or _config('VACUUM_PAGES')
+    pause = _config('BATCH_PAUSE') if pause is None else pause
+    report = {}
+    for alias in connections:
+        connection = connections[alias]
+        if alias == READ_ONLY_DATABASE or connection.vendor != 'sqlite':
+            continue
+        with connection.cursor() as cursor:
+            page_size = _pragma(cursor, 'page_size')
+            before = _pragma(cursor, 'page_count')
+            if full:
+                cursor.execute("VACUUM")
+            elif _pragma(cursor, 'auto_vacuum') == AUTO_VACUUM_INCREMENTAL:
+                while _pragma(cursor, 'freelist_count'):
+                    cursor.execute(f"PRAGMA incremental_vacuum({pages})")
+                    # Each step frees one page per row fetched.
+                    cursor.fetchall()
+                    time.sleep(pause)
+            report[alias] = ((before - _pragma(cursor, 'page_count')) *
+                             page_size,
+                             _pragma(cursor, 'freelist_count') * page_size)
+    return report
+
+
+def run_maintenance(full_vacuum=False, batch_size=None):
+    """
+    Sweep, then reclaim the space freed. Returns (rows deleted per model,
+    space per database as returned by reclaim_space).
+    """
+    counts = sweep_expired(batch_size)
+    return counts, reclaim_space(full=full_vacuum)
+
+
+class MaintenanceScheduler:
+    """
+    Daemon thread running run_maintenance every MAINTENANCE['INTERVAL']
+    seconds. Started lazily in each process, so a server that forks its
+    workers after loading the app gets one thread per worker; the cache lock
+    keeps all but one of them idle per interval.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='maintenance',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            interval = _config('INTERVAL')
+            time.sleep(interval)
+            if not cache.add(LOCK_KEY, os.getpid(), timeout=interval):
+                continue
+            try:
+                run_maintenance()
+            except Exception:
+                logger.exception("Maintenance sweep failed")
+            finally:
+                for connection in connections.all(initialized_only=True):
+                    connection.close()
+
+
+maintenance_scheduler = MaintenanceScheduler()
@@ -0,0 +1,60 @@
+import statistics
+import time
+from contextlib import ExitStack
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.benchmarks import benchmark_database
+from api.routers import read_only_alias
+
+
+class Command(BaseCommand):
+    help = ("Time authenticated profile requests with the user cache enabled "
+            "and disabled, and count the queries each request makes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests',
+                            type=int,
+                            default=2000,
+                            help="Requests per configuration.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'user cache':<10} {'req/s':>8} {'p50 ms':>8} "
+                          f"{'p99 ms':>8} {'queries':>8}")
+        with benchmark_database():
+            user = User.objects.create_user(username='bench',
+                                            password='bench')
+            client = Client()
+            client.cookies['access_token'] = str(
+                RefreshToken.for_user(user).access_token)
+            for enabled in (False, True):
+                cache.clear()
+                with override_settings(USER_CACHE={'ENABLED': enabled}):
+                    self.run('on' if enabled else 'off', client,
+                             options['requests'])
+
+    def run(self, label, client, requests):
+        url = reverse('profile')
+        client.get(url)  # warm up, and fill the cache when enabled
+        timings = []
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in {DEFAULT_DB_ALIAS, read_only_alias()}
+            ]
+            for _ in range(requests):
+                started = time.perf_counter()
+                client.get(url)
+                timings.append(time.perf_counter() - started)
+        queries = sum(len(c) for c in captured)
+        timings.sort()
+        self.stdout.write(
+            f"{label:<10} {requests / sum(timings):>8.0f} "
+            f"{statistics.median(timings) * 1000:>8.2f} "
+            f"{timings[int(len(timings) * 0.99)] * 1000:>8.2f} "
+            f"{queries / requests:>8.1f}")
@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.benchmarks import benchmark_database, measure
+from api.models import EncryptedFile
+
+
+class Command(BaseCommand):
+    help = ("Measure queries and wall time of sharing one file, and several "
+            "files, with growing numbers of recipients.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients',
+                            default='10,1000,10000',
+                            help="Comma-separated recipient counts.")
+        parser.add_argument('--files',
+                            type=int,
+                            default=5,
+                            help="Files shared at once by the bulk endpoint.")
+
+    def handle(self, *args, **options):
+        counts = [int(n) for n in options['recipients'].split(',')]
+
+        # Let the largest bulk request through the per-request cap.
+        limit = max(counts) * options['files']
+        with benchmark_database(), override_settings(
+                MAX_SHARES_PER_REQUEST=limit):
+            owner = User.objects.create_user(username='bench',
+                                             password='bench')
+            User.objects.bulk_create(
+                User(username=f'recipient{i}') for i in range(max(counts)))
+            files = [
+                EncryptedFile.objects.create(owner=owner,
+                                             file_name=f'bench{i}.pdf',
+                                             iv='iv')
+                for i in range(options['files'])
+            ]
+            client = Client()
+            client.cookies['access_token'] = str(
+                RefreshToken.for_user(owner).access_token)
+
+            self.stdout.write(f"{'endpoint':<12} {'recipients':>10} "
+                              f"{'pass':<7} {'queries':>7} {'wall ms':>9}")
+            for count in counts:
+                shares = [{
+                    'user': f'recipient{i}',
+                    'access_type': 'view'
+                } for i in range(count)]
+                requests = (
+                    ('share-file',
+                     lambda: client.post(reverse('share-file',
+                                                 args=[files[0].pk]),
+                                         {'shares': shares},
+                                         content_type='application/json')),
+                    ('share-files',
+                     lambda: client.post(reverse('share-files'), {
+                         'files': [f.pk for f in files],
+                         'shares': shares
+                     },
+                                         content_type='application/json')),
+                )
+                for name, request in requests:
+                    # The first pass inserts every share, the second one
+                    # updates them in place.
+                    for label in ('insert', 'update'):
+                        with CaptureQueriesContext(connection) as queries, \
+                                measure(trace_memory=False) as result:
+                            response = request()
+                        if response.status_code != 200:
+                            raise CommandError(
+                                f"{name} returned {response.status_code}: "
+                                f"{response.content[:200]!r}")
+                        self.stdout.write(
+                            f"{name:<12} {count:>10} {label:<7} "
+                            f"{len(queries):>7} {result['wall'] * 1000:>9.1f}")
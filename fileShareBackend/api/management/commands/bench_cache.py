@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from api.cache_backends import LocMemCache, RedisCache, SQLiteCache
+
+
+def make_cache(name, location):
+    if name == 'locmem':
+        return LocMemCache('bench', {})
+    if name == 'sqlite':
+        return SQLiteCache(location, {})
+    return RedisCache(location, {})
+
+
+def run_ops(name, location, ops, value, worker):
+    """
+    Time `ops` sets followed by `ops` gets. Returns (set/s, get/s).
+    """
+    cache = make_cache(name, location)
+    keys = [f'bench:{worker}:{i % 1000}' for i in range(ops)]
+    started = time.perf_counter()
+    for key in keys:
+        cache.set(key, value, 300)
+    set_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for key in keys:
+        cache.get(key)
+    get_elapsed = time.perf_counter() - started
+    return ops / set_elapsed, ops / get_elapsed
+
+
+def _worker(args):
+    return run_ops(*args)
+
+
+class Command(BaseCommand):
+    help = ("Compare get/set throughput of the shared SQLite (and optionally "
+            "Redis) cache backends against the per-process LocMem cache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops',
+                            type=int,
+                            default=20000,
+                            help="Sets and gets per process.")
+        parser.add_argument('--value-size', type=int, default=64)
+        parser.add_argument('--processes',
+                            default='1,4',
+                            help="Comma-separated process counts.")
+        parser.add_argument('--redis-url',
+                            default=os.environ.get('REDIS_URL'),
+                            help="Also benchmark Redis at this URL.")
+
+    def handle(self, *args, **options):
+        value = os.urandom(options['value_size'])
+        backends = [('locmem', None)]
+        directory = tempfile.mkdtemp(prefix='bench-cache-')
+        backends.append(('sqlite', os.path.join(directory, 'cache.sqlite3')))
+        if options['redis_url']:
+            backends.append(('redis', options['redis_url']))
+
+        self.stdout.write(f"{'backend':<8} {'procs':>5} {'set/s':>12} "
+                          f"{'get/s':>12}")
+        try:
+            self.run(backends, options, value)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, backends, options, value):
+        for processes in (int(n) for n in options['processes'].split(',')):
+            for name, location in backends:
+                jobs = [(name, location, options['ops'], value, worker)
+                        for worker in range(processes)]
+                if processes == 1:
+                    results = [_worker(jobs[0])]
+                else:
+                    with multiprocessing.get_context('fork').Pool(
+                            processes) as pool:
+                        results = pool.map(_worker, jobs)
+                # Aggregate throughput across all processes.
+                sets = sum(r[0] for r in results)
+                gets = sum(r[1] for r in results)
+                self.stdout.write(
+                    f"{name:<8} {processes:>5} {sets:>12,.0f} {gets:>12,.0f}")
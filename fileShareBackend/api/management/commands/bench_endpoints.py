@@ -0,0 +1,429 @@
+import base64
+import json
+import os
+import random
+import statistics
+from contextlib import ExitStack
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.benchmarks import benchmark_database, measure
+from api.models import EncryptedFile, FileShare, PublicLink
+from api.revocation import revocation_list
+from api.routers import BLOB_DATABASE, read_only_alias
+from api.urls import urlpatterns
+from api.utlis import SEGMENT_SIZE
+from api.views import _create_file_from_stream
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'bench_baseline.json'
+BATCH_SIZE = 5000
+PASSWORD = 'bench-password'
+# Payload size of the files uploaded and downloaded by the scenarios.
+FILE_SIZE = SEGMENT_SIZE
+# Absolute slack on top of the relative tolerances, so endpoints that take a
+# millisecond or allocate a few KiB do not fail on noise.
+WALL_SLACK_MS = 5
+MEMORY_SLACK_KB = 64
+
+
+def seed(users, files, shares, rng):
+    """
+    Bulk-insert `users` users, `files` metadata-only files spread across them
+    and about `shares` FileShare rows, plus a 'bench' user and a 'benchadmin'
+    superuser to make requests as. Returns (bench user, admin).
+    """
+    password = make_password(PASSWORD)  # hash once, Argon2 is slow
+    bench = User.objects.create(username='bench',
+                                email='bench@example.com',
+                                password=password)
+    admin = User.objects.create(username='benchadmin',
+                                password=password,
+                                is_staff=True,
+                                is_superuser=True)
+    for start in range(0, users, BATCH_SIZE):
+        User.objects.bulk_create(
+            User(username=f'user{i}',
+                 email=f'user{i}@example.com',
+                 password=password)
+            for i in range(start, min(start + BATCH_SIZE, users)))
+    user_ids = list(
+        User.objects.exclude(pk=admin.pk).values_list('pk', flat=True))
+
+    for start in range(0, files, BATCH_SIZE):
+        EncryptedFile.objects.bulk_create(
+            EncryptedFile(owner_id=rng.choice(user_ids),
+                          file_name=f'file{i}.pdf',
+                          iv=base64.b64encode(os.urandom(12)).decode(),
+                          storage_format='segments',
+                          size_bytes=rng.randrange(1, 100 * SEGMENT_SIZE))
+            for i in range(start, min(start + BATCH_SIZE, files)))
+
+    per_file = min(shares // max(files, 1), len(user_ids))
+    batch = []
+    for file_id in EncryptedFile.objects.values_list('pk',
+                                                     flat=True).iterator():
+        batch.extend(
+            FileShare(file_id=file_id, user_id=user_id)
+            for user_id in rng.sample(user_ids, per_file))
+        if len(batch) >= BATCH_SIZE:
+            FileShare.objects.bulk_create(batch)
+            batch = []
+    FileShare.objects.bulk_create(batch)
+    return bench, admin
+
+
+def authenticated_client(user):
+    client = Client()
+    client.cookies['access_token'] = str(
+        RefreshToken.for_user(user).access_token)
+    return client
+
+
+def build_scenarios(bench, admin):
+    """
+    Map every named URL in api/urls.py to a factory. A factory performs any
+    untimed setup and returns the zero-argument request that is measured.
+    """
+    client = authenticated_client(bench)
+    admin_client = authenticated_client(admin)
+    anonymous = Client()
+    content = os.urandom(FILE_SIZE)
+    iv = base64.b64encode(os.urandom(12)).decode()
+    salt = base64.b64encode(os.urandom(16)).decode()
+    owned = _create_file_from_stream(bench, 'bench.pdf', iv, salt, [content])
+    share_targets = list(
+        User.objects.exclude(pk__in=[bench.pk, admin.pk]).values_list(
+            'username', flat=True)[:3])
+    multipart_body = encode_multipart(
+        BOUNDARY, {
+            'file': SimpleUploadedFile('bench.pdf', content),
+            'iv': iv,
+            'salt': salt,
+        })
+    registrations = iter(range(10**9))
+
+    def new_session(size=FILE_SIZE):
+        return client.post(reverse('upload-session-create'), {
+            'file_name': 'bench.pdf',
+            'iv': iv,
+            'salt': salt,
+            'size': size
+        },
+                           content_type='application/json').json()['session_id']
+
+    def new_public_token():
+        return PublicLink.create_for(owned)[1]
+
+    def complete():
+        session_id = new_session()
+        client.put(reverse('upload-chunk', args=[session_id, 0]),
+                   content,
+                   content_type='application/octet-stream')
+        return lambda: client.post(
+            reverse('upload-session-complete', args=[session_id]))
+
+    def public_file():
+        token = new_public_token()
+        return lambda: anonymous.get(reverse('public-file', args=[token]))
+
+    def revoke():
+        token = new_public_token()
+        return lambda: client.post(
+            reverse('revoke-public-link', args=[token]))
+
+    def public_metadata():
+        token = new_public_token()
+        return lambda: anonymous.get(reverse('public-metadata', args=[token]))
+
+    def token_refresh():
+        # Refresh tokens are single use, so every run gets its own.
+        refreshing = Client()
+        refreshing.cookies['refresh_token'] = str(RefreshToken.for_user(bench))
+        return lambda: refreshing.post(reverse('token-refresh'))
+
+    def upload_session():
+        session_id = new_session()
+        return lambda: client.get(reverse('upload-session', args=[session_id]))
+
+    def upload_chunk():
+        session_id = new_session()
+        return lambda: client.put(reverse('upload-chunk',
+                                          args=[session_id, 0]),
+                                  content,
+                                  content_type='application/octet-stream')
+
+    def upload_part():
+        session_id = new_session()
+        return lambda: client.put(reverse('upload-part',
+                                          args=[session_id, 0]),
+                                  content,
+                                  content_type='application/octet-stream')
+
+    return {
+        'login':
+        lambda: lambda: anonymous.post(reverse('login'), {
+            'username': 'bench',
+            'password': PASSWORD
+        }),
+        'admin-login':
+        lambda: lambda: anonymous.post(reverse('admin-login'), {
+            'username': 'benchadmin',
+            'password': PASSWORD
+        }),
+        'admin-files':
+        lambda: lambda: admin_client.get(reverse('admin-files')),
+        'register':
+        lambda: lambda: anonymous.post(
+            reverse('register'), {
+                'username': f'registered{next(registrations)}',
+                'password': PASSWORD,
+                'email': 'registered@example.com'
+            }),
+        'profile':
+        lambda: lambda: client.get(reverse('profile')),
+        # Logout clears the auth cookies, so it gets a client of its own.
+        'logout':
+        lambda: lambda: authenticated_client(bench).get(reverse('logout')),
+        'token-refresh':
+        token_refresh,
+        'upload':
+        lambda: lambda: client.generic('POST',
+                                       reverse('upload'),
+                                       multipart_body,
+                                       content_type=MULTIPART_CONTENT),
+        'upload-raw':
+        lambda: lambda: client.generic('PUT',
+                                       reverse('upload-raw'),
+                                       content,
+                                       content_type='application/octet-stream',
+                                       HTTP_X_FILE_NAME='bench.pdf',
+                                       HTTP_X_FILE_IV=iv,
+                                       HTTP_X_FILE_SALT=salt),
+        'upload-session-create':
+        lambda: lambda: client.post(reverse('upload-session-create'), {
+            'file_name': 'bench.pdf',
+            'iv': iv,
+            'salt': salt,
+            'size': FILE_SIZE
+        },
+                                    content_type='application/json'),
+        'upload-session':
+        upload_session,
+        'upload-chunk':
+        upload_chunk,
+        'upload-part':
+        upload_part,
+        'upload-session-complete':
+        complete,
+        'allFiles':
+        lambda: lambda: client.get(reverse('allFiles')),
+        'filesView':
+        lambda: lambda: client.get(reverse('filesView', args=[owned.pk])),
+        'file-metadata':
+        lambda: lambda: client.get(reverse('file-metadata', args=[owned.pk])),
+        'generate-public-link':
+        lambda: lambda: client.post(
+            reverse('generate-public-link', args=[owned.pk])),
+        'public-file':
+        public_file,
+        'public-metadata':
+        public_metadata,
+        'revoke-public-link':
+        revoke,
+        'share-file':
+        lambda: lambda: client.post(
+            reverse('share-file', args=[owned.pk]), {
+                'shares': [{
+                    'user': username,
+                    'access_type': 'view'
+                } for username in share_targets]
+            },
+            content_type='application/json'),
+        'share-files':
+        lambda: lambda: client.post(
+            reverse('share-files'), {
+                'files': [owned.pk],
+                'shares': [{
+                    'user': username,
+                    'access_type': 'download'
+                } for username in share_targets]
+            },
+            content_type='application/json'),
+    }
+
+
+def unthrottled(rate_limits):
+    """
+    `rate_limits` raised so far that repeated runs never hit them, while the
+    buckets are still checked and their cost measured.
+    """
+    return {
+        endpoint: {kind: '1000000000/s'
+                   for kind in limits}
+        for endpoint, limits in rate_limits.items()
+    }
+
+
+def run_scenario(factory, repeat=1, trace_memory=True):
+    """
+    Run one scenario `repeat` times. Returns the worst query count, the median
+    wall time in ms and, when `trace_memory` is set, the peak traced memory in
+    KiB of one extra run (tracing is kept out of the timed runs).
+    """
+    queries, walls = 0, []
+
+    def call(trace):
+        request = factory()
+        # Workers pick up revocations every few seconds, not per request.
+        revocation_list.sync(force=True)
+        with ExitStack() as stack:
+            # Read-only views and payloads use their own connections.
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in {DEFAULT_DB_ALIAS,
+                              read_only_alias(), BLOB_DATABASE}
+            ]
+            result = stack.enter_context(measure(trace_memory=trace))
+            response = request()
+            # Streamed downloads do their work while being consumed.
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+        if response.status_code >= 400:
+            raise CommandError(
+                f"{response.wsgi_request.path} returned "
+                f"{response.status_code}: "
+                f"{getattr(response, 'content', b'')[:200]!r}")
+        return sum(len(queries) for queries in captured), result
+
+    for _ in range(repeat):
+        count, result = call(False)
+        queries = max(queries, count)
+        walls.append(result['wall'] * 1000)
+    result = {'queries': queries, 'wall_ms': round(statistics.median(walls), 2)}
+    if trace_memory:
+        result['peak_kb'] = round(call(True)[1]['peak_memory'] / 1024, 1)
+    return result
+
+
+def over_budget(result, budget, time_tolerance, memory_tolerance):
+    """
+    Return a description of every metric in `result` exceeding `budget`.
+    """
+    failures = []
+    if result['queries'] > budget['queries']:
+        failures.append(f"{result['queries']} queries > {budget['queries']}")
+    if 'wall_ms' in budget:
+        limit = budget['wall_ms'] * time_tolerance + WALL_SLACK_MS
+        if result['wall_ms'] > limit:
+            failures.append(f"{result['wall_ms']} ms > {limit:.1f} ms")
+    if 'peak_kb' in budget and 'peak_kb' in result:
+        limit = budget['peak_kb'] * memory_tolerance + MEMORY_SLACK_KB
+        if result['peak_kb'] > limit:
+            failures.append(f"{result['peak_kb']} KiB > {limit:.1f} KiB")
+    return failures
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway database at realistic volume, then record the "
+            "query count, wall time and peak memory of a request to every "
+            "endpoint in api/urls.py and check them against a stored "
+            "baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--files', type=int, default=100000)
+        parser.add_argument('--shares', type=int, default=1000000)
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=5,
+                            help="Timed runs per endpoint; the median is kept.")
+        parser.add_argument('--baseline',
+                            default=str(DEFAULT_BASELINE),
+                            help="JSON file holding the per-endpoint budgets.")
+        parser.add_argument('--update-baseline',
+                            action='store_true',
+                            help="Write the results as the new baseline.")
+        parser.add_argument('--time-tolerance',
+                            type=float,
+                            default=2.0,
+                            help="Allowed wall time as a multiple of the "
+                            "baseline.")
+        parser.add_argument('--memory-tolerance',
+                            type=float,
+                            default=1.5,
+                            help="Allowed peak memory as a multiple of the "
+                            "baseline.")
+        parser.add_argument('--only',
+                            nargs='+',
+                            metavar='URL_NAME',
+                            help="Benchmark only these endpoints.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        baseline_path = Path(options['baseline'])
+        baseline = {}
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        elif not options['update_baseline']:
+            raise CommandError(f"No baseline at {baseline_path}; run with "
+                               "--update-baseline first.")
+        volumes = {key: options[key] for key in ('users', 'files', 'shares')}
+        if baseline and baseline.get('volumes') != volumes:
+            self.stderr.write(
+                f"Baseline was recorded at {baseline.get('volumes')}; "
+                "time and memory comparisons may not be meaningful.")
+
+        with benchmark_database(), override_settings(
+                RATE_LIMITS=unthrottled(settings.RATE_LIMITS)):
+            self.stdout.write(f"Seeding {volumes}...")
+            bench, admin = seed(**volumes, rng=random.Random(options['seed']))
+            scenarios = build_scenarios(bench, admin)
+            names = [p.name for p in urlpatterns if p.name]
+            missing = sorted(set(names) - set(scenarios))
+            if missing:
+                raise CommandError(
+                    f"No benchmark scenario for: {', '.join(missing)}")
+            if options['only']:
+                names = [name for name in names if name in options['only']]
+
+            results, failures = {}, []
+            self.stdout.write(f"{'endpoint':<26} {'queries':>7} "
+                              f"{'wall ms':>9} {'peak KiB':>10}")
+            for name in names:
+                result = run_scenario(scenarios[name], options['repeat'])
+                results[name] = result
+                problems = []
+                budget = baseline.get('endpoints', {}).get(name)
+                if budget and not options['update_baseline']:
+                    problems = over_budget(result, budget,
+                                           options['time_tolerance'],
+                                           options['memory_tolerance'])
+                    failures.extend(f"{name}: {p}" for p in problems)
+                self.stdout.write(
+                    f"{name:<26} {result['queries']:>7} "
+                    f"{result['wall_ms']:>9.2f} {result['peak_kb']:>10.1f}"
+                    f"{'  OVER BUDGET' if problems else ''}")
+
+        if options['update_baseline']:
+            endpoints = baseline.get('endpoints', {}) if options['only'] else {}
+            endpoints.update(results)
+            baseline_path.write_text(
+                json.dumps({
+                    'volumes': volumes,
+                    'endpoints': endpoints
+                },
+                           indent=2,
+                           sort_keys=True) + "\n")
+            self.stdout.write(f"Baseline written to {baseline_path}")
+        elif failures:
+            raise CommandError("Budgets exceeded:\n" + "\n".join(failures))
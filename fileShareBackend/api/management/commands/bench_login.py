@@ -0,0 +1,141 @@
+import asyncio
+import socket
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from api.benchmarks import benchmark_database
+from api.management.commands.send_queued_email import deliver_batch
+from api.models import OutboundEmail
+
+try:
+    from aiosmtpd.controller import Controller as SMTPController
+except ImportError:
+    SMTPController = None
+
+PASSWORD = 'bench-password'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class SlowHandler:
+    """
+    aiosmtpd handler that accepts every message after `delay` seconds.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.delay)
+        self.received += 1
+        return "250 OK"
+
+
+class Command(BaseCommand):
+    help = ("Measure MFA login latency under concurrent load while the outbox "
+            "worker delivers the codes to a slow local SMTP stand-in "
+            "(requires aiosmtpd).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--smtp-delay',
+                            type=float,
+                            default=0.5,
+                            help="Seconds the SMTP stand-in takes per message.")
+
+    def handle(self, *args, **options):
+        if SMTPController is None:
+            raise CommandError("bench_login needs aiosmtpd installed.")
+        handler = SlowHandler(options['smtp_delay'])
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        controller = SMTPController(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=port,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False)
+        try:
+            with benchmark_database(), smtp:
+                self.run(options, handler)
+        finally:
+            controller.stop()
+
+    def run(self, options, handler):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            User(username=f'user{i}',
+                 email=f'user{i}@example.com',
+                 password=password) for i in range(options['concurrency']))
+
+        stop = threading.Event()
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    if deliver_batch(100) == (0, 0):
+                        time.sleep(0.05)
+            finally:
+                connection.close()
+
+        def login(i):
+            client = Client()
+            try:
+                started = time.perf_counter()
+                response = client.post(
+                    reverse('login'), {
+                        'username': f'user{i % options["concurrency"]}',
+                        'password': PASSWORD
+                    })
+                elapsed = time.perf_counter() - started
+            finally:
+                connection.close()
+            if response.status_code != 202:
+                raise CommandError(f"Login returned {response.status_code}")
+            return elapsed
+
+        delivery = threading.Thread(target=worker)
+        delivery.start()
+        try:
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                timings = list(pool.map(login, range(options['logins'])))
+            deadline = time.monotonic() + 60 + (options['logins'] *
+                                                options['smtp_delay'])
+            while (OutboundEmail.objects.filter(status='pending').exists()
+                   and time.monotonic() < deadline):
+                time.sleep(0.1)
+        finally:
+            stop.set()
+            delivery.join()
+
+        lags = [(sent_at - created_at).total_seconds()
+                for created_at, sent_at in OutboundEmail.objects.filter(
+                    status='sent').values_list('created_at', 'sent_at')]
+        self.stdout.write(
+            f"{options['logins']} logins, concurrency "
+            f"{options['concurrency']}, SMTP delay {options['smtp_delay']}s")
+        self.stdout.write(
+            f"login latency  p50 {statistics.median(timings) * 1000:8.1f} ms"
+            f"  p99 {percentile(timings, 0.99) * 1000:8.1f} ms")
+        if lags:
+            self.stdout.write(
+                f"delivery lag   p50 {statistics.median(lags) * 1000:8.1f} ms"
+                f"  p99 {percentile(lags, 0.99) * 1000:8.1f} ms")
+        self.stdout.write(f"delivered {handler.received} of "
+                          f"{options['logins']} emails")
@@ -0,0 +1,111 @@
+import json
+import os
+import ssl
+import time
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.models import EncryptedFile
+from api.utlis import SEGMENT_SIZE
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ("Benchmark parallel multi-part uploads against a running server, "
+            "comparing several levels of parallelism.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            default='http://127.0.0.1:8000/api',
+                            help="Base URL of the API.")
+        parser.add_argument('--username',
+                            required=True,
+                            help="Existing user to upload as.")
+        parser.add_argument('--size-mb',
+                            type=int,
+                            default=1024,
+                            help="Size of the test file in MiB.")
+        parser.add_argument('--part-size-mb',
+                            type=int,
+                            default=64,
+                            help="Size of each part in MiB.")
+        parser.add_argument('--parallel',
+                            default='1,4,8',
+                            help="Comma-separated parallelism levels.")
+        parser.add_argument('--insecure',
+                            action='store_true',
+                            help="Skip TLS certificate verification.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+        part_size = options['part_size_mb'] * MB
+        if part_size % SEGMENT_SIZE:
+            raise CommandError(
+                f"Part size must be a multiple of {SEGMENT_SIZE} bytes.")
+
+        self.base_url = options['url'].rstrip('/')
+        self.cookie = f"access_token={RefreshToken.for_user(user).access_token}"
+        self.ssl_context = None
+        if options['insecure']:
+            self.ssl_context = ssl._create_unverified_context()
+
+        size = options['size_mb'] * MB
+        # One part of random data is reused for every part so generating the
+        # payload does not dominate the measurement.
+        payload = os.urandom(part_size)
+
+        self.stdout.write(f"{'parallel':>8} {'seconds':>9} {'MiB/s':>9}")
+        for workers in [int(n) for n in options['parallel'].split(',')]:
+            started = time.perf_counter()
+            file_id = self._upload(size, part_size, payload, workers)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{workers:>8} {elapsed:>9.2f} {size / MB / elapsed:>9.1f}")
+            EncryptedFile.objects.filter(pk=file_id).delete()
+
+    def _upload(self, size, part_size, payload, workers):
+        session = self._call('POST', '/uploads/', {
+            'file_name': 'bench.bin',
+            'iv': base64.b64encode(os.urandom(12)).decode(),
+            'salt': base64.b64encode(os.urandom(16)).decode(),
+            'size': size,
+            'part_size': part_size,
+        })
+
+        def put_part(number):
+            length = min(part_size, size - number * part_size)
+            path = f"/uploads/{session['session_id']}/parts/{number}/"
+            result = self._call('PUT',
+                                path,
+                                payload[:length],
+                                content_type='application/octet-stream')
+            return {'part': number, 'etag': result['etag']}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            manifest = list(
+                executor.map(put_part, range(session['part_count'])))
+
+        result = self._call('POST',
+                            f"/uploads/{session['session_id']}/complete/",
+                            {'parts': manifest})
+        return result['file_id']
+
+    def _call(self, method, path, body, content_type='application/json'):
+        if content_type == 'application/json':
+            body = json.dumps(body).encode()
+        request = Request(self.base_url + path,
+                          data=body,
+                          method=method,
+                          headers={
+                              'Content-Type': content_type,
+                              'Cookie': self.cookie,
+                          })
+        with urlopen(request, context=self.ssl_context) as response:
+            return json.loads(response.read())
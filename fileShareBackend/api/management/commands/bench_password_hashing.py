@@ -0,0 +1,81 @@
+import os
+import statistics
+import threading
+import time
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from api.hashers import PasswordHashingBusy, password_executor
+from api.utlis import SEGMENT_SIZE
+
+
+class Command(BaseCommand):
+    help = ("Run a burst of concurrent password checks next to download "
+            "threads decrypting segments, with Argon2 unbounded and with the "
+            "configured PASSWORD_HASHING limits, and report download latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins',
+                            type=int,
+                            default=16,
+                            help="Threads checking passwords.")
+        parser.add_argument('--downloads',
+                            type=int,
+                            default=2,
+                            help="Threads decrypting segments.")
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        encoded = make_password('bench-password')
+        self.stdout.write(f"{'argon2':<10} {'logins/s':>9} {'rejected':>9} "
+                          f"{'max queued':>10} {'dl p50 ms':>10} "
+                          f"{'dl p99 ms':>10}")
+        unbounded = {**settings.PASSWORD_HASHING,
+                     'MAX_WORKERS': options['logins'], 'QUEUE_SIZE': 0}
+        for label, limits in (('unbounded', unbounded),
+                              ('bounded', settings.PASSWORD_HASHING)):
+            with override_settings(PASSWORD_HASHING=limits):
+                self.run(label, encoded, options)
+
+    def run(self, label, encoded, options):
+        password_executor.reset_stats()
+        key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(12)
+        segment = AESGCM(key).encrypt(nonce, os.urandom(SEGMENT_SIZE), None)
+        done = threading.Event()
+        downloads = []
+
+        def login():
+            while not done.is_set():
+                try:
+                    check_password('bench-password', encoded)
+                except PasswordHashingBusy:
+                    time.sleep(0.05)  # the client backing off
+
+        def download():
+            cipher = AESGCM(key)
+            while not done.is_set():
+                started = time.perf_counter()
+                cipher.decrypt(nonce, segment, None)
+                downloads.append(time.perf_counter() - started)
+
+        threads = ([threading.Thread(target=login)
+                    for _ in range(options['logins'])] +
+                   [threading.Thread(target=download)
+                    for _ in range(options['downloads'])])
+        for thread in threads:
+            thread.start()
+        time.sleep(options['seconds'])
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        stats = password_executor.stats()
+        downloads.sort()
+        self.stdout.write(
+            f"{label:<10} {stats['completed'] / options['seconds']:>9.1f} "
+            f"{stats['rejected']:>9} {stats['max_queued']:>10} "
+            f"{statistics.median(downloads) * 1000:>10.2f} "
+            f"{downloads[int(len(downloads) * 0.99)] * 1000:>10.2f}")
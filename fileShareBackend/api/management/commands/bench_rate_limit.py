@@ -0,0 +1,77 @@
+import statistics
+import time
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import resolve, reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api.benchmarks import benchmark_database
+from api.throttling import RateLimit
+from api.views import LoginView
+
+# Limits that reject every request after the first.
+EXHAUSTED = {'login': {'ip': '1/d', 'username': '1/d'}}
+
+
+class Command(BaseCommand):
+    help = ("Time rate-limit decisions and compare a rejected login with one "
+            "that reaches password hashing.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests',
+                            type=int,
+                            default=2000,
+                            help="Rejected requests and decisions timed.")
+        parser.add_argument('--hashed',
+                            type=int,
+                            default=20,
+                            help="Logins timed without a limit.")
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = LoginView.as_view()
+
+        def login():
+            request = factory.post(reverse('login'), {
+                'username': 'bench',
+                'password': 'wrong'
+            },
+                                   format='json')
+            request.resolver_match = resolve(request.path)
+            return view(request)
+
+        self.stdout.write(f"{'case':<28} {'status':>6} {'p50 us':>10} "
+                          f"{'p99 us':>10}")
+        with benchmark_database():
+            cache.clear()
+            with override_settings(RATE_LIMITS={}):
+                self.report('login, no limit', login, options['hashed'])
+            with override_settings(RATE_LIMITS=EXHAUSTED):
+                login()  # takes the only token
+                self.report('login, rejected', login, options['requests'])
+
+                request = factory.post(reverse('login'), {'username': 'bench'},
+                                       format='json')
+                request.resolver_match = resolve(request.path)
+                drf_request = Request(request)
+                throttle = RateLimit()
+
+                def decide():
+                    return throttle.allow_request(drf_request, LoginView())
+
+                self.report('RateLimit.allow_request', decide,
+                            options['requests'])
+
+    def report(self, case, call, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = call()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        outcome = getattr(result, 'status_code', result)
+        self.stdout.write(
+            f"{case:<28} {str(outcome):>6} "
+            f"{statistics.median(timings) * 1e6:>10.0f} "
+            f"{timings[int(len(timings) * 0.99)] * 1e6:>10.0f}")
@@ -0,0 +1,83 @@
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.authentication import CookieJWTAuthentication
+from api.benchmarks import benchmark_database
+from api.models import RevokedToken
+from api.revocation import revocation_list
+
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ("Measure the cost of the token revocation check: loading the "
+            "revocation list, its memory, and the time cookie JWT "
+            "authentication takes with no and with many revoked tokens.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revoked',
+                            type=int,
+                            default=1000000,
+                            help="Revoked tokens to load.")
+        parser.add_argument('--requests',
+                            type=int,
+                            default=20000,
+                            help="Authentications timed per configuration.")
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            cache.clear()
+            user = User.objects.create_user(username='bench', password='bench')
+            request = RequestFactory().get('/')
+            request.COOKIES['access_token'] = str(
+                RefreshToken.for_user(user).access_token)
+            authenticator = CookieJWTAuthentication()
+
+            self.stdout.write(f"{'revoked':>9} {'auth us':>9} {'check ns':>9} "
+                              f"{'queries':>8}")
+            revocation_list.clear()
+            self.run(0, authenticator, request, options['requests'])
+
+            expires_at = timezone.now() + timedelta(days=1)
+            for start in range(0, options['revoked'], BATCH_SIZE):
+                RevokedToken.objects.bulk_create(
+                    RevokedToken(jti=uuid.uuid4().hex, expires_at=expires_at)
+                    for _ in range(min(BATCH_SIZE,
+                                       options['revoked'] - start)))
+            revocation_list.clear()
+            tracemalloc.start()
+            started = time.perf_counter()
+            revocation_list.sync(force=True)
+            loaded = time.perf_counter() - started
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.run(len(revocation_list), authenticator, request,
+                     options['requests'])
+            self.stdout.write(
+                f"Loading {len(revocation_list):,} revoked tokens took "
+                f"{loaded:.2f} s and {memory / 1024 / 1024:.0f} MiB")
+
+    def run(self, revoked, authenticator, request, requests):
+        authenticator.authenticate(request)  # load the list, cache the user
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                user, _token = authenticator.authenticate(request)
+            auth = (time.perf_counter() - started) / requests
+        missing = uuid.uuid4().hex
+        started = time.perf_counter()
+        for _ in range(requests):
+            revocation_list.is_revoked(missing)
+        check = (time.perf_counter() - started) / requests
+        self.stdout.write(f"{revoked:>9,} {auth * 1e6:>9.1f} "
+                          f"{check * 1e9:>9.0f} "
+                          f"{len(queries) / requests:>8.1f}")
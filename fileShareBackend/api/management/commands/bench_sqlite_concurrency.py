@@ -0,0 +1,135 @@
+import base64
+import os
+import random
+import statistics
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+from django.test import override_settings
+from api.benchmarks import benchmark_database
+from api.models import EncryptedFile, PublicLink
+from api.routers import read_only
+from api.utlis import SEGMENT_SIZE
+from api.views import _create_file_from_stream
+
+MB = 1024 * 1024
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Time file-list reads on the read-only connection and metadata "
+            "writes while one large upload is written and committed, in WAL "
+            "mode and with the rollback journal for comparison.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb',
+                            type=int,
+                            default=500,
+                            help="Size of the upload in MiB.")
+        parser.add_argument('--readers',
+                            type=int,
+                            default=4,
+                            help="Concurrent reader threads.")
+        parser.add_argument('--writers',
+                            type=int,
+                            default=1,
+                            help="Concurrent threads generating public links.")
+        parser.add_argument('--files',
+                            type=int,
+                            default=1000,
+                            help="Files in the listing the readers page.")
+        parser.add_argument('--journal-modes',
+                            default='wal,delete',
+                            help="Comma-separated journal modes to compare.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{options['size_mb']} MiB upload, "
+                          f"{options['readers']} readers, "
+                          f"{options['writers']} metadata writers")
+        self.stdout.write(f"{'journal':<8} {'op':<6} {'count':>7} "
+                          f"{'per s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+                          f"{'max ms':>8} {'errors':>7}")
+        for mode in options['journal_modes'].split(','):
+            pragmas = {**settings.SQLITE_PRAGMAS, 'journal_mode': mode.upper()}
+            with override_settings(SQLITE_PRAGMAS=pragmas), \
+                    benchmark_database():
+                self.run(mode, options)
+
+    def run(self, mode, options):
+        owner = User.objects.create_user(username='bench', password='bench')
+        EncryptedFile.objects.bulk_create(
+            EncryptedFile(owner=owner, file_name=f'bench{i}.pdf', iv='iv')
+            for i in range(options['files']))
+        files = list(EncryptedFile.objects.filter(owner=owner))
+
+        done = threading.Event()
+        timings = {'read': [], 'write': []}
+        errors = {'read': [], 'write': []}
+
+        def timed(op, call):
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        call()
+                    except OperationalError as exc:
+                        errors[op].append(exc)
+                    else:
+                        timings[op].append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+
+        def read():
+            with read_only():
+                list(
+                    EncryptedFile.objects.filter(owner=owner).order_by(
+                        '-uploaded_at', '-id').values('id', 'file_name')[:50])
+
+        def write():
+            # What GeneratePublicLinkView does.
+            PublicLink.create_for(random.choice(files))
+
+        # One segment of random data is reused so generating the payload
+        # does not dominate the measurement.
+        segment = os.urandom(SEGMENT_SIZE)
+        chunks = (segment
+                  for _ in range(options['size_mb'] * MB // SEGMENT_SIZE))
+
+        threads = [
+            threading.Thread(target=timed, args=('read', read))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=timed, args=('write', write))
+            for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        started = time.perf_counter()
+        try:
+            _create_file_from_stream(owner, 'upload.bin',
+                                     base64.b64encode(os.urandom(12)).decode(),
+                                     base64.b64encode(os.urandom(16)).decode(),
+                                     chunks)
+            upload = time.perf_counter() - started
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(f"{mode:<8} upload took {upload:.2f} s")
+        for op in ('read', 'write'):
+            values = timings[op]
+            p50 = statistics.median(values) * 1000 if values else 0
+            p99 = percentile(values, 0.99) * 1000 if values else 0
+            worst = max(values) * 1000 if values else 0
+            self.stdout.write(
+                f"{mode:<8} {op:<6} {len(values):>7} "
+                f"{len(values) / upload:>8.0f} {p50:>8.1f} {p99:>8.1f} "
+                f"{worst:>8.1f} {len(errors[op]):>7}")
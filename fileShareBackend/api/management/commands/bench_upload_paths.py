@@ -0,0 +1,76 @@
+import base64
+import os
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.benchmarks import benchmark_database, measure
+
+MB = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ("Compare CPU cost per GiB of the multipart upload path against "
+            "the raw-body streaming upload path.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb',
+                            type=int,
+                            default=256,
+                            help="Size of the uploaded file in MiB.")
+        parser.add_argument('--repeat',
+                            type=int,
+                            default=3,
+                            help="Uploads per path; the best run is kept.")
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * MB
+        content = os.urandom(size)
+        iv = base64.b64encode(os.urandom(12)).decode()
+        salt = base64.b64encode(os.urandom(16)).decode()
+
+        # Request bodies are built up front so only server-side work is timed.
+        multipart_body = encode_multipart(
+            BOUNDARY, {
+                'file': SimpleUploadedFile('bench.bin', content),
+                'iv': iv,
+                'salt': salt,
+            })
+
+        with benchmark_database():
+            user = User.objects.create_user(username='bench', password='bench')
+            client = Client()
+            client.cookies['access_token'] = str(
+                RefreshToken.for_user(user).access_token)
+
+            def multipart():
+                return client.generic('POST',
+                                      reverse('upload'),
+                                      multipart_body,
+                                      content_type=MULTIPART_CONTENT)
+
+            def raw():
+                return client.generic('PUT',
+                                      reverse('upload-raw'),
+                                      content,
+                                      content_type='application/octet-stream',
+                                      HTTP_X_FILE_NAME='bench.bin',
+                                      HTTP_X_FILE_IV=iv,
+                                      HTTP_X_FILE_SALT=salt)
+
+            self.stdout.write(
+                f"{'path':<10} {'cpu s':>8} {'wall s':>8} {'cpu s/GiB':>10}")
+            for name, upload in (('multipart', multipart), ('raw', raw)):
+                runs = []
+                for _ in range(options['repeat']):
+                    with measure(trace_memory=False) as result:
+                        response = upload()
+                    assert response.status_code == 201, response.content
+                    runs.append(result)
+                best = min(runs, key=lambda run: run['cpu'])
+                per_gib = best['cpu'] * 1024 / options['size_mb']
+                self.stdout.write(f"{name:<10} {best['cpu']:>8.2f} "
+                                  f"{best['wall']:>8.2f} {per_gib:>10.2f}")
@@ -0,0 +1,81 @@
+import os
+import statistics
+import time
+import argon2
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+KIB_PER_MIB = 1024
+
+
+class Command(BaseCommand):
+    help = ("Find the Argon2 memory and time costs whose hash takes about the "
+            "target latency on this host, and print the ARGON2 setting.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms',
+                            type=float,
+                            default=250,
+                            help="Latency one hash should take.")
+        parser.add_argument('--max-memory-mib',
+                            type=int,
+                            default=settings.ARGON2['MEMORY_COST'] //
+                            KIB_PER_MIB,
+                            help="Memory cost to start from.")
+        parser.add_argument('--min-memory-mib',
+                            type=int,
+                            default=19,
+                            help="Lowest memory cost to fall back to.")
+        parser.add_argument('--parallelism',
+                            type=int,
+                            default=settings.ARGON2['PARALLELISM'])
+        parser.add_argument('--samples',
+                            type=int,
+                            default=3,
+                            help="Hashes timed per candidate; the median is "
+                            "kept.")
+
+    def handle(self, *args, **options):
+        target = options['target_ms'] / 1000
+        parallelism = options['parallelism']
+        password = os.urandom(16).hex()
+
+        def measure(time_cost, memory_mib):
+            hasher = argon2.PasswordHasher(time_cost=time_cost,
+                                           memory_cost=memory_mib *
+                                           KIB_PER_MIB,
+                                           parallelism=parallelism)
+            timings = []
+            for _ in range(options['samples']):
+                started = time.perf_counter()
+                hasher.hash(password)
+                timings.append(time.perf_counter() - started)
+            latency = statistics.median(timings)
+            self.stdout.write(f"time_cost={time_cost} memory={memory_mib} MiB "
+                              f"parallelism={parallelism}: "
+                              f"{latency * 1000:.1f} ms")
+            return latency
+
+        # Memory hardness matters most, so memory is only lowered when a
+        # single pass over the maximum already takes longer than the target;
+        # the remaining budget goes to more passes.
+        memory_mib = options['max_memory_mib']
+        latency = measure(1, memory_mib)
+        while latency > target and memory_mib > options['min_memory_mib']:
+            memory_mib = max(options['min_memory_mib'], memory_mib // 2)
+            latency = measure(1, memory_mib)
+        time_cost = 1
+        while latency <= target:
+            next_latency = measure(time_cost + 1, memory_mib)
+            if next_latency > target:
+                break
+            time_cost, latency = time_cost + 1, next_latency
+
+        self.stdout.write(
+            f"\nHashes take about {latency * 1000:.0f} ms. Set in "
+            f"settings.py:\n"
+            f"ARGON2 = {{\n"
+            f"    \"TIME_COST\": {time_cost},\n"
+            f"    \"MEMORY_COST\": {memory_mib * KIB_PER_MIB},  # KiB\n"
+            f"    \"PARALLELISM\": {parallelism},\n"
+            f"}}")
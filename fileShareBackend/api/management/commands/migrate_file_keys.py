@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from api.models import EncryptedFile
+from api.utlis import current_key_version
+
+
+class Command(BaseCommand):
+    help = ("Re-encrypt files that still use salt-derived or outdated keys "
+            "under per-file data keys wrapped with the current master key.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit',
+                            type=int,
+                            default=None,
+                            help="Maximum number of files to migrate.")
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            help="Only report how many files need migrating.")
+
+    def handle(self, *args, **options):
+        pending = EncryptedFile.objects.exclude(
+            key_version=current_key_version()).exclude(
+                storage_format='passthrough').order_by('pk').values_list(
+                    'pk', flat=True)
+        if options['limit'] is not None:
+            pending = pending[:options['limit']]
+        pending = list(pending)
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(pending)} file(s) need migrating.")
+            return
+
+        migrated = 0
+        failed = 0
+        # Load one file at a time so only a single payload is in memory.
+        for pk in pending:
+            file_instance = EncryptedFile.objects.get(pk=pk)
+            try:
+                file_instance.rekey()
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"File {pk}: {e}")
+                continue
+            migrated += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Migrated {migrated} file(s), {failed} failed."))
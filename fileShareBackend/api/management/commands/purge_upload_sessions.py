@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from api.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete expired resumable upload sessions and their chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=100,
+                            help="Sessions deleted per batch.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            deleted = UploadSession.purge_expired(limit=options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+        self.stdout.write(
+            self.style.SUCCESS(f"Deleted {total} expired upload session(s)."))
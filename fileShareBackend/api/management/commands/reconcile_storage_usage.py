@@ -0,0 +1,83 @@
+import hashlib
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.core.management.base import BaseCommand
+from api.models import EncryptedFile, StorageUsage
+
+
+def reconcile_user(user_id):
+    """
+    Recompute one user's usage from their stored files and correct the
+    StorageUsage row if it has drifted. Counting and correcting happen in
+    one transaction, so no upload can commit in between. Returns the
+    (bytes, files) drift that was corrected.
+    """
+    with transaction.atomic():
+        actual = EncryptedFile.objects.filter(owner_id=user_id).exclude(
+            storage_format='pending').aggregate(bytes_used=Sum('size_bytes'),
+                                                file_count=Count('id'))
+        bytes_used = actual['bytes_used'] or 0
+        file_count = actual['file_count']
+        usage, created = StorageUsage.objects.get_or_create(
+            user_id=user_id,
+            defaults={
+                'bytes_used': bytes_used,
+                'file_count': file_count
+            })
+        if created:
+            return bytes_used, file_count
+        drift = (bytes_used - usage.bytes_used, file_count - usage.file_count)
+        if drift != (0, 0):
+            usage.bytes_used = bytes_used
+            usage.file_count = file_count
+            usage.save(update_fields=['bytes_used', 'file_count'])
+        return drift
+
+
+def fill_missing_digests():
+    """
+    Compute the SHA-256 of stored files that have none by reading them back.
+    Returns the number of files updated.
+    """
+    updated = 0
+    missing = EncryptedFile.objects.filter(sha256='').exclude(
+        storage_format='pending')
+    for pk in missing.values_list('pk', flat=True).iterator():
+        encrypted_file = EncryptedFile.objects.get(pk=pk)
+        digest = hashlib.sha256()
+        for data in encrypted_file.iter_plaintext():
+            digest.update(data)
+        updated += EncryptedFile.objects.filter(pk=pk, sha256='').update(
+            sha256=digest.hexdigest())
+    return updated
+
+
+class Command(BaseCommand):
+    help = ("Recompute every user's storage usage from their files and fix "
+            "any drift in the running totals.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--digests',
+                            action='store_true',
+                            help="Also compute the missing SHA-256 of files "
+                            "stored before digests were recorded. Reads every "
+                            "such file in full.")
+
+    def handle(self, *args, **options):
+        owners = set(
+            EncryptedFile.objects.values_list('owner_id',
+                                              flat=True).distinct())
+        owners |= set(StorageUsage.objects.values_list('user_id', flat=True))
+        fixed = 0
+        for user_id in sorted(owners):
+            drift = reconcile_user(user_id)
+            if drift != (0, 0):
+                fixed += 1
+                self.stdout.write(f"user {user_id}: {drift[0]:+} byte(s), "
+                                  f"{drift[1]:+} file(s)")
+        self.stdout.write(
+            self.style.SUCCESS(f"Corrected the usage of {fixed} of "
+                               f"{len(owners)} user(s)."))
+        if options['digests']:
+            self.stdout.write(f"Computed {fill_missing_digests()} missing "
+                              "digest(s).")
@@ -0,0 +1,50 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.maintenance import run_maintenance
+
+
+class Command(BaseCommand):
+    help = ("Delete expired public links, revoked tokens and upload sessions, "
+            "abandoned uploads and orphaned blobs in small batches, then hand "
+            "the freed SQLite pages back to the filesystem.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=settings.MAINTENANCE['BATCH_SIZE'],
+                            help="Rows deleted per transaction.")
+        parser.add_argument('--vacuum',
+                            action='store_true',
+                            help="Run a full VACUUM, which holds the write "
+                            "lock until done. Needed once to switch a database "
+                            "created before auto_vacuum was set to "
+                            "incremental reclaiming.")
+        parser.add_argument('--loop',
+                            action='store_true',
+                            help="Sweep again every MAINTENANCE['INTERVAL'] "
+                            "seconds instead of exiting.")
+
+    def handle(self, *args, **options):
+        while True:
+            counts, space = run_maintenance(full_vacuum=options['vacuum'],
+                                            batch_size=options['batch_size'])
+            self.report(counts, space)
+            if not options['loop']:
+                break
+            time.sleep(settings.MAINTENANCE['INTERVAL'])
+
+    def report(self, counts, space):
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count} row(s) deleted")
+        for alias, (reclaimed, free) in space.items():
+            line = f"{alias}: {reclaimed} byte(s) reclaimed"
+            if free:
+                line += (f", {free} byte(s) still free; run with --vacuum "
+                         "to reclaim them")
+            self.stdout.write(line)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {sum(counts.values())} row(s), reclaimed "
+                f"{sum(reclaimed for reclaimed, _ in space.values())} "
+                "byte(s)."))
@@ -0,0 +1,97 @@
+import time
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api.models import OutboundEmail
+
+
+def deliver_batch(batch_size):
+    """
+    Claim up to `batch_size` due emails and send them over a single SMTP
+    connection. Emails that went stale while waiting are deleted unsent.
+    Returns (sent, failed) counts.
+    """
+    config = settings.EMAIL_OUTBOX
+    emails = OutboundEmail.claim_batch(batch_size, config['CLAIM_TIMEOUT'])
+    if not emails:
+        return 0, 0
+
+    def retry_later(email, error):
+        email.retry_later(error, config['MAX_ATTEMPTS'], config['RETRY_DELAY'],
+                          config['MAX_RETRY_DELAY'])
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        for email in emails:
+            retry_later(email, exc)
+        return 0, len(emails)
+
+    sent, stale, failed = [], [], 0
+    try:
+        for i, email in enumerate(emails):
+            if email.is_stale():
+                stale.append(email.pk)
+                continue
+            message = EmailMessage(email.subject,
+                                   email.body,
+                                   email.from_email,
+                                   email.to,
+                                   connection=connection)
+            try:
+                connection.send_messages([message])
+            except Exception as exc:
+                retry_later(email, exc)
+                failed += 1
+                # The server may have dropped the session, so start a new
+                # one for the rest of the batch. Left closed, the backend
+                # would open and close a connection for every message.
+                connection.close()
+                try:
+                    connection.open()
+                except Exception as exc:
+                    for email in emails[i + 1:]:
+                        retry_later(email, exc)
+                    failed += len(emails) - i - 1
+                    break
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+        # Sent messages are not kept: the body may hold a one-time code.
+        OutboundEmail.objects.filter(pk__in=sent).update(status='sent',
+                                                         sent_at=timezone.now(),
+                                                         claim_token='',
+                                                         body='')
+        OutboundEmail.objects.filter(pk__in=stale).delete()
+    return len(sent), failed
+
+
+class Command(BaseCommand):
+    help = ("Deliver queued emails in batches over one reused SMTP connection, "
+            "retrying failures with exponential backoff.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            type=int,
+                            default=settings.EMAIL_OUTBOX['BATCH_SIZE'])
+        parser.add_argument('--loop',
+                            action='store_true',
+                            help="Keep polling for new email instead of "
+                            "exiting once the queue is drained.")
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = deliver_batch(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(settings.EMAIL_OUTBOX['POLL_INTERVAL'])
+        self.stdout.write(f"Sent {total_sent} email(s), {total_failed} "
+                          "failed attempt(s).")
@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.maintenance import sweep_orphan_blobs
+
+
+class Command(BaseCommand):
+    help = ("Delete abandoned pending files and blob rows whose file or upload "
+            "session no longer exists in the metadata database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pending-hours',
+            type=float,
+            default=settings.PENDING_FILE_TTL.total_seconds() / 3600,
+            help="Age after which a pending file counts as abandoned.")
+
+    def handle(self, *args, **options):
+        counts = sweep_orphan_blobs(
+            timedelta(hours=options['pending_hours']))
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count} row(s) deleted")
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_remove_encryptedfile_is_shared_fileshare_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='segment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='storage_format',
+            field=models.CharField(choices=[('blob', 'Single blob'), ('segments', 'Segments')], default='blob', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='FileSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='api.encryptedfile')),
+            ],
+            options={
+                'unique_together': {('file', 'index')},
+            },
+        ),
+    ]
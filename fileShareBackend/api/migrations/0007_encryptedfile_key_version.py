@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_encryptedfile_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='key_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='wrapped_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:03
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Length
+
+# AES-GCM authentication tag appended to every sealed blob or segment.
+TAG_SIZE = 16
+
+
+def fill_size_bytes(apps, schema_editor):
+    EncryptedFile = apps.get_model('api', 'EncryptedFile')
+    FileSegment = apps.get_model('api', 'FileSegment')
+
+    EncryptedFile.objects.filter(storage_format='blob').update(
+        size_bytes=Greatest(Length('file_data') - TAG_SIZE, Value(0)))
+
+    sealed_total = FileSegment.objects.filter(file=OuterRef('pk')).values(
+        'file').annotate(total=Sum(Length('data'))).values('total')
+    EncryptedFile.objects.filter(storage_format='segments').update(
+        size_bytes=Coalesce(Subquery(sealed_total), Value(0)) -
+        TAG_SIZE * models.F('segment_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_encryptedfile_key_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='size_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_size_bytes, migrations.RunPython.noop),
+    ]
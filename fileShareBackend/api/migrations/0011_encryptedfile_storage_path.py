@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_uploadpart'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='storage_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='encryptedfile',
+            name='storage_format',
+            field=models.CharField(choices=[('blob', 'Single blob'), ('segments', 'Segments'), ('passthrough', 'Client ciphertext on disk')], default='blob', max_length=11),
+        ),
+    ]
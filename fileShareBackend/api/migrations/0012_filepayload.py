@@ -0,0 +1,63 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Rows copied per batch, so only a few blobs are held in memory at once.
+BATCH_SIZE = 16
+
+
+def copy_payloads(apps, schema_editor):
+    EncryptedFile = apps.get_model('api', 'EncryptedFile')
+    FilePayload = apps.get_model('api', 'FilePayload')
+
+    last_pk = 0
+    while True:
+        rows = list(
+            EncryptedFile.objects.filter(
+                storage_format='blob',
+                pk__gt=last_pk).order_by('pk').values_list(
+                    'pk', 'file_data')[:BATCH_SIZE])
+        if not rows:
+            return
+        FilePayload.objects.bulk_create(
+            FilePayload(file_id=pk, data=data) for pk, data in rows)
+        last_pk = rows[-1][0]
+
+
+def restore_payloads(apps, schema_editor):
+    EncryptedFile = apps.get_model('api', 'EncryptedFile')
+    FilePayload = apps.get_model('api', 'FilePayload')
+
+    for file_id in FilePayload.objects.values_list('file_id', flat=True):
+        data = FilePayload.objects.values_list('data',
+                                               flat=True).get(file_id=file_id)
+        EncryptedFile.objects.filter(pk=file_id).update(file_data=data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_encryptedfile_storage_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilePayload',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='api.encryptedfile')),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.RunPython(copy_payloads, restore_payloads),
+        # A default lets the column be re-added when migrating backwards.
+        migrations.AlterField(
+            model_name='encryptedfile',
+            name='file_data',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='file_data',
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-18 02:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_filepayload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['owner', 'uploaded_at', 'id'], name='api_encrypt_owner_i_dca6a6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['owner', 'file_name', 'id'], name='api_encrypt_owner_i_771824_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['owner', 'size_bytes', 'id'], name='api_encrypt_owner_i_bb4ec6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileshare',
+            index=models.Index(fields=['user', 'file'], name='api_filesha_user_id_d4d0aa_idx'),
+        ),
+    ]
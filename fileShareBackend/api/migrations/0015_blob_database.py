@@ -0,0 +1,80 @@
+# Generated by Django 5.1.5 on 2026-10-18 03:08
+
+import django.db.models.deletion
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+from api.routers import BLOB_DATABASE
+
+# Rows moved per batch, so only a few blobs are held in memory at once.
+BATCH_SIZE = 16
+BLOB_MODELS = ('FilePayload', 'FileSegment', 'UploadChunk')
+
+
+def _move_rows(model, source, target):
+    """
+    Move every row of `model` from the `source` database to `target` a batch
+    at a time. Each batch is written before it is deleted from `source` and
+    replaces any copy an interrupted earlier run left in `target`.
+    """
+    if model._meta.db_table not in connections[source].introspection.table_names():
+        return
+    while True:
+        rows = list(model.objects.using(source).order_by('pk')[:BATCH_SIZE])
+        if not rows:
+            return
+        pks = [row.pk for row in rows]
+        model.objects.using(target).filter(pk__in=pks).delete()
+        model.objects.using(target).bulk_create(rows)
+        model.objects.using(source).filter(pk__in=pks).delete()
+
+
+def move_blobs(apps, schema_editor):
+    # Runs when the blob database is migrated, after its tables exist.
+    if schema_editor.connection.alias != BLOB_DATABASE:
+        return
+    for name in BLOB_MODELS:
+        _move_rows(apps.get_model('api', name), DEFAULT_DB_ALIAS,
+                   BLOB_DATABASE)
+
+
+def restore_blobs(apps, schema_editor):
+    if schema_editor.connection.alias != BLOB_DATABASE:
+        return
+    for name in BLOB_MODELS:
+        _move_rows(apps.get_model('api', name), BLOB_DATABASE,
+                   DEFAULT_DB_ALIAS)
+
+
+class Migration(migrations.Migration):
+    # Rows are moved between two databases, so each batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ('api', '0014_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='encryptedfile',
+            name='storage_format',
+            field=models.CharField(choices=[('pending', 'Payload still being written'), ('blob', 'Single blob'), ('segments', 'Segments'), ('passthrough', 'Client ciphertext on disk')], default='blob', max_length=11),
+        ),
+        migrations.AlterField(
+            model_name='filepayload',
+            name='file',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='payload', serialize=False, to='api.encryptedfile'),
+        ),
+        migrations.AlterField(
+            model_name='filesegment',
+            name='file',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='segments', to='api.encryptedfile'),
+        ),
+        migrations.AlterField(
+            model_name='uploadchunk',
+            name='session',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='chunks', to='api.uploadsession'),
+        ),
+        # The hint lets the operation run on the blob database.
+        migrations.RunPython(move_blobs,
+                             restore_blobs,
+                             hints={'model_name': 'filesegment'}),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.5 on 2026-10-18 03:45
+
+import hashlib
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_public_tokens(apps, schema_editor):
+    """
+    Turn every file's public token into a single-use PublicLink. Links
+    without an expiry were already unusable and are not copied.
+    """
+    EncryptedFile = apps.get_model('api', 'EncryptedFile')
+    PublicLink = apps.get_model('api', 'PublicLink')
+    db_alias = schema_editor.connection.alias
+
+    files = EncryptedFile.objects.using(db_alias).filter(
+        public_token__isnull=False,
+        public_token_expires__gt=timezone.now()).values_list(
+            'pk', 'public_token', 'public_token_expires')
+    PublicLink.objects.using(db_alias).bulk_create(
+        PublicLink(file_id=pk,
+                   token_hash=hashlib.sha256(token.encode()).hexdigest(),
+                   expires_at=expires,
+                   remaining_downloads=1)
+        for pk, token, expires in files.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.CharField(max_length=64, unique=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('remaining_downloads', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='public_links', to='api.encryptedfile')),
+            ],
+        ),
+        # Only hashes are stored, so going back drops the links.
+        migrations.RunPython(copy_public_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='public_token',
+        ),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='public_token_expires',
+        ),
+    ]
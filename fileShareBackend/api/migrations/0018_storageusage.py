@@ -0,0 +1,51 @@
+# Generated by Django 5.1.5 on 2026-10-18 03:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def count_existing_files(apps, schema_editor):
+    """
+    Start every owner's usage from the files they already store.
+    """
+    EncryptedFile = apps.get_model('api', 'EncryptedFile')
+    StorageUsage = apps.get_model('api', 'StorageUsage')
+    db_alias = schema_editor.connection.alias
+
+    totals = EncryptedFile.objects.using(db_alias).exclude(
+        storage_format='pending').values('owner_id').annotate(
+            bytes_used=Sum('size_bytes'), file_count=Count('id'))
+    StorageUsage.objects.using(db_alias).bulk_create(
+        StorageUsage(user_id=row['owner_id'],
+                     bytes_used=row['bytes_used'],
+                     file_count=row['file_count'])
+        for row in totals.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_publiclink'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.BigIntegerField(default=0)),
+                ('quota_bytes', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(count_existing_files,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 04:17
+
+import api.utlis
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_storageusage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='key_version',
+            field=models.PositiveSmallIntegerField(default=api.utlis.current_key_version),
+        ),
+    ]
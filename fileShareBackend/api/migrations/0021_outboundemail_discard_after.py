@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+def blank_finished_bodies(apps, schema_editor):
+    """
+    Drop the bodies, and the codes in them, of email already sent or given
+    up on.
+    """
+    OutboundEmail = apps.get_model('api', 'OutboundEmail')
+    OutboundEmail.objects.using(schema_editor.connection.alias).filter(
+        status__in=['sent', 'failed']).update(body='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_uploadsession_finalizing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='discard_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(blank_finished_bodies,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_outboundemail_discard_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publiclink',
+            name='resume_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='publiclink',
+            name='resume_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,22 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
 import secrets
+import uuid
 from datetime import timedelta
 from django.utils import timezone
+from django.conf import settings
+import base64
+import hashlib
+import os
+from pathlib import Path
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .routers import BLOB_DATABASE
+from .utlis import (derive_backend_key, decrypt_segments, encrypt_segments,
+                    new_data_key, unwrap_data_key, SegmentCipher,
+                    backend_key_cache, read_exactly, SEGMENT_SIZE,
+                    SEGMENT_TAG_SIZE,
+                    LEGACY_KEY_VERSION, current_key_version)
 
 # Custom User Model
 
@@ -11,6 +25,22 @@ ACCESS_CHOICES = [
     ('download', 'Download'),
 ]
 
+STORAGE_CHOICES = [
+    ('pending', 'Payload still being written'),
+    ('blob', 'Single blob'),
+    ('segments', 'Segments'),
+    ('passthrough', 'Client ciphertext on disk'),
+]
+
+EMAIL_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+]
+
+# Number of segments written or read per database round trip.
+SEGMENT_BATCH_SIZE = 8
+
 
 # File Model
 class EncryptedFile(models.Model):
@@ -18,55 +48,422 @@ class EncryptedFile(models.Model):
         User, on_delete=models.CASCADE,
         related_name="files")  # User who uploaded the file
     file_name = models.CharField(max_length=255)  # Original filename
-    file_data = models.BinaryField(
-    )  # Encrypted file data (stored as received)
+    # Payload bytes live in FileSegment / FilePayload in the blob database (or
+    # on disk), never on this row, so metadata queries and updates do not
+    # touch them.
+    storage_format = models.CharField(max_length=11,
+                                      choices=STORAGE_CHOICES,
+                                      default='blob')
+    segment_count = models.PositiveIntegerField(default=0)
+    size_bytes = models.BigIntegerField(default=0)  # Plaintext size
+    # SHA-256 of the bytes the client uploaded, computed as they streamed in.
+    # Empty for files stored before it was recorded.
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    # Location under PASSTHROUGH_STORAGE_ROOT, only for 'passthrough' files.
+    storage_path = models.CharField(max_length=255, blank=True, default='')
+    # Per-file data key, wrapped with the master key of `key_version`.
+    # Version 0 means the key is still derived from the salt.
+    wrapped_key = models.BinaryField(blank=True, null=True)
+    key_version = models.PositiveSmallIntegerField(
+        default=LEGACY_KEY_VERSION)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     # Public access flag
     iv = models.CharField(max_length=16)
     salt = models.CharField(max_length=64, default='')
     # Users with whom this file is shared
-
-    # Fields for public sharing
-    public_token = models.CharField(max_length=64,
-                                    blank=True,
-                                    null=True,
-                                    unique=True)
-    public_token_expires = models.DateTimeField(blank=True, null=True)
-
     shared_with = models.ManyToManyField(User,
                                          through='FileShare',
                                          related_name="shared_files",
                                          blank=True)
 
-    def generate_public_link(self, hours_valid=24):
+    class Meta:
+        # Back the keyset-paginated file listing: one index per sort order,
+        # each ending in id so the (value, id) seek stays on the index.
+        indexes = [
+            models.Index(fields=['owner', 'uploaded_at', 'id']),
+            models.Index(fields=['owner', 'file_name', 'id']),
+            models.Index(fields=['owner', 'size_bytes', 'id']),
+        ]
+
+    def store_segments(self, sealed_segments, digest=None):
+        """
+        Persist (index, sealed) tuples in batches so only a few segments are
+        held in memory, then record how many were written, their size and,
+        if given, the final value of `digest`, which the caller feeds with
+        the plaintext while the segments are consumed.
+
+        The segments go to the blob database first and the metadata row is
+        updated last, so the file only becomes 'segments' once its payload is
+        there. The row must already be committed: segments of a file that
+        does not exist are swept as orphans.
+        """
+        self.segment_count, self.size_bytes = self._write_segments(
+            sealed_segments)
+        self.storage_format = 'segments'
+        if digest is not None:
+            self.sha256 = digest.hexdigest()
+        try:
+            with transaction.atomic():
+                self.save(update_fields=[
+                    'segment_count', 'size_bytes', 'storage_format', 'sha256'
+                ])
+                StorageUsage.add_file(self.owner_id, self.size_bytes)
+        except BaseException:
+            # Rolled back, so deleting the row must not touch the usage.
+            self.storage_format = 'pending'
+            raise
+
+    def _write_segments(self, sealed_segments):
+        # Returns the number of segments written and their plaintext size.
+        batch = []
+        count = 0
+        size = 0
+        for index, data in sealed_segments:
+            batch.append(FileSegment(file=self, index=index, data=data))
+            count += 1
+            size += len(data) - SEGMENT_TAG_SIZE
+            if len(batch) >= SEGMENT_BATCH_SIZE:
+                FileSegment.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            FileSegment.objects.bulk_create(batch)
+        return count, size
+
+    def iter_sealed_segments(self, first=0, last=None):
+        """
+        Yield (index, sealed) tuples for segments `first`..`last` in order
+        without loading the whole payload.
+        """
+        segments = self.segments.filter(index__gte=first)
+        if last is not None:
+            segments = segments.filter(index__lte=last)
+        return segments.order_by('index').values_list(
+            'index', 'data').iterator(chunk_size=SEGMENT_BATCH_SIZE)
+
+    def backend_key(self):
+        """
+        Return the key the payload is encrypted with: an unwrapped data key,
+        or the salt-derived key for files that have not been migrated yet.
+        """
+        if self.key_version == LEGACY_KEY_VERSION:
+            return derive_backend_key(base64.b64decode(self.salt))
+        return unwrap_data_key(self.wrapped_key, self.key_version)
+
+    def passthrough_path(self):
+        return Path(settings.PASSTHROUGH_STORAGE_ROOT) / self.storage_path
+
+    def store_passthrough(self, chunks):
         """
-        Generate a unique public token and set the expiration time.
+        Write the client's ciphertext to disk as received, without a second
+        layer of server-side encryption. The file only appears under its
+        final name once it has been written completely.
+
+        The row must already be committed as 'pending': no transaction is
+        open while the file is written, and the row only becomes
+        'passthrough' in the short transaction that records it. If anything
+        fails the file is removed; deleting the row is up to the caller.
         """
-        self.public_token = secrets.token_urlsafe(32)
-        self.public_token_expires = timezone.now() + timedelta(
-            hours=hours_valid)
-        self.save()
+        name = uuid.uuid4().hex
+        self.storage_path = f"{name[:2]}/{name}"
+        path = self.passthrough_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix('.part')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(partial, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(partial, path)
+            self.size_bytes = size
+            self.sha256 = digest.hexdigest()
+            self.storage_format = 'passthrough'
+            with transaction.atomic():
+                self.save(update_fields=[
+                    'storage_path', 'size_bytes', 'sha256', 'storage_format'
+                ])
+                StorageUsage.add_file(self.owner_id, self.size_bytes)
+        except BaseException:
+            # The row was rolled back to 'pending', so its deletion neither
+            # removes the file nor touches the owner's usage.
+            self.storage_format = 'pending'
+            path.unlink(missing_ok=True)
+            raise
+        finally:
+            partial.unlink(missing_ok=True)
 
-    def is_public_link_expired(self):
+    def iter_plaintext(self, start=0, stop=None):
         """
-        Returns True if the public link is expired.
+        Yield the decrypted bytes in [start, stop), one segment at a time.
+        Only the segments overlapping that range are read and decrypted.
+        Passthrough files are read from disk as stored.
         """
-        if self.public_token_expires:
-            return timezone.now() > self.public_token_expires
-        return True
+        if stop is None:
+            stop = self.size_bytes
+        if self.storage_format == 'passthrough':
+            with open(self.passthrough_path(), 'rb') as f:
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    data = f.read(min(SEGMENT_SIZE, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+            return
+
+        iv_bytes = base64.b64decode(self.iv)
+        key = self.backend_key()
+        if self.storage_format == 'blob':
+            plaintext = AESGCM(key).decrypt(iv_bytes,
+                                            bytes(self.payload.data), None)
+            yield plaintext[start:stop]
+            return
+
+        if start >= stop:
+            return
+        first = start // SEGMENT_SIZE
+        last = (stop - 1) // SEGMENT_SIZE
+        position = first * SEGMENT_SIZE
+        sealed = self.iter_sealed_segments(first, last)
+        for plaintext in decrypt_segments(sealed, key, iv_bytes,
+                                          self.segment_count, first):
+            yield plaintext[max(start - position, 0):stop - position]
+            position += len(plaintext)
 
-    def revoke_public_link(self):
+    def rekey(self):
         """
-        Revoke the public link by clearing the token and expiration.
+        Re-encrypt the payload under a fresh data key wrapped with the current
+        master key. Legacy single-blob payloads are converted to segments.
+
+        The new payload is written in one blob database transaction and the
+        metadata is saved just before it commits, so a failure before then
+        leaves the old payload and key in place.
         """
-        self.public_token = None
-        self.public_token_expires = None
-        self.save()
+        if self.storage_format == 'passthrough':
+            raise ValueError("Passthrough files have no server-side key.")
+        iv_bytes = base64.b64decode(self.iv)
+        old_key = self.backend_key()
+        new_key, wrapped_key, key_version = new_data_key()
+
+        with transaction.atomic(using=BLOB_DATABASE):
+            if self.storage_format == 'blob':
+                plaintext = AESGCM(old_key).decrypt(iv_bytes,
+                                                    bytes(self.payload.data),
+                                                    None)
+                self.payload.delete()
+                self.segment_count, self.size_bytes = self._write_segments(
+                    encrypt_segments([plaintext], new_key, iv_bytes))
+                self.storage_format = 'segments'
+            else:
+                old_cipher = SegmentCipher(old_key, iv_bytes)
+                new_cipher = SegmentCipher(new_key, iv_bytes)
+                last = self.segment_count - 1
+                # Re-seal a batch at a time rather than iterating a cursor
+                # over the table that is being updated.
+                for start in range(0, self.segment_count, SEGMENT_BATCH_SIZE):
+                    batch = list(
+                        self.segments.filter(
+                            index__gte=start,
+                            index__lt=start + SEGMENT_BATCH_SIZE))
+                    for segment in batch:
+                        final = segment.index == last
+                        plaintext = old_cipher.open(segment.index,
+                                                    bytes(segment.data), final)
+                        segment.data = new_cipher.seal(segment.index,
+                                                       plaintext, final)
+                    FileSegment.objects.bulk_update(batch, ['data'])
+
+            self.wrapped_key = wrapped_key
+            self.key_version = key_version
+            self.save(update_fields=[
+                'storage_format', 'segment_count', 'size_bytes',
+                'wrapped_key', 'key_version'
+            ])
+
+        # The salt-derived key is no longer needed for this file.
+        backend_key_cache.evict_salt(base64.b64decode(self.salt))
 
     def __str__(self):
         return f"{self.file_name} (Owner: {self.owner.username})"
 
 
+class FilePayload(models.Model):
+    """
+    Legacy single-blob payload of a file with storage_format 'blob'. Kept in
+    its own table so only the download paths ever read it.
+
+    FilePayload, FileSegment and UploadChunk are stored in the blob database
+    and point at their metadata row without a constraint; they are deleted
+    once the metadata row is gone (see api.signals and sweep_orphan_blobs).
+    """
+    file = models.OneToOneField(EncryptedFile,
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False,
+                                primary_key=True,
+                                related_name="payload")
+    data = models.BinaryField()
+
+
+class StorageQuotaExceeded(Exception):
+    """
+    Raised by StorageUsage.add_file when a file does not fit in its owner's
+    quota.
+    """
+
+
+class StorageUsage(models.Model):
+    """
+    Running totals of a user's stored files, so a quota check reads one row
+    instead of summing their files. Updated in the transaction that stores
+    or deletes each file; pending uploads are not counted. The
+    reconcile_storage_usage command recomputes them from EncryptedFile.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="storage_usage")
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.BigIntegerField(default=0)
+    # Overrides settings.STORAGE_QUOTA for this user; null uses the default.
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
+
+    @classmethod
+    def add_file(cls, user_id, size):
+        """
+        Count a newly stored file of `size` bytes, or raise
+        StorageQuotaExceeded if it does not fit in the user's quota. The
+        check is part of the UPDATE, so concurrent uploads cannot overshoot
+        the quota together. Call it inside the transaction that stores the
+        file, which the exception then rolls back.
+        """
+        usage = cls.objects.filter(user_id=user_id)
+        default = settings.STORAGE_QUOTA
+        fits = Q(quota_bytes__isnull=False,
+                 bytes_used__lte=F('quota_bytes') - size)
+        if default is None:
+            fits |= Q(quota_bytes__isnull=True)
+        else:
+            fits |= Q(quota_bytes__isnull=True, bytes_used__lte=default - size)
+        if usage.filter(fits).update(bytes_used=F('bytes_used') + size,
+                                     file_count=F('file_count') + 1):
+            return
+        if usage.exists() or (default is not None and size > default):
+            raise StorageQuotaExceeded
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id,
+                                   bytes_used=size,
+                                   file_count=1)
+        except IntegrityError:
+            # Another upload created the row first.
+            cls.add_file(user_id, size)
+
+    @classmethod
+    def remove_file(cls, user_id, size):
+        """
+        Stop counting a deleted file. A missing row, as when the user is
+        being deleted too, is left alone.
+        """
+        cls.objects.filter(user_id=user_id).update(
+            bytes_used=F('bytes_used') - size,
+            file_count=F('file_count') - 1)
+
+    @classmethod
+    def remaining_for(cls, user):
+        """
+        Bytes `user` may still store, or None if they have no quota. Reads
+        a single row.
+        """
+        used, quota = cls.objects.filter(user=user).values_list(
+            'bytes_used', 'quota_bytes').first() or (0, None)
+        if quota is None:
+            quota = settings.STORAGE_QUOTA
+        if quota is None:
+            return None
+        return max(quota - used, 0)
+
+
+class PublicLink(models.Model):
+    """
+    Link giving whoever holds its token access to a file until it expires or
+    its downloads are used up. A file can have any number of links. Only the
+    SHA-256 of the token is stored, so the token itself is shown once, when
+    the link is created.
+    """
+    file = models.ForeignKey(EncryptedFile,
+                             on_delete=models.CASCADE,
+                             related_name='public_links')
+    token_hash = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    remaining_downloads = models.PositiveIntegerField(default=1)
+    # Until this time, bytes still covered by the last download claimed, so
+    # an interrupted transfer can be resumed without using another.
+    resume_until = models.DateTimeField(null=True, blank=True)
+    resume_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def create_for(cls, file, hours_valid=24, max_downloads=1):
+        """
+        Create a link to `file`. Returns the link and its token.
+        """
+        token = secrets.token_urlsafe(32)
+        link = cls.objects.create(file=file,
+                                  token_hash=cls.hash_token(token),
+                                  expires_at=timezone.now() +
+                                  timedelta(hours=hours_valid),
+                                  remaining_downloads=max_downloads)
+        return link, token
+
+    @classmethod
+    def lookup(cls, token):
+        """
+        Return the link with `token` and its file, or None.
+        """
+        return cls.objects.select_related('file').exclude(
+            file__storage_format='pending').filter(
+                token_hash=cls.hash_token(token)).first()
+
+    def is_usable(self):
+        now = timezone.now()
+        return now < self.expires_at and (
+            self.remaining_downloads > 0
+            or (self.resume_until is not None and now < self.resume_until))
+
+    def claim(self, resumed=0):
+        """
+        Use up one download, or, for a request resuming one (`resumed`
+        bytes of a range not starting at the first byte), take those bytes
+        from the last download claimed while its resume window is open.
+        Claiming a download opens a new window covering one more copy of
+        the file. Each step is a single conditional UPDATE, so no row is
+        locked and of concurrent downloads at most `remaining_downloads`
+        succeed.
+
+        Returns False if the link has expired or has nothing left.
+        """
+        now = timezone.now()
+        links = PublicLink.objects.filter(pk=self.pk, expires_at__gt=now)
+        if resumed and links.filter(
+                resume_until__gt=now, resume_bytes__gte=resumed).update(
+                    resume_bytes=F('resume_bytes') - resumed):
+            return True
+        file_size = EncryptedFile.objects.filter(
+            pk=OuterRef('file_id')).values('size_bytes')
+        claimed = links.filter(remaining_downloads__gt=0).update(
+            remaining_downloads=F('remaining_downloads') - 1,
+            resume_until=now + settings.PUBLIC_LINKS['RESUME_WINDOW'],
+            resume_bytes=Subquery(file_size))
+        return claimed == 1
+
+
 class FileShare(models.Model):
     file = models.ForeignKey(EncryptedFile, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -77,3 +474,397 @@ class FileShare(models.Model):
 
     class Meta:
         unique_together = ('file', 'user')
+        # Files shared with a user, looked up without touching the file table.
+        indexes = [models.Index(fields=['user', 'file'])]
+
+
+class FileSegment(models.Model):
+    """
+    One AES-GCM sealed, fixed-size slice of a file's payload.
+    """
+    file = models.ForeignKey(EncryptedFile,
+                             on_delete=models.DO_NOTHING,
+                             db_constraint=False,
+                             related_name="segments")
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ('file', 'index')
+
+
+class UploadSessionFinalizing(Exception):
+    """
+    Raised when a chunk or part is written to a session that a completion
+    request has already claimed.
+    """
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload: chunks arrive in any order and are sealed as they
+    come in, then `finalize()` turns them into an EncryptedFile.
+    Every chunk is exactly one segment, so chunk `i` becomes segment `i`.
+    """
+    id = models.UUIDField(primary_key=True,
+                          default=uuid.uuid4,
+                          editable=False)
+    owner = models.ForeignKey(User,
+                              on_delete=models.CASCADE,
+                              related_name="upload_sessions")
+    file_name = models.CharField(max_length=255)
+    iv = models.CharField(max_length=16)
+    salt = models.CharField(max_length=64)
+    size_bytes = models.BigIntegerField()  # Declared plaintext size
+    chunk_size = models.PositiveIntegerField(default=SEGMENT_SIZE)
+    # Parallel uploads send parts of `part_size` bytes, a whole number of
+    # chunks each, so different connections can write different parts.
+    part_size = models.BigIntegerField(default=SEGMENT_SIZE)
+    wrapped_key = models.BinaryField()
+    key_version = models.PositiveSmallIntegerField(
+        default=current_key_version)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    # Set by the one completion request allowed to turn the chunks into a
+    # file; chunk and part writes are refused from then on.
+    finalizing = models.BooleanField(default=False)
+
+    @property
+    def chunk_count(self):
+        # An empty file still has one (empty) final chunk.
+        return max(1, -(-self.size_bytes // self.chunk_size))
+
+    @property
+    def chunks_per_part(self):
+        return self.part_size // self.chunk_size
+
+    @property
+    def part_count(self):
+        return -(-self.chunk_count // self.chunks_per_part)
+
+    def part_chunk_range(self, part_number):
+        """
+        Return the range of chunk indexes covered by `part_number`.
+        """
+        first = part_number * self.chunks_per_part
+        return range(first,
+                     min(first + self.chunks_per_part, self.chunk_count))
+
+    def expected_chunk_length(self, index):
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size_bytes - self.chunk_size * (self.chunk_count - 1)
+
+    def is_expired(self):
+        return timezone.now() > self.expires_at
+
+    def touch(self):
+        """
+        Push the expiry forward; called whenever the client makes progress.
+        Raises UploadSessionFinalizing if the session was claimed meanwhile,
+        in which case the write just made may or may not be in the file.
+        """
+        self.expires_at = timezone.now() + settings.UPLOAD_SESSION_TTL
+        if not UploadSession.objects.filter(pk=self.pk,
+                                            finalizing=False).update(
+                                                expires_at=self.expires_at):
+            raise UploadSessionFinalizing()
+
+    def claim(self):
+        """
+        Mark the session as being finalized, with a single conditional UPDATE
+        so that only one of several concurrent completion requests wins.
+        Returns whether this call won.
+        """
+        self.expires_at = timezone.now() + settings.UPLOAD_SESSION_TTL
+        self.finalizing = UploadSession.objects.filter(
+            pk=self.pk, finalizing=False).update(
+                finalizing=True, expires_at=self.expires_at) == 1
+        return self.finalizing
+
+    def release(self):
+        """
+        Give up a claim after a failed finalize, so the client can retry.
+        """
+        self.finalizing = False
+        UploadSession.objects.filter(pk=self.pk).update(finalizing=False)
+
+    def store_chunk(self, index, data):
+        """
+        Seal one chunk with the session's data key and store it, replacing any
+        earlier copy of the same chunk.
+        """
+        sealed = self._cipher().seal(index, data,
+                                     index == self.chunk_count - 1)
+        self._upsert_chunk(index, sealed)
+        self.touch()
+
+    def store_part(self, part_number, stream):
+        """
+        Read one part from `stream` a chunk at a time, sealing and storing each
+        chunk as it arrives, then record the part in the manifest.
+        Chunks are committed individually so concurrent parts only hold the
+        write lock briefly. Returns the UploadPart, or None if the stream
+        ended early or carried extra bytes; the chunks already stored and any
+        earlier manifest entry for the part are then deleted, so a failed
+        attempt never leaves a mix of old and new chunks behind.
+        """
+        cipher = self._cipher()
+        digest = hashlib.sha256()
+        size = 0
+        chunk_range = self.part_chunk_range(part_number)
+        complete = True
+        for index in chunk_range:
+            expected = self.expected_chunk_length(index)
+            data = read_exactly(stream, expected)
+            if len(data) != expected:
+                complete = False
+                break
+            digest.update(data)
+            size += expected
+            self._upsert_chunk(
+                index,
+                cipher.seal(index, data, index == self.chunk_count - 1))
+        if not complete or stream.read(1):
+            UploadChunk.objects.filter(session=self,
+                                       index__in=chunk_range).delete()
+            UploadPart.objects.filter(session=self,
+                                      number=part_number).delete()
+            return None
+
+        part = UploadPart(session=self,
+                          number=part_number,
+                          size_bytes=size,
+                          etag=digest.hexdigest())
+        UploadPart.objects.bulk_create([part],
+                                       update_conflicts=True,
+                                       unique_fields=['session', 'number'],
+                                       update_fields=['size_bytes', 'etag'])
+        self.touch()
+        return part
+
+    def _upsert_chunk(self, index, sealed):
+        # A single INSERT ... ON CONFLICT statement, so concurrent writers
+        # wait for the lock instead of failing a read-to-write upgrade.
+        UploadChunk.objects.bulk_create(
+            [UploadChunk(session=self, index=index, data=sealed)],
+            update_conflicts=True,
+            unique_fields=['session', 'index'],
+            update_fields=['data'])
+
+    def _cipher(self):
+        return SegmentCipher(
+            unwrap_data_key(self.wrapped_key, self.key_version),
+            base64.b64decode(self.iv))
+
+    def received_ranges(self):
+        """
+        Return the received chunk indexes as a list of [first, last] runs.
+        """
+        ranges = []
+        for index in self.chunks.order_by('index').values_list('index',
+                                                                flat=True):
+            if ranges and ranges[-1][1] == index - 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return ranges
+
+    def iter_sealed_chunks(self):
+        """
+        Yield (index, sealed) tuples, fetching a batch of chunks at a time.
+        """
+        for start in range(0, self.chunk_count, SEGMENT_BATCH_SIZE):
+            yield from self.chunks.filter(
+                index__gte=start,
+                index__lt=start + SEGMENT_BATCH_SIZE).order_by(
+                    'index').values_list('index', 'data')
+
+    def _iter_hashed_chunks(self, digest):
+        # The chunks arrived in any order, so the digest is taken here, as
+        # they are moved in order, by opening each one again.
+        cipher = self._cipher()
+        for index, sealed in self.iter_sealed_chunks():
+            digest.update(
+                cipher.open(index, bytes(sealed),
+                            index == self.chunk_count - 1))
+            yield index, sealed
+
+    def finalize(self):
+        """
+        Move the sealed chunks into a new EncryptedFile and delete the session.
+        The caller must have claimed the session and checked that every chunk
+        has arrived. The chunks are only deleted once the file's metadata has
+        committed; if anything fails, the file is removed and the claim
+        released.
+        """
+        encrypted_file = EncryptedFile.objects.create(
+            owner=self.owner,
+            file_name=self.file_name,
+            iv=self.iv,
+            salt=self.salt,
+            storage_format='pending',
+            wrapped_key=self.wrapped_key,
+            key_version=self.key_version)
+        digest = hashlib.sha256()
+        try:
+            encrypted_file.store_segments(self._iter_hashed_chunks(digest),
+                                          digest)
+            if encrypted_file.segment_count != self.chunk_count:
+                raise ValueError("Upload session chunks are missing.")
+        except BaseException:
+            encrypted_file.delete()
+            self.release()
+            raise
+        self.delete()
+        return encrypted_file
+
+    @classmethod
+    def purge_expired(cls, limit=100):
+        """
+        Delete up to `limit` expired sessions along with their chunks.
+        Returns the number of sessions deleted.
+        """
+        expired = list(
+            cls.objects.filter(expires_at__lt=timezone.now()).values_list(
+                'pk', flat=True)[:limit])
+        if not expired:
+            return 0
+        cls.objects.filter(pk__in=expired).delete()
+        return len(expired)
+
+
+class UploadChunk(models.Model):
+    """
+    One sealed chunk of an UploadSession.
+    """
+    session = models.ForeignKey(UploadSession,
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False,
+                                related_name="chunks")
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+
+class UploadPart(models.Model):
+    """
+    Manifest entry for one part of a parallel upload. Written only after all
+    of the part's chunks have been stored.
+    """
+    session = models.ForeignKey(UploadSession,
+                                on_delete=models.CASCADE,
+                                related_name="parts")
+    number = models.PositiveIntegerField()
+    size_bytes = models.BigIntegerField()
+    etag = models.CharField(max_length=64)  # SHA-256 of the part plaintext
+
+    class Meta:
+        unique_together = ('session', 'number')
+
+
+class OutboundEmail(models.Model):
+    """
+    Durable outbox entry for an email that is delivered by the
+    send_queued_email worker instead of inside the request that queued it.
+    The body is blanked once the email is sent or given up on, and the row
+    itself is removed by the maintenance sweep.
+    """
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=7,
+                              choices=EMAIL_STATUS_CHOICES,
+                              default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest time a worker may (re)try. Claiming pushes it forward by the
+    # claim timeout, so a crashed worker's batch is picked up again later.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Time after which the email is useless, such as when the code it
+    # carries has expired. It is dropped instead of sent after that.
+    discard_after = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    @classmethod
+    def queue(cls,
+              subject,
+              message,
+              from_email,
+              recipient_list,
+              discard_after=None):
+        return cls.objects.create(subject=subject,
+                                  body=message,
+                                  from_email=from_email,
+                                  to=list(recipient_list),
+                                  discard_after=discard_after)
+
+    def is_stale(self):
+        return (self.discard_after is not None
+                and self.discard_after <= timezone.now())
+
+    @classmethod
+    def claim_batch(cls, limit, claim_timeout):
+        """
+        Atomically claim up to `limit` due emails for this worker and return
+        them. Concurrent workers never claim the same row, and emails past
+        their discard_after are never claimed.
+        """
+        now = timezone.now()
+        due = list(
+            cls.objects.filter(status='pending',
+                               next_attempt_at__lte=now).exclude(
+                                   discard_after__lte=now).order_by(
+                                   'next_attempt_at').values_list(
+                                       'pk', flat=True)[:limit])
+        if not due:
+            return []
+        token = uuid.uuid4().hex
+        # The conditional UPDATE is the claim: rows another worker took in
+        # the meantime no longer match.
+        cls.objects.filter(pk__in=due,
+                           status='pending',
+                           next_attempt_at__lte=now).update(
+                               claim_token=token,
+                               next_attempt_at=now + claim_timeout)
+        return list(cls.objects.filter(claim_token=token, status='pending'))
+
+    def retry_later(self, error, max_attempts, retry_delay, max_retry_delay):
+        """
+        Record a failed attempt and schedule the next one with exponential
+        backoff, or give up after `max_attempts`.
+        """
+        self.attempts += 1
+        self.last_error = str(error)[:1000]
+        self.claim_token = ''
+        if self.attempts >= max_attempts:
+            self.status = 'failed'
+            self.body = ''
+        else:
+            self.next_attempt_at = timezone.now() + min(
+                retry_delay * 2**(self.attempts - 1), max_retry_delay)
+        self.save(update_fields=[
+            'attempts', 'last_error', 'claim_token', 'status',
+            'next_attempt_at', 'body'
+        ])
+
+
+class RevokedToken(models.Model):
+    """
+    JWT that must no longer be accepted before it expires, identified by its
+    jti claim. Requests check the in-process list in api.revocation, which
+    is loaded from and kept in sync with this table.
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    # The token's own expiry; after it the signature check rejects the
+    # token anyway and the row can be deleted.
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
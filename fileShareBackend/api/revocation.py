@@ -0,0 +1,163 @@
+"""
+Revoked JWTs.
+
+The RevokedToken table is the source of truth. Each worker keeps the jtis of
+the revoked, unexpired tokens in an in-process set, so checking a token on a
+request is a set lookup and never a query. A worker picks up revocations made
+by other workers by comparing a version stored in the shared cache, at most
+every SYNC_INTERVAL seconds, and only queries the table when the version has
+changed. It rebuilds the set without expired tokens every RELOAD_INTERVAL
+seconds. Both intervals are read from settings.TOKEN_REVOCATION.
+
+One thread syncs at a time, and nothing a check waits for is held while it
+queries: the other threads keep checking against the current set, which a
+rebuild replaces with a single assignment once it is complete. Only the very
+first load is waited for.
+"""
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from .models import RevokedToken
+
+# Shared cache key changed after every revocation.
+VERSION_KEY = "revocation:version"
+
+
+class RevocationList:
+
+    def __init__(self):
+        # Held by the thread syncing, for as long as it queries.
+        self._sync_lock = threading.Lock()
+        # Held briefly to add to or replace the set.
+        self._lock = threading.Lock()
+        self._jtis = set()
+        # Revoked here while a rebuild is running, for the rebuilt set.
+        self._revoked_during_reload = None
+        self._last_id = 0
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = None
+
+    @property
+    def config(self):
+        return getattr(settings, 'TOKEN_REVOCATION', {})
+
+    def __len__(self):
+        return len(self._jtis)
+
+    def is_revoked(self, jti):
+        self.sync()
+        return jti in self._jtis
+
+    def revoke(self, token):
+        """
+        Revoke a validated simplejwt token until it expires. Returns False if
+        it had already been revoked, so a caller can use a token only once.
+        """
+        jti = token[api_settings.JTI_CLAIM]
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti,
+                                            expires_at=datetime.fromtimestamp(
+                                                token['exp'],
+                                                tz=dt_timezone.utc))
+        except IntegrityError:
+            return False
+        # This worker stops accepting the token at once, the others once the
+        # row is committed and they see the new version.
+        with self._lock:
+            self._jtis.add(jti)
+            if self._revoked_during_reload is not None:
+                self._revoked_during_reload.append(jti)
+        transaction.on_commit(
+            lambda: cache.set(VERSION_KEY, uuid.uuid4().hex, None))
+        return True
+
+    def sync(self, force=False):
+        """
+        Pick up revocations made by other workers if SYNC_INTERVAL has passed
+        since the last check, or now when `force` is set.
+        """
+        if not force and not self._due(self.config.get('SYNC_INTERVAL', 2)):
+            return
+        # While another thread syncs, checks use the set as it is, unless
+        # nothing has been loaded yet.
+        if not self._sync_lock.acquire(
+                blocking=force or self._checked_at is None):
+            return
+        try:
+            if not force and not self._due(self.config.get(
+                    'SYNC_INTERVAL', 2)):
+                return  # another thread synced while we waited
+            now = time.monotonic()
+            # Read before querying, so a revocation committed in between is
+            # picked up by the next sync at the latest.
+            version = cache.get(VERSION_KEY)
+            if (self._loaded_at is None or now - self._loaded_at >=
+                    self.config.get('RELOAD_INTERVAL', 3600)):
+                self._reload()
+                self._loaded_at = now
+            elif version != self._version:
+                self._last_id = self._pull(self._jtis, self._last_id)
+            self._version = version
+            # Only now, so threads waiting for the first load keep waiting.
+            self._checked_at = now
+        finally:
+            self._sync_lock.release()
+
+    def _reload(self):
+        """
+        Build the set again from the table and swap it in.
+        """
+        with self._lock:
+            self._revoked_during_reload = []
+        jtis = set()
+        try:
+            last_id = self._pull(jtis, 0)
+        except BaseException:
+            with self._lock:
+                self._revoked_during_reload = None
+            raise
+        with self._lock:
+            # Revoked here after the query read the table.
+            jtis.update(self._revoked_during_reload)
+            self._revoked_during_reload = None
+            self._jtis = jtis
+        self._last_id = last_id
+
+    def _due(self, interval):
+        return (self._checked_at is None
+                or time.monotonic() - self._checked_at >= interval)
+
+    @staticmethod
+    def _pull(jtis, last_id):
+        """
+        Add the unexpired jtis of rows after `last_id` to `jtis` and return
+        the last id read.
+        """
+        rows = RevokedToken.objects.filter(
+            pk__gt=last_id, expires_at__gt=timezone.now()).order_by(
+                'pk').values_list('pk', 'jti')
+        for last_id, jti in rows.iterator(chunk_size=10000):
+            jtis.add(jti)
+        return last_id
+
+    def clear(self):
+        """
+        Forget everything loaded, so the next check reloads from the table.
+        """
+        with self._sync_lock, self._lock:
+            self._jtis = set()
+            self._last_id = 0
+            self._version = None
+            self._loaded_at = None
+            self._checked_at = None
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,129 @@
+"""
+Database routing.
+
+Payload bytes live in the BLOB_DATABASE alias, apart from the metadata, so a
+large upload never holds the metadata database's write lock. Blob rows point
+at metadata rows in the other database without a foreign key constraint;
+writes are ordered so a crash can only leave orphaned blobs, which the
+sweep_orphan_blobs command removes.
+
+Views that only read are marked with ReadOnlyViewMixin. While they run, reads
+go to the READ_ONLY_DATABASE alias: the same SQLite file opened with
+mode=ro and query_only, so those connections never take the write lock and,
+with WAL, keep reading while an upload commits on the default connection.
+Other writes go to the default database.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import StreamingHttpResponse
+
+READ_ONLY_DATABASE = 'readonly'
+BLOB_DATABASE = 'blobs'
+
+# Models holding payload bytes, stored in BLOB_DATABASE.
+BLOB_MODELS = {'filepayload', 'filesegment', 'uploadchunk'}
+
+_read_only = ContextVar('read_only', default=False)
+
+
+@contextmanager
+def read_only():
+    """
+    Route reads made in the enclosed block to the read-only database.
+    """
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def read_only_alias():
+    """
+    The alias read-only reads go to, or the default one if no separate
+    read-only database is configured. A test mirror shares the default
+    database's NAME but not its connection, so it could not see data from a
+    test's open transaction; reads then stay on the default connection.
+    """
+    if READ_ONLY_DATABASE not in connections.settings:
+        return DEFAULT_DB_ALIAS
+    if (connections[READ_ONLY_DATABASE].settings_dict['NAME'] ==
+            connections[DEFAULT_DB_ALIAS].settings_dict['NAME']):
+        return DEFAULT_DB_ALIAS
+    return READ_ONLY_DATABASE
+
+
+def is_blob_model(model):
+    return (model._meta.app_label == 'api'
+            and model._meta.model_name in BLOB_MODELS)
+
+
+class BlobRouter:
+
+    def db_for_read(self, model, **hints):
+        # Historical models in data migrations stay on the database being
+        # migrated; migration 0015 moves the blob rows across explicitly.
+        if is_blob_model(model) and model._meta.apps is apps:
+            return BLOB_DATABASE
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Blob rows refer to metadata rows in the other database.
+        if is_blob_model(type(obj1)) or is_blob_model(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The blob tables also stay in the default database, where older
+        # installs kept their payloads until migration 0015 moved them.
+        if db == BLOB_DATABASE:
+            return app_label == 'api' and model_name in BLOB_MODELS
+        return None
+
+
+class ReadOnlyRouter:
+
+    def db_for_read(self, model, **hints):
+        if _read_only.get():
+            return read_only_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Never fall back to the alias an instance was read from.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        aliases = {DEFAULT_DB_ALIAS, READ_ONLY_DATABASE}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == READ_ONLY_DATABASE:
+            return False
+        return None
+
+
+class ReadOnlyViewMixin:
+    """
+    Serve the view's reads from the read-only database, including those made
+    while a streamed response is being consumed.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_only():
+            response = super().dispatch(request, *args, **kwargs)
+        if isinstance(response, StreamingHttpResponse):
+            response.streaming_content = _iter_read_only(
+                response.streaming_content)
+        return response
+
+
+def _iter_read_only(chunks):
+    with read_only():
+        yield from chunks
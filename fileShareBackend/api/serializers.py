@@ -27,10 +27,7 @@ class EncryptedFileListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = EncryptedFile
-        fields = [
-            'id', 'file_name', 'uploaded_at', 'owner', 'public_token',
-            "public_token_expires"
-        ]
+        fields = ['id', 'file_name', 'uploaded_at', 'size_bytes', 'owner']
 
 
 class FileShareSerializer(serializers.ModelSerializer):
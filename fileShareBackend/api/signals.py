@@ -0,0 +1,154 @@
+import base64
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.signals import request_started, setting_changed
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .acl import access_cache
+from .authentication import user_cache
+from .maintenance import maintenance_scheduler
+from .models import EncryptedFile, FilePayload, FileSegment, FileShare, StorageUsage, UploadChunk, UploadSession
+from .routers import READ_ONLY_DATABASE
+from .utlis import backend_key_cache, master_key
+
+
+@receiver(post_delete, sender=EncryptedFile)
+def evict_deleted_file_key(sender, instance, **kwargs):
+    """
+    Drop the cached backend key of a deleted file.
+    """
+    backend_key_cache.evict_salt(base64.b64decode(instance.salt))
+
+
+@receiver(post_delete, sender=EncryptedFile)
+def remove_passthrough_file(sender, instance, **kwargs):
+    """
+    Delete the on-disk ciphertext of a deleted passthrough file.
+    """
+    if instance.storage_format == 'passthrough' and instance.storage_path:
+        instance.passthrough_path().unlink(missing_ok=True)
+
+
+@receiver(post_delete, sender=EncryptedFile)
+def delete_file_blobs(sender, instance, **kwargs):
+    """
+    Delete a deleted file's payload from the blob database once the metadata
+    deletion has committed. sweep_orphan_blobs catches any this misses.
+    """
+    pk = instance.pk
+
+    def delete_blobs():
+        FileSegment.objects.filter(file_id=pk).delete()
+        FilePayload.objects.filter(file_id=pk).delete()
+
+    transaction.on_commit(delete_blobs)
+
+
+@receiver(post_delete, sender=UploadSession)
+def delete_session_chunks(sender, instance, **kwargs):
+    """
+    Delete a finished or abandoned upload session's chunks once the session
+    deletion has committed.
+    """
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: UploadChunk.objects.filter(session_id=pk).delete())
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Evict a changed or deleted account from the user cache, so deactivation,
+    password and staff changes apply to the next request. The entry is
+    dropped again after commit, in case a concurrent request cached the old
+    row in the meantime. Recording a login only changes last_login.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    user_id = instance.pk
+    user_cache.invalidate(user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
+
+@receiver(post_save, sender=FileShare)
+@receiver(post_delete, sender=FileShare)
+def invalidate_share_access(sender, instance, **kwargs):
+    """
+    Drop the cached access decision of the user a share was changed for.
+    """
+    access_cache.invalidate([(instance.user_id, instance.file_id)])
+
+
+@receiver(pre_save, sender=EncryptedFile)
+def invalidate_owner_access(sender, instance, update_fields=None, **kwargs):
+    """
+    Drop the cached decisions of the old and new owner when a file changes
+    hands.
+    """
+    if instance.pk is None or (update_fields is not None
+                               and 'owner' not in update_fields):
+        return
+    old_owner_id = EncryptedFile.objects.filter(pk=instance.pk).values_list(
+        'owner_id', flat=True).first()
+    if old_owner_id is not None and old_owner_id != instance.owner_id:
+        access_cache.invalidate([(old_owner_id, instance.pk),
+                                 (instance.owner_id, instance.pk)])
+
+
+@receiver(post_delete, sender=EncryptedFile)
+def invalidate_deleted_file_access(sender, instance, **kwargs):
+    """
+    Drop the owner's cached decision for a deleted file. Shares are deleted
+    by cascade and invalidate their own entries.
+    """
+    access_cache.invalidate([(instance.owner_id, instance.pk)])
+
+
+@receiver(post_delete, sender=EncryptedFile)
+def release_storage_usage(sender, instance, **kwargs):
+    """
+    Take a deleted file off its owner's usage, in the deleting transaction.
+    Pending uploads were never counted.
+    """
+    if instance.storage_format != 'pending':
+        StorageUsage.remove_file(instance.owner_id, instance.size_bytes)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """
+    Apply SQLITE_PRAGMAS to every new SQLite connection. Read-only
+    connections skip journal_mode and auto_vacuum, which only a writer can
+    change, and are set query_only.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(settings.SQLITE_PRAGMAS)
+    if connection.alias == READ_ONLY_DATABASE:
+        pragmas.pop('journal_mode', None)
+        pragmas.pop('auto_vacuum', None)
+        pragmas['query_only'] = 'ON'
+    for name, value in pragmas.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+@receiver(request_started)
+def start_maintenance_scheduler(sender, **kwargs):
+    """
+    Start the in-process maintenance thread on the first request each
+    process serves, when MAINTENANCE['IN_PROCESS'] is set.
+    """
+    if settings.MAINTENANCE['IN_PROCESS']:
+        maintenance_scheduler.ensure_running()
+
+
+@receiver(setting_changed)
+def clear_master_keys(sender, setting, **kwargs):
+    """
+    Forget the derived master keys when their secrets change.
+    """
+    if setting == 'BACKEND_MASTER_KEYS':
+        master_key.cache_clear()
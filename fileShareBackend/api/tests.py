@@ -1,17 +1,63 @@
 import base64
+import hashlib
+import json
+import pickle
 import random
 from django.urls import reverse
 from django.core.cache import cache
 from django.core import mail
+from django.core.management import call_command
+from io import StringIO
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
+from django.db import OperationalError, connection, connections, router
+from django.db.migrations.executor import MigrationExecutor
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, LiveServerTestCase, override_settings
+from unittest import mock, skipUnless
+from cryptography.exceptions import InvalidTag
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import EncryptedFile, FileShare
+from .models import EncryptedFile, FilePayload, FileShare, FileSegment, OutboundEmail, PublicLink, RevokedToken, StorageQuotaExceeded, StorageUsage, UploadChunk, UploadPart, UploadSession
+from .views import MFA_MAX_ATTEMPTS, _create_file_from_stream
 import os
-from .utlis import derive_backend_key
+import shutil
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import time
+from urllib.request import Request, urlopen
+from .acl import access_cache
+from .authentication import UserCache, user_cache
+from .hashers import password_executor
+from .maintenance import AUTO_VACUUM_INCREMENTAL, LOCK_KEY, MaintenanceScheduler, delete_in_batches, run_maintenance
+from .revocation import VERSION_KEY, revocation_list
+from .cache_backends import LocMemCache, SQLiteCache
+from .routers import BLOB_DATABASE, READ_ONLY_DATABASE, ReadOnlyRouter, read_only
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+import asyncio
+import smtplib
+try:
+    import aiosmtpd
+    from aiosmtpd.controller import Controller as SMTPController
+except ImportError:
+    aiosmtpd = None
+from .management.commands.bench_endpoints import DEFAULT_BASELINE, seed, build_scenarios, run_scenario
+from .urls import urlpatterns
+from .utlis import current_key_version, derive_backend_key, master_key, encrypt_segments, decrypt_segments, parse_range_header, limit_size, SEGMENT_SIZE, LEGACY_KEY_VERSION, BackendKeyCache, backend_key_cache
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from datetime import timedelta
 
@@ -19,6 +65,7 @@ User = get_user_model()
 
 
 class EncryptedViews(APITestCase):
+    databases = {"default", BLOB_DATABASE}
 
     def setUp(self):
         self.register_url = reverse(
@@ -56,18 +103,20 @@ class EncryptedViews(APITestCase):
             email='admin@example.com')
         self.test_file1 = EncryptedFile.objects.create(
             owner=self.user,
-            file_data=b"Dummy encrypted data 1",
             file_name="file1.pdf",
             salt=base64.b64encode(os.urandom(16)).decode(),
             iv=base64.b64encode(os.urandom(12)).decode(),
         )
         self.test_file2 = EncryptedFile.objects.create(
             owner=self.admin_user,
-            file_data=b"Dummy encrypted data 2",
             file_name="file2.pdf",
             salt=base64.b64encode(os.urandom(16)).decode(),
             iv=base64.b64encode(os.urandom(12)).decode(),
         )
+        FilePayload.objects.create(file=self.test_file1,
+                                   data=b"Dummy encrypted data 1")
+        FilePayload.objects.create(file=self.test_file2,
+                                   data=b"Dummy encrypted data 2")
         # Clear the cache before each test to avoid stale MFA codes.
         cache.clear()
 
@@ -106,7 +155,12 @@ class EncryptedViews(APITestCase):
         # First, generate and store a valid code.
         valid_code = random.randint(100000, 999999)
         cache_key = f"mfa_code_{self.user.id}"
-        cache.set(cache_key, valid_code, timeout=300)
+        cache.set(cache_key, {
+            "code": valid_code,
+            "expires_at": time.time() + 300,
+            "failures": 0
+        },
+                  timeout=300)
         login_data = {
             "username": "testuser",
             "password": "TestPass123!",
@@ -116,6 +170,45 @@ class EncryptedViews(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
         self.assertIn("Invalid MFA code", response.data.get("error", ""))
 
+        # A wrong guess does not use the code up.
+        login_data["email_code"] = str(valid_code)
+        response = self.client.post(self.login_url, login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_mfa_code_is_dropped_after_too_many_wrong_guesses(self):
+        login_data = {"username": "testuser", "password": "TestPass123!"}
+        self.client.post(self.login_url, login_data, format='json')
+        valid_code = cache.get(f"mfa_code_{self.user.id}")["code"]
+
+        for _ in range(MFA_MAX_ATTEMPTS):
+            response = self.client.post(self.login_url,
+                                        dict(login_data,
+                                             email_code="000000"),
+                                        format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(self.login_url,
+                                    dict(login_data,
+                                         email_code=str(valid_code)),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_wrong_guess_does_not_extend_the_code_lifetime(self):
+        cache_key = f"mfa_code_{self.user.id}"
+        cache.set(cache_key, {
+            "code": 123456,
+            "expires_at": time.time() - 1,
+            "failures": 0
+        },
+                  timeout=300)
+        login_data = {
+            "username": "testuser",
+            "password": "TestPass123!",
+            "email_code": "000000"
+        }
+        self.client.post(self.login_url, login_data, format='json')
+        self.assertIsNone(cache.get(cache_key))
+
     def test_login_with_valid_mfa_code(self):
         # First login without MFA code to trigger sending
         login_data = {
@@ -125,16 +218,27 @@ class EncryptedViews(APITestCase):
         response = self.client.post(self.login_url, login_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
 
+        # The code is queued, not sent, until the outbox worker runs.
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
         # Retrieve the MFA code from the cache
         cache_key = f"mfa_code_{self.user.id}"
-        valid_code = cache.get(cache_key)
-        self.assertIsNotNone(valid_code, "MFA code not set in cache")
+        entry = cache.get(cache_key)
+        self.assertIsNotNone(entry, "MFA code not set in cache")
+        valid_code = entry["code"]
+        self.assertIn(str(valid_code), mail.outbox[0].body)
 
         # Now, login with the MFA code
         login_data["email_code"] = str(valid_code)
         response = self.client.post(self.login_url, login_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        # The code is single-use.
+        response = self.client.post(self.login_url, login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
     def test_profile_view_authenticated(self):
         # Log in the user first (simulate successful login by setting a JWT cookie manually)
         refresh = RefreshToken.for_user(self.user)
@@ -217,6 +321,17 @@ class EncryptedViews(APITestCase):
         self.assertIn(file_id1, returned_ids)
         self.assertIn(file_id2, returned_ids)
 
+    def test_file_list_never_reads_payloads(self):
+        """
+        Test that listing files does not query the payload table.
+        """
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('allFiles'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in queries.captured_queries:
+            self.assertNotIn("api_filepayload", query["sql"])
+
     def test_file_metadata_view_owner(self):
         """
         Test that FileMetadataView returns all metadata for the owner.
@@ -281,7 +396,114 @@ class EncryptedViews(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         # The decrypted content should match the original content.
-        self.assertEqual(response.content, original_content)
+        self.assertEqual(b"".join(response.streaming_content),
+                         original_content)
+
+    def test_upload_stored_as_segments(self):
+        """
+        Test that an upload larger than one segment is split into sealed segments
+        and decrypts back to the original content.
+        """
+        original_content = os.urandom(SEGMENT_SIZE * 2 + 100)
+        file_id, _, _ = self._upload_file(original_content, "large.pdf")
+
+        file_obj = EncryptedFile.objects.get(id=file_id)
+        self.assertEqual(file_obj.storage_format, "segments")
+        self.assertEqual(file_obj.segment_count, 3)
+        self.assertEqual(FileSegment.objects.filter(file=file_obj).count(), 3)
+
+        url = reverse('filesView', args=[file_id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content),
+                         original_content)
+
+    def test_upload_uses_wrapped_data_key(self):
+        """
+        Test that new uploads get their own data key wrapped with the master key.
+        """
+        file_id, _, _ = self._upload_file(b"Envelope content", "env.pdf")
+        file_obj = EncryptedFile.objects.get(id=file_id)
+        self.assertEqual(file_obj.key_version, current_key_version())
+        self.assertIsNotNone(file_obj.wrapped_key)
+        self.assertEqual(b"".join(file_obj.iter_plaintext()),
+                         b"Envelope content")
+
+    def test_migrate_file_keys_command(self):
+        """
+        Test that migrate_file_keys moves legacy salt-keyed blobs onto wrapped
+        data keys and segment storage without changing their content.
+        """
+        plaintext = os.urandom(1000)
+        file_instance, _, _ = self._create_encrypted_file(
+            plaintext, "legacy.pdf")
+        self.assertEqual(file_instance.key_version, LEGACY_KEY_VERSION)
+
+        call_command('migrate_file_keys', stdout=StringIO(), stderr=StringIO())
+
+        file_instance.refresh_from_db()
+        self.assertEqual(file_instance.key_version, current_key_version())
+        self.assertEqual(file_instance.storage_format, "segments")
+        self.assertFalse(
+            FilePayload.objects.filter(file=file_instance).exists())
+        self.assertEqual(b"".join(file_instance.iter_plaintext()), plaintext)
+
+    def test_rekey_segmented_legacy_file(self):
+        """
+        Test that rekey re-seals every segment of a salt-keyed segmented file.
+        """
+        plaintext = os.urandom(SEGMENT_SIZE + 10)
+        salt_bytes = os.urandom(16)
+        iv_bytes = os.urandom(12)
+        file_instance = EncryptedFile.objects.create(
+            owner=self.owner,
+            file_name="legacy_segments.pdf",
+            salt=base64.b64encode(salt_bytes).decode(),
+            iv=base64.b64encode(iv_bytes).decode(),
+            storage_format="segments")
+        file_instance.store_segments(
+            encrypt_segments([plaintext], derive_backend_key(salt_bytes),
+                             iv_bytes))
+
+        file_instance.rekey()
+
+        file_instance.refresh_from_db()
+        self.assertEqual(file_instance.key_version, current_key_version())
+        self.assertEqual(file_instance.segment_count, 2)
+        self.assertEqual(b"".join(file_instance.iter_plaintext()), plaintext)
+
+    def test_master_key_rotation(self):
+        """
+        Test that files wrapped with an old master key still open, and that
+        migrate_file_keys moves them onto a new secret so the old one can be
+        removed.
+        """
+        old_secret, new_secret = b"old-master-secret", b"new-master-secret"
+        with override_settings(BACKEND_MASTER_KEYS={1: old_secret},
+                               BACKEND_MASTER_KEY_VERSION=1):
+            file_id, _, _ = self._upload_file(b"Rotated content", "rot.pdf")
+            old_key = master_key(1)
+        self.assertEqual(EncryptedFile.objects.get(id=file_id).key_version, 1)
+
+        with override_settings(BACKEND_MASTER_KEYS={
+                1: old_secret,
+                2: new_secret
+        },
+                               BACKEND_MASTER_KEY_VERSION=2):
+            self.assertEqual(master_key(1), old_key)
+            call_command('migrate_file_keys',
+                         stdout=StringIO(),
+                         stderr=StringIO())
+
+        with override_settings(BACKEND_MASTER_KEYS={2: new_secret},
+                               BACKEND_MASTER_KEY_VERSION=2):
+            file_obj = EncryptedFile.objects.get(id=file_id)
+            self.assertEqual(file_obj.key_version, 2)
+            self.assertEqual(b"".join(file_obj.iter_plaintext()),
+                             b"Rotated content")
+            with self.assertRaises(ImproperlyConfigured):
+                master_key(1)
+        self.assertNotEqual(master_key(1), old_key)
 
     def _encrypt_test_file(self, plaintext, filename="test.pdf"):
         """
@@ -308,10 +530,11 @@ class EncryptedViews(APITestCase):
         ciphertext, salt_b64, iv_b64 = self._encrypt_test_file(
             plaintext, filename)
         file_instance = EncryptedFile.objects.create(owner=self.owner,
-                                                     file_data=ciphertext,
                                                      file_name=filename,
                                                      salt=salt_b64,
-                                                     iv=iv_b64)
+                                                     iv=iv_b64,
+                                                     size_bytes=len(plaintext))
+        FilePayload.objects.create(file=file_instance, data=ciphertext)
         return file_instance, salt_b64, iv_b64
 
     def test_generate_public_link_view(self):
@@ -327,11 +550,12 @@ class EncryptedViews(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn("public_url", response.data)
         self.assertIn("expires", response.data)
-        # Verify that the file instance now has a public_token set.
-        file_instance.refresh_from_db()
-        self.assertIsNotNone(file_instance.public_token)
+        # Verify that the file now has a link for the returned token.
+        link = PublicLink.lookup(response.data["public_url"])
+        self.assertEqual(link.file, file_instance)
+        self.assertEqual(link.remaining_downloads, 1)
         # Also, expires should be in the future.
-        self.assertGreater(file_instance.public_token_expires, timezone.now())
+        self.assertGreater(link.expires_at, timezone.now())
 
     def test_public_view_metadata(self):
         """
@@ -341,8 +565,7 @@ class EncryptedViews(APITestCase):
         file_instance, salt_b64, iv_b64 = self._create_encrypted_file(
             b"Metadata test", "metadata.pdf")
         # Generate a public link (simulate 24-hour validity)
-        file_instance.generate_public_link(hours_valid=24)
-        public_token = file_instance.public_token
+        _, public_token = PublicLink.create_for(file_instance, hours_valid=24)
 
         url = reverse('public-metadata', args=[public_token])
         response = self.client.get(url)
@@ -361,17 +584,169 @@ class EncryptedViews(APITestCase):
         file_instance, _, _ = self._create_encrypted_file(
             plaintext, "expired.pdf")
         # Generate a public link and manually set expiration to the past.
-        file_instance.generate_public_link(hours_valid=1)
-        file_instance.public_token_expires = timezone.now() - timedelta(
-            minutes=1)
-        file_instance.save()
-        public_token = file_instance.public_token
+        link, public_token = PublicLink.create_for(file_instance,
+                                                   hours_valid=1)
+        link.expires_at = timezone.now() - timedelta(minutes=1)
+        link.save()
 
         url = reverse('public-file', args=[public_token])
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_410_GONE)
         self.assertIn("expired", response.json().get("error", "").lower())
 
+    def test_public_file_retrieve_view_claims_the_link(self):
+        """
+        Test that PublicFileRetrieveView uses up the download before
+        streaming the decrypted file, so a second download is refused.
+        """
+        plaintext = b"Public download content"
+        file_instance, _, _ = self._create_encrypted_file(
+            plaintext, "public.pdf")
+        link, public_token = PublicLink.create_for(file_instance,
+                                                   hours_valid=1)
+
+        url = reverse('public-file', args=[public_token])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        link.refresh_from_db()
+        self.assertEqual(link.remaining_downloads, 0)
+        self.assertEqual(b"".join(response.streaming_content), plaintext)
+
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_410_GONE)
+
+    def test_file_view_single_range(self):
+        """
+        Test that a Range spanning a segment boundary returns 206 with only the
+        requested bytes.
+        """
+        original_content = os.urandom(SEGMENT_SIZE + 500)
+        file_id, _, _ = self._upload_file(original_content, "ranged.pdf")
+        url = reverse('filesView', args=[file_id])
+        first = SEGMENT_SIZE - 10
+        response = self.client.get(url, HTTP_RANGE=f"bytes={first}-{first + 19}")
+        self.assertEqual(response.status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"],
+                         f"bytes {first}-{first + 19}/{len(original_content)}")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(b"".join(response.streaming_content),
+                         original_content[first:first + 20])
+
+    def test_file_view_multiple_ranges(self):
+        """
+        Test that several ranges are returned as multipart/byteranges.
+        """
+        original_content = os.urandom(1000)
+        file_id, _, _ = self._upload_file(original_content, "multi.pdf")
+        url = reverse('filesView', args=[file_id])
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9,-10")
+        self.assertEqual(response.status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+        self.assertTrue(
+            response["Content-Type"].startswith("multipart/byteranges"))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(body), int(response["Content-Length"]))
+        self.assertIn(b"Content-Range: bytes 0-9/1000", body)
+        self.assertIn(b"Content-Range: bytes 990-999/1000", body)
+        self.assertIn(original_content[:10], body)
+        self.assertIn(original_content[-10:], body)
+
+    def test_file_view_unsatisfiable_range(self):
+        """
+        Test that a range beyond the end of the file returns 416.
+        """
+        file_id, _, _ = self._upload_file(b"short", "short.pdf")
+        url = reverse('filesView', args=[file_id])
+        response = self.client.get(url, HTTP_RANGE="bytes=100-200")
+        self.assertEqual(response.status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */5")
+
+    def test_file_view_ignores_non_ascii_range_digits(self):
+        """
+        Test that a Range with superscript digits is ignored and the whole
+        file is served.
+        """
+        file_id, _, _ = self._upload_file(b"digits", "digits.pdf")
+        url = reverse('filesView', args=[file_id])
+        for header in ("bytes=\u00b2-", "bytes=0-\u00b9", "bytes=-\u00b3"):
+            response = self.client.get(url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b"".join(response.streaming_content), b"digits")
+
+    def test_file_view_stale_if_range_returns_full_file(self):
+        """
+        Test that a Range is ignored when If-Range does not match the ETag.
+        """
+        original_content = b"If-Range content"
+        file_id, _, _ = self._upload_file(original_content, "ifrange.pdf")
+        url = reverse('filesView', args=[file_id])
+        response = self.client.get(url,
+                                   HTTP_RANGE="bytes=0-1",
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content),
+                         original_content)
+
+    def test_public_link_download_can_be_resumed(self):
+        """
+        Test that the first range uses up a single-use link and the rest of
+        the file can still be fetched within the resume window.
+        """
+        plaintext = b"0123456789"
+        file_instance, _, _ = self._create_encrypted_file(
+            plaintext, "resume.pdf")
+        link, public_token = PublicLink.create_for(file_instance,
+                                                   hours_valid=1)
+        url = reverse('public-file', args=[public_token])
+
+        response = self.client.get(url, HTTP_RANGE="bytes=0-4")
+        self.assertEqual(b"".join(response.streaming_content), b"01234")
+        link.refresh_from_db()
+        self.assertEqual(link.remaining_downloads, 0)
+
+        response = self.client.get(url, HTTP_RANGE="bytes=5-")
+        self.assertEqual(response.status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), b"56789")
+
+        # Not once the window has passed.
+        PublicLink.objects.filter(pk=link.pk).update(
+            resume_until=timezone.now())
+        self.assertEqual(
+            self.client.get(url, HTTP_RANGE="bytes=5-").status_code,
+            status.HTTP_410_GONE)
+
+    def test_repeated_partial_ranges_use_up_the_link(self):
+        """
+        Test that partial ranges, whether from the start or resuming, cannot
+        be fetched again and again from a used-up link.
+        """
+        plaintext = b"0123456789"
+        file_instance, _, _ = self._create_encrypted_file(
+            plaintext, "partial.pdf")
+        _, public_token = PublicLink.create_for(file_instance,
+                                                hours_valid=1,
+                                                max_downloads=2)
+        url = reverse('public-file', args=[public_token])
+
+        statuses = [
+            self.client.get(url, HTTP_RANGE="bytes=0-8").status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [status.HTTP_206_PARTIAL_CONTENT] * 2 +
+                         [status.HTTP_410_GONE])
+
+        # Resumes within the window cover one more copy of the file: 10
+        # bytes, so a third range of 4 is refused.
+        statuses = [
+            self.client.get(url, HTTP_RANGE="bytes=1-4").status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [status.HTTP_206_PARTIAL_CONTENT] * 2 +
+                         [status.HTTP_410_GONE])
+
     def test_share_file_view_success(self):
         """
         Test that ShareFileView shares a file with specified users.
@@ -421,6 +796,94 @@ class EncryptedViews(APITestCase):
         errors = response.json().get("error")
         self.assertTrue(len(errors) >= 1)
 
+    def test_share_file_view_reports_each_recipient(self):
+        """
+        Test that valid recipients are shared with even if others are
+        rejected, and that the response has one result per recipient.
+        """
+        self.client.force_authenticate(user=self.owner)
+        file_instance, _, _ = self._create_encrypted_file(
+            b"Partial share", "partial.pdf")
+        url = reverse('share-file', args=[file_instance.id])
+        payload = {
+            "shares": [{
+                "user": "shared",
+                "access_type": "view"
+            }, {
+                "user": "nonexistent",
+                "access_type": "view"
+            }]
+        }
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([r["status"] for r in response.json()["results"]],
+                         ["shared", "error"])
+        self.assertTrue(
+            file_instance.shared_with.filter(username="shared").exists())
+
+    def test_share_file_view_query_count_is_constant(self):
+        """
+        Test that sharing with many users takes a fixed number of queries and
+        that sharing again updates the access type in place.
+        """
+        self.client.force_authenticate(user=self.owner)
+        file_instance, _, _ = self._create_encrypted_file(
+            b"Many recipients", "many.pdf")
+        User.objects.bulk_create(
+            User(username=f"recipient{i}") for i in range(50))
+        url = reverse('share-file', args=[file_instance.id])
+        for access_type in ("view", "download"):
+            payload = {
+                "shares": [{
+                    "user": f"recipient{i}",
+                    "access_type": access_type
+                } for i in range(50)]
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(queries), 4)
+        self.assertEqual(
+            FileShare.objects.filter(file=file_instance,
+                                     access_type="download").count(), 50)
+
+    def test_bulk_share_files(self):
+        """
+        Test sharing several files with several users in one request.
+        """
+        self.client.force_authenticate(user=self.owner)
+        files = [
+            self._create_encrypted_file(b"Bulk", f"bulk{i}.pdf")[0]
+            for i in range(3)
+        ]
+        payload = {
+            "files": [f.id for f in files],
+            "shares": [{
+                "user": "shared",
+                "access_type": "download"
+            }, {
+                "user": "testuser",
+                "access_type": "view"
+            }]
+        }
+        response = self.client.post(reverse('share-files'),
+                                    payload,
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            FileShare.objects.filter(file__in=files).count(), 6)
+
+        # Files the caller does not own are rejected without sharing anything.
+        payload["files"].append(self.test_file2.id)
+        payload["shares"] = [{"user": "adminuser", "access_type": "view"}]
+        response = self.client.post(reverse('share-files'),
+                                    payload,
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json()["files"], [self.test_file2.id])
+        self.assertFalse(
+            FileShare.objects.filter(user__username="adminuser").exists())
+
     def test_admin_login_success(self):
         """
             Test that an admin user can successfully log in via AdminLoginView.
@@ -476,3 +939,2163 @@ class EncryptedViews(APITestCase):
             self.assertIn("file_name", file)
             self.assertIn("owner", file)
             self.assertIn("shared_with", file)
+
+
+class FileListPaginationTests(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='lister',
+                                              password='listerpass')
+        self.other = User.objects.create_user(username='sharer',
+                                              password='sharerpass')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.owner)
+        self.url = reverse('allFiles')
+        self.owned = [
+            EncryptedFile.objects.create(owner=self.owner,
+                                         file_name=f"owned{i}.txt",
+                                         iv="iv",
+                                         size_bytes=i * 10) for i in range(5)
+        ]
+        self.shared = [
+            EncryptedFile.objects.create(owner=self.other,
+                                         file_name=f"shared{i}.txt",
+                                         iv="iv",
+                                         size_bytes=i * 10 + 5)
+            for i in range(3)
+        ]
+        for file_instance in self.shared:
+            FileShare.objects.create(file=file_instance, user=self.owner)
+        EncryptedFile.objects.create(owner=self.other,
+                                     file_name="private.txt",
+                                     iv="iv")
+
+    def _walk(self, **params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, **({"cursor": cursor} if cursor else {}))
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(f["id"] for f in response.data["files"])
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_every_visible_file_once(self):
+        ids = self._walk(page_size=3)
+        expected = sorted(self.owned + self.shared,
+                          key=lambda f: (f.uploaded_at, f.id),
+                          reverse=True)
+        self.assertEqual(ids, [f.id for f in expected])
+
+    def test_sort_by_size_ascending(self):
+        ids = self._walk(page_size=2, sort="size_bytes")
+        expected = sorted(self.owned + self.shared,
+                          key=lambda f: (f.size_bytes, f.id))
+        self.assertEqual(ids, [f.id for f in expected])
+
+    def test_sort_by_name_descending(self):
+        ids = self._walk(page_size=4, sort="-file_name")
+        expected = sorted(self.owned + self.shared,
+                          key=lambda f: (f.file_name, f.id),
+                          reverse=True)
+        self.assertEqual(ids, [f.id for f in expected])
+
+    def test_scope_filters(self):
+        self.assertEqual(set(self._walk(scope="owned")),
+                         {f.id for f in self.owned})
+        self.assertEqual(set(self._walk(scope="shared")),
+                         {f.id for f in self.shared})
+
+    def test_page_query_count_is_constant(self):
+        """
+        Test that a deep page costs the same number of queries as the first.
+        """
+        first = self.client.get(self.url, {"page_size": 2})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {
+                "page_size": 2,
+                "cursor": first.data["next_cursor"]
+            })
+        self.assertEqual(len(queries), 2)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({"cursor": "not-a-cursor"}, {"sort": "owner"},
+                       {"scope": "everyone"}, {"page_size": "0"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST, params)
+
+    def test_cursor_is_tied_to_its_sort_order(self):
+        first = self.client.get(self.url, {"page_size": 2})
+        response = self.client.get(self.url, {
+            "sort": "file_name",
+            "cursor": first.data["next_cursor"]
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class EndpointQueryBudgetTests(TransactionTestCase):
+    """
+    Checks the query counts recorded in bench_baseline.json at a small
+    volume, so N+1 regressions fail the regular test run. Wall time and
+    memory budgets are only checked by the bench_endpoints command.
+    """
+    databases = {"default", BLOB_DATABASE}
+
+    def test_every_endpoint_within_query_budget(self):
+        cache.clear()
+        budgets = json.loads(DEFAULT_BASELINE.read_text())['endpoints']
+        bench, admin = seed(users=20,
+                            files=100,
+                            shares=400,
+                            rng=random.Random(0))
+        scenarios = build_scenarios(bench, admin)
+        for name in (p.name for p in urlpatterns if p.name):
+            with self.subTest(endpoint=name):
+                self.assertIn(name, scenarios)
+                self.assertIn(name, budgets)
+                result = run_scenario(scenarios[name], trace_memory=False)
+                self.assertLessEqual(result['queries'],
+                                     budgets[name]['queries'])
+
+
+class AccessCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        access_cache.reset_stats()
+        self.owner = User.objects.create_user(username='acl-owner',
+                                              password='ownerpass')
+        self.reader = User.objects.create_user(username='acl-reader',
+                                               password='readerpass')
+        self.file = EncryptedFile.objects.create(owner=self.owner,
+                                                 file_name="acl.pdf",
+                                                 iv="iv",
+                                                 salt="salt")
+        self.client.force_authenticate(user=self.reader)
+        self.url = reverse('file-metadata', args=[self.file.pk])
+
+    def test_repeated_opens_hit_the_cache(self):
+        FileShare.objects.create(file=self.file,
+                                 user=self.reader,
+                                 access_type='download')
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()["access_type"], "download")
+        self.assertEqual(len(queries), 1)  # the file row only
+        self.assertEqual(access_cache.stats()["hits"], 1)
+        self.assertEqual(access_cache.stats()["hit_rate"], 0.5)
+
+    def test_sharing_invalidates_a_cached_denial(self):
+        self.assertEqual(self.client.get(self.url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(reverse('share-file',
+                                            args=[self.file.pk]),
+                                    {
+                                        "shares": [{
+                                            "user": "acl-reader",
+                                            "access_type": "view"
+                                        }]
+                                    },
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.reader)
+        self.assertEqual(self.client.get(self.url).json()["access_type"],
+                         "view")
+
+    def test_unsharing_and_ownership_changes_invalidate(self):
+        share = FileShare.objects.create(file=self.file, user=self.reader)
+        self.assertEqual(self.client.get(self.url).status_code,
+                         status.HTTP_200_OK)
+        share.delete()
+        self.assertEqual(self.client.get(self.url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        self.file.owner = self.reader
+        self.file.save()
+        self.assertEqual(self.client.get(self.url).json()["access_type"],
+                         "owner")
+
+    def test_deleting_a_file_invalidates_its_entries(self):
+        FileShare.objects.create(file=self.file, user=self.reader)
+        self.client.get(self.url)
+        self.file.delete()
+        self.assertIsNone(access_cache.get(self.reader.pk, self.file.pk))
+        self.assertIsNone(access_cache.get(self.owner.pk, self.file.pk))
+
+    def test_strict_mode_always_checks_the_database(self):
+        FileShare.objects.create(file=self.file, user=self.reader)
+        with self.settings(ACL_CACHE={"STRICT": True}):
+            self.client.get(self.url)
+            # A write that bypasses signals is still seen at once.
+            FileShare.objects.filter(file=self.file).update(
+                access_type='download')
+            response = self.client.get(self.url)
+        self.assertEqual(response.json()["access_type"], "download")
+        self.assertEqual(access_cache.stats()["hits"], 0)
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """
+    In-memory backend that counts how often a connection is opened.
+    """
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+
+class FlakyEmailBackend(CountingEmailBackend):
+    """
+    Fails the first `failures` messages and, like the SMTP backend, opens a
+    connection of its own for messages sent while it is closed.
+    """
+    failures = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    def open(self):
+        if self.is_open:
+            return False
+        super().open()
+        self.is_open = True
+        return True
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, email_messages):
+        new_connection = self.open()
+        try:
+            if FlakyEmailBackend.failures:
+                FlakyEmailBackend.failures -= 1
+                raise smtplib.SMTPServerDisconnected(
+                    "Connection unexpectedly closed")
+            return super().send_messages(email_messages)
+        finally:
+            if new_connection:
+                self.close()
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+
+class OutboundEmailTests(TestCase):
+
+    def _queue(self, count=1):
+        for i in range(count):
+            OutboundEmail.queue("Subject", f"Body {i}", "from@example.com",
+                                [f"to{i}@example.com"])
+
+    @override_settings(EMAIL_BACKEND='api.tests.CountingEmailBackend')
+    def test_batch_is_sent_over_one_connection(self):
+        CountingEmailBackend.opened = 0
+        self._queue(5)
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(
+            OutboundEmail.objects.filter(status='sent').count(), 5)
+        self.assertFalse(OutboundEmail.objects.exclude(body='').exists())
+
+    @override_settings(EMAIL_BACKEND='api.tests.FlakyEmailBackend')
+    def test_connection_is_reopened_once_after_a_failure(self):
+        CountingEmailBackend.opened = 0
+        FlakyEmailBackend.failures = 1
+        self._queue(4)
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        # One for the batch and one after the failure, not one per message.
+        self.assertEqual(CountingEmailBackend.opened, 2)
+        self.assertEqual(
+            OutboundEmail.objects.filter(status='pending').count(), 1)
+
+    @override_settings(EMAIL_BACKEND='api.tests.FailingEmailBackend')
+    def test_failures_back_off_then_give_up(self):
+        self._queue()
+        call_command('send_queued_email', stdout=StringIO())
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, 'pending')
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("unexpectedly closed", email.last_error)
+        delay = email.next_attempt_at - timezone.now()
+        self.assertGreater(delay, timedelta(seconds=5))
+        self.assertLessEqual(delay, timedelta(seconds=10))
+
+        # Not due yet, so a second run leaves it alone.
+        call_command('send_queued_email', stdout=StringIO())
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+
+        outbox = dict(settings.EMAIL_OUTBOX, RETRY_DELAY=timedelta(0))
+        with self.settings(EMAIL_OUTBOX=outbox):
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            call_command('send_queued_email', stdout=StringIO())
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'failed')
+        self.assertEqual(email.attempts, outbox['MAX_ATTEMPTS'])
+        self.assertEqual(email.body, '')
+
+    def test_claimed_emails_are_not_claimed_twice(self):
+        self._queue(3)
+        first = OutboundEmail.claim_batch(2, timedelta(minutes=5))
+        second = OutboundEmail.claim_batch(10, timedelta(minutes=5))
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({e.pk for e in first} & {e.pk for e in second})
+
+    def test_stale_emails_are_never_sent(self):
+        OutboundEmail.queue("Subject", "Code 123456", "from@example.com",
+                            ["to@example.com"],
+                            discard_after=timezone.now() -
+                            timedelta(seconds=1))
+        self.assertEqual(OutboundEmail.claim_batch(10, timedelta(minutes=5)),
+                         [])
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_emails_going_stale_after_the_claim_are_dropped(self):
+        self._queue(2)
+        with mock.patch.object(OutboundEmail, "is_stale", return_value=True):
+            call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_mfa_code_email_expires_with_the_code(self):
+        User.objects.create_user(username="mfauser",
+                                 password="MfaPass123!",
+                                 email="mfa@example.com")
+        cache.clear()
+        response = self.client.post(reverse('login'), {
+            "username": "mfauser",
+            "password": "MfaPass123!"
+        },
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        email = OutboundEmail.objects.get()
+        self.assertAlmostEqual(email.discard_after,
+                               timezone.now() + timedelta(seconds=300),
+                               delta=timedelta(seconds=5))
+
+
+@skipUnless(aiosmtpd, "aiosmtpd is not installed")
+class OutboundEmailSMTPTests(APITestCase):
+    """
+    Delivers through the real SMTP backend to a local aiosmtpd stand-in that
+    answers every message slowly, and checks logins do not wait for it.
+    """
+    SMTP_DELAY = 1.0
+
+    def setUp(self):
+        cache.clear()  # no rate-limit buckets left over from earlier runs
+        self.sessions = 0
+        self.received = []
+        test = self
+
+        class Handler:
+
+            async def handle_EHLO(self, server, session, envelope, hostname,
+                                  responses):
+                test.sessions += 1
+                session.host_name = hostname
+                return responses
+
+            async def handle_DATA(self, server, session, envelope):
+                await asyncio.sleep(test.SMTP_DELAY)
+                test.received.append(envelope)
+                return "250 OK"
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.controller = SMTPController(Handler(),
+                                         hostname="127.0.0.1",
+                                         port=port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        self.smtp_settings = self.settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+            EMAIL_USE_TLS=False)
+        self.smtp_settings.enable()
+        self.addCleanup(self.smtp_settings.disable)
+        User.objects.create_user(username="smtpuser",
+                                 password="SmtpPass123!",
+                                 email="smtpuser@example.com")
+
+    def test_login_latency_is_independent_of_smtp(self):
+        timings = []
+        for _ in range(10):
+            started = time.perf_counter()
+            response = self.client.post(reverse('login'), {
+                "username": "smtpuser",
+                "password": "SmtpPass123!"
+            },
+                                        format='json')
+            timings.append(time.perf_counter() - started)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        p99 = sorted(timings)[int(len(timings) * 0.99)]
+        self.assertLess(p99, self.SMTP_DELAY)
+
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEqual(len(self.received), 10)
+        self.assertEqual(self.sessions, 1)
+
+
+def _set_in_child(path, key, value):
+    SQLiteCache(path, {}).set(key, value)
+
+
+def _take_in_child(path, key, attempts):
+    cache = SQLiteCache(path, {})
+    return sum(
+        cache.take_token(key, 1 / 3600, 30) == 0 for _ in range(attempts))
+
+
+class SharedCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.path = os.path.join(directory, "cache.sqlite3")
+        self.cache = SQLiteCache(self.path, {})
+
+    def test_basic_operations_and_expiry(self):
+        self.cache.set("a", {"n": 1})
+        self.assertEqual(self.cache.get("a"), {"n": 1})
+        self.assertFalse(self.cache.add("a", 2))
+        self.assertTrue(self.cache.add("b", 2))
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {
+            "a": {
+                "n": 1
+            },
+            "b": 2
+        })
+        self.cache.set("gone", 1, timeout=0)
+        self.assertIsNone(self.cache.get("gone"))
+        self.assertTrue(self.cache.add("gone", 3))  # expired entries are free
+        self.assertTrue(self.cache.delete("a"))
+        self.assertFalse(self.cache.has_key("a"))
+
+    def test_pop_returns_the_value_once(self):
+        self.cache.set("code", 123456)
+        self.assertEqual(self.cache.pop("code"), 123456)
+        self.assertIsNone(self.cache.pop("code"))
+        self.cache.set("stale", 1, timeout=0)
+        self.assertIsNone(self.cache.pop("stale"))
+
+    def test_racing_pops_get_one_value(self):
+        self.cache.set("code", 123456)
+        barrier = threading.Barrier(8)
+
+        def pop():
+            barrier.wait()
+            return self.cache.pop("code")
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: pop(), range(8)))
+        self.assertEqual([r for r in results if r is not None], [123456])
+
+    def test_entries_are_shared_between_processes(self):
+        child = multiprocessing.get_context("fork").Process(
+            target=_set_in_child, args=(self.path, "from-child", 42))
+        child.start()
+        child.join()
+        self.assertEqual(self.cache.get("from-child"), 42)
+
+    def test_locmem_pop(self):
+        local = LocMemCache("pop-test", {})
+        local.set("code", 1)
+        self.assertEqual(local.pop("code"), 1)
+        self.assertEqual(local.pop("code", "missing"), "missing")
+
+    def test_take_token_refills_over_time(self):
+        for backend in (self.cache, LocMemCache("bucket-test", {})):
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(backend.take_token("bucket", 20, 2), 0)
+                self.assertEqual(backend.take_token("bucket", 20, 2), 0)
+                wait = backend.take_token("bucket", 20, 2)
+                self.assertGreater(wait, 0)
+                self.assertLessEqual(wait, 0.05)
+                time.sleep(wait)
+                self.assertEqual(backend.take_token("bucket", 20, 2), 0)
+
+    def test_buckets_are_shared_between_processes(self):
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            taken = pool.starmap(_take_in_child,
+                                 [(self.path, "shared-bucket", 20)] * 4)
+        # Refilling at one token an hour, only the initial 30 are handed out.
+        self.assertEqual(sum(taken), 30)
+
+
+class UserCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="cached",
+                                             password="cachedpass",
+                                             email="cached@example.com")
+        self.client.cookies["access_token"] = str(
+            RefreshToken.for_user(self.user).access_token)
+
+    def _user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [
+            q["sql"] for q in queries if 'FROM "auth_user"' in q["sql"]
+        ]
+
+    def test_cached_user_skips_the_user_query(self):
+        response, user_queries = self._user_queries(reverse("profile"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(user_queries), 1)
+        response, user_queries = self._user_queries(reverse("profile"))
+        self.assertEqual(response.data["user"], "cached")
+        self.assertEqual(user_queries, [])
+
+    def test_account_changes_evict_the_cached_user(self):
+        self.client.get(reverse("profile"))
+        self.user.is_staff = True
+        self.user.save()
+        response, user_queries = self._user_queries(reverse("admin-files"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(user_queries), 1)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(user_cache.get(self.user.id))
+
+    def test_recording_a_login_keeps_the_entry(self):
+        self.client.get(reverse("profile"))
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=["last_login"])
+        _, user_queries = self._user_queries(reverse("profile"))
+        self.assertEqual(user_queries, [])
+
+    def test_cache_holds_no_password_hash(self):
+        self.client.get(reverse("profile"))
+        claims = cache.get(user_cache.key(self.user.id))
+        self.assertEqual(set(claims), set(UserCache.FIELDS))
+        self.assertNotIn(self.user.password.encode(),
+                         pickle.dumps(claims))
+
+        user, _ = user_cache.get(self.user.id)
+        self.assertEqual((user.pk, user.username, user.is_staff),
+                         (self.user.pk, "cached", False))
+        # Fields left out of the cache are read from the database.
+        with self.assertNumQueries(1):
+            self.assertEqual(user.date_joined, self.user.date_joined)
+
+    def test_password_change_rejects_older_tokens(self):
+        with mock.patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True):
+            self.client.cookies["access_token"] = str(
+                RefreshToken.for_user(self.user).access_token)
+            self.assertEqual(
+                self.client.get(reverse("profile")).status_code,
+                status.HTTP_200_OK)
+            claims = cache.get(user_cache.key(self.user.id))
+            self.assertIn("password_md5", claims)
+
+            # Bypass the signal, as if the entry were cached again by a
+            # request racing the password change.
+            password = make_password("newpass")
+            User.objects.filter(pk=self.user.pk).update(password=password)
+            cache.set(
+                user_cache.key(self.user.id),
+                dict(claims, password_md5=get_md5_hash_password(password)))
+            response = self.client.get(reverse("profile"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(USER_CACHE={"ENABLED": False})
+    def test_disabled_cache_always_queries(self):
+        self.client.get(reverse("profile"))
+        _, user_queries = self._user_queries(reverse("profile"))
+        self.assertEqual(len(user_queries), 1)
+
+
+class TokenRevocationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        revocation_list.clear()
+        self.user = User.objects.create_user(username="revoker",
+                                             password="revokerpass")
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access_token = self.refresh.access_token
+        self.access = str(self.access_token)
+
+    def test_refresh_rotates_and_revokes_the_old_token(self):
+        self.client.cookies["refresh_token"] = str(self.refresh)
+        response = self.client.post(reverse("token-refresh"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_refresh = response.cookies["refresh_token"].value
+        self.assertNotEqual(new_refresh, str(self.refresh))
+        self.client.cookies["access_token"] = response.cookies[
+            "access_token"].value
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_200_OK)
+
+        # A refresh token can only be used once.
+        self.client.cookies["refresh_token"] = str(self.refresh)
+        response = self.client.post(reverse("token-refresh"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(
+            RevokedToken.objects.filter(jti=self.refresh["jti"]).exists())
+
+    def test_refresh_requires_an_active_user(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse("token-refresh"),
+                                    {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse("token-refresh"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_both_tokens(self):
+        self.client.cookies["access_token"] = self.access
+        self.client.cookies["refresh_token"] = str(self.refresh)
+        self.assertEqual(
+            self.client.get(reverse("logout")).status_code,
+            status.HTTP_200_OK)
+
+        # Copies of the cookies no longer work.
+        self.client.cookies["access_token"] = self.access
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse("token-refresh"),
+                                    {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(reverse("profile"),
+                                   HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalid_cookie_leaves_the_request_anonymous(self):
+        self.client.cookies["access_token"] = "not-a-token"
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_401_UNAUTHORIZED)
+        self.client.cookies["refresh_token"] = str(self.refresh)
+        self.assertEqual(
+            self.client.post(reverse("token-refresh")).status_code,
+            status.HTTP_200_OK)
+
+    def test_checks_do_not_query_the_revocation_table(self):
+        self.client.cookies["access_token"] = self.access
+        self.client.get(reverse("profile"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("profile"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(
+            [q for q in queries if "api_revokedtoken" in q["sql"]])
+
+    @override_settings(TOKEN_REVOCATION={"SYNC_INTERVAL": 0})
+    def test_revocations_by_other_workers_are_picked_up(self):
+        self.client.cookies["access_token"] = self.access
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_200_OK)
+        # What revoke() does in another process.
+        RevokedToken.objects.create(jti=self.access_token["jti"],
+                                    expires_at=timezone.now() +
+                                    timedelta(days=1))
+        # Without a new version the table is not read again.
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_200_OK)
+        cache.set(VERSION_KEY, "other-worker")
+        self.assertEqual(
+            self.client.get(reverse("profile")).status_code,
+            status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_REVOCATION={"RELOAD_INTERVAL": 0})
+    def test_reload_drops_expired_tokens(self):
+        RevokedToken.objects.create(jti="expired",
+                                    expires_at=timezone.now() -
+                                    timedelta(seconds=1))
+        revocation_list.revoke(self.refresh)
+        revocation_list.sync(force=True)
+        self.assertFalse(revocation_list.is_revoked("expired"))
+        self.assertTrue(revocation_list.is_revoked(self.refresh["jti"]))
+        self.assertEqual(len(revocation_list), 1)
+
+    @override_settings(TOKEN_REVOCATION={
+        "SYNC_INTERVAL": 0,
+        "RELOAD_INTERVAL": 0
+    })
+    def test_checks_do_not_wait_for_a_reload(self):
+        revocation_list.revoke(self.refresh)
+        revocation_list.sync(force=True)
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_pull(jtis, last_id):
+            started.set()
+            finish.wait(10)
+            jtis.add("from-table")
+            return 1
+
+        with mock.patch.object(revocation_list, "_pull", slow_pull):
+            reload = threading.Thread(target=revocation_list.sync)
+            reload.start()
+            self.assertTrue(started.wait(10))
+            # Answered from the current set while the reload queries.
+            self.assertTrue(revocation_list.is_revoked(self.refresh["jti"]))
+            self.assertFalse(revocation_list.is_revoked("from-table"))
+            revocation_list.revoke(self.access_token)
+            self.assertTrue(reload.is_alive())
+            finish.set()
+            reload.join(10)
+        # The set swapped in, checked without syncing again.
+        with override_settings(TOKEN_REVOCATION={"SYNC_INTERVAL": 60}):
+            self.assertTrue(revocation_list.is_revoked("from-table"))
+            # Revoked during the reload, so also in the new set.
+            self.assertTrue(
+                revocation_list.is_revoked(self.access_token["jti"]))
+
+
+@override_settings(RATE_LIMITS={
+    "login": {
+        "ip": "5/min",
+        "username": "2/min"
+    },
+    "public-file": {
+        "public_token": "1/min"
+    },
+})
+class RateLimitTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="limited",
+                                             password="limitedpass")
+
+    def _login(self, username, **extra):
+        return self.client.post(reverse("login"), {
+            "username": username,
+            "password": "wrong"
+        },
+                                format="json",
+                                **extra)
+
+    def test_login_is_limited_per_username_before_hashing(self):
+        for _ in range(2):
+            self.assertEqual(
+                self._login("limited").status_code,
+                status.HTTP_401_UNAUTHORIZED)
+        with mock.patch("api.views.authenticate") as authenticate:
+            response = self._login("limited")
+        self.assertEqual(response.status_code,
+                         status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        authenticate.assert_not_called()
+        # Other usernames have buckets of their own.
+        self.assertEqual(
+            self._login("someone-else").status_code,
+            status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_is_limited_per_ip(self):
+        statuses = [
+            self._login(f"user{i}").status_code for i in range(6)
+        ]
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(
+            self._login("user0", REMOTE_ADDR="10.0.0.2").status_code,
+            status.HTTP_401_UNAUTHORIZED)
+
+    def test_spoofed_forwarded_for_shares_the_proxy_seen_bucket(self):
+        # nginx appends the peer address to whatever the client sent.
+        statuses = [
+            self._login(f"user{i}",
+                        REMOTE_ADDR="172.18.0.3",
+                        HTTP_X_FORWARDED_FOR=f"10.9.{i}.1, 203.0.113.7").
+            status_code for i in range(6)
+        ]
+        self.assertEqual(statuses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(
+            self._login("user0",
+                        REMOTE_ADDR="172.18.0.3",
+                        HTTP_X_FORWARDED_FOR="203.0.113.8").status_code,
+            status.HTTP_401_UNAUTHORIZED)
+
+    def test_public_file_is_limited_per_token(self):
+        file_instance = _create_file_from_stream(
+            self.user, "limited.pdf",
+            base64.b64encode(os.urandom(12)).decode(),
+            base64.b64encode(os.urandom(16)).decode(), [b"payload"])
+        _, public_token = PublicLink.create_for(file_instance,
+                                                max_downloads=5)
+        url = reverse("public-file", args=[public_token])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.client.get(url).status_code,
+            status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_endpoints_without_limits_are_not_throttled(self):
+        self.client.force_authenticate(user=self.user)
+        for _ in range(5):
+            self.assertEqual(
+                self.client.get(reverse("profile")).status_code,
+                status.HTTP_200_OK)
+
+
+@override_settings(PASSWORD_HASHING={
+    "MAX_WORKERS": 1,
+    "QUEUE_SIZE": 0,
+    "RETRY_AFTER": 3
+})
+class PasswordHashingTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="hashed",
+                                             password="hashedpass")
+        password_executor.reset_stats()
+
+    def _occupy_executor(self):
+        """
+        Hold the only hashing slot until the test ends.
+        """
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=password_executor.run, args=(hold, ))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        started.wait()
+
+    def test_verification_runs_on_the_executor(self):
+        self.assertTrue(self.user.check_password("hashedpass"))
+        self.assertFalse(self.user.check_password("wrong"))
+        stats = password_executor.stats()
+        self.assertEqual(stats["completed"], 2)
+        self.assertEqual(stats["running"] + stats["queued"], 0)
+
+    def test_full_executor_rejects_logins_at_once(self):
+        self._occupy_executor()
+        started = time.perf_counter()
+        response = self.client.post(reverse("login"), {
+            "username": "hashed",
+            "password": "hashedpass"
+        },
+                                    format="json")
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertEqual(password_executor.stats()["rejected"], 1)
+
+    def test_full_executor_rejects_registrations_with_retry_after(self):
+        self._occupy_executor()
+        response = self.client.post(reverse("register"), {
+            "username": "newcomer",
+            "password": "NewcomerPass123!"
+        },
+                                    format="json")
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "3")
+        self.assertFalse(User.objects.filter(username="newcomer").exists())
+
+    @override_settings(ARGON2={
+        "TIME_COST": 1,
+        "MEMORY_COST": 8192,
+        "PARALLELISM": 1
+    })
+    def test_cost_parameters_come_from_settings(self):
+        self.assertIn("$m=8192,t=1,p=1$", make_password("secret"))
+        # Hashes made with the old parameters are upgraded at login.
+        self.assertTrue(self.user.check_password("hashedpass"))
+        self.user.refresh_from_db()
+        self.assertIn("$m=8192,t=1,p=1$", self.user.password)
+
+    def test_calibrate_argon2_prints_settings(self):
+        out = StringIO()
+        call_command("calibrate_argon2",
+                     target_ms=1,
+                     max_memory_mib=16,
+                     min_memory_mib=8,
+                     parallelism=1,
+                     samples=1,
+                     stdout=out)
+        self.assertIn('"TIME_COST": 1', out.getvalue())
+        self.assertIn('"MEMORY_COST": 8192', out.getvalue())
+
+
+class PublicLinkTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username="linker",
+                                              password="linkerpass")
+        self.file = _create_file_from_stream(
+            self.owner, "linked.pdf",
+            base64.b64encode(os.urandom(12)).decode(),
+            base64.b64encode(os.urandom(16)).decode(), [b"linked payload"])
+
+    def test_only_the_token_hash_is_stored(self):
+        link, token = PublicLink.create_for(self.file)
+        self.assertNotIn(token, link.token_hash)
+        self.assertFalse(PublicLink.objects.filter(token_hash=token).exists())
+        self.assertEqual(PublicLink.lookup(token), link)
+        self.assertIsNone(PublicLink.lookup("unknown"))
+
+    def test_claim_is_one_conditional_update(self):
+        link, _ = PublicLink.create_for(self.file, max_downloads=2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(link.claim())
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("UPDATE"))
+        self.assertTrue(link.claim())
+        self.assertFalse(link.claim())
+        link.refresh_from_db()
+        self.assertEqual(link.remaining_downloads, 0)
+
+    def test_downloads_are_limited_per_link(self):
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post(reverse("generate-public-link",
+                                            args=[self.file.pk]),
+                                    {"max_downloads": 2},
+                                    format="json")
+        self.assertEqual(response.data["remaining_downloads"], 2)
+        url = reverse("public-file", args=[response.data["public_url"]])
+        self.client.force_authenticate(user=None)
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b"".join(response.streaming_content),
+                             b"linked payload")
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_410_GONE)
+
+    def test_invalid_limits_are_rejected(self):
+        self.client.force_authenticate(user=self.owner)
+        too_long = settings.PUBLIC_LINKS["MAX_HOURS_VALID"] + 1
+        too_many = settings.PUBLIC_LINKS["MAX_DOWNLOADS"] + 1
+        for data in ({"max_downloads": 0}, {"hours_valid": "soon"},
+                     {"hours_valid": 10**20}, {"hours_valid": too_long},
+                     {"max_downloads": too_many}):
+            response = self.client.post(reverse("generate-public-link",
+                                                args=[self.file.pk]),
+                                        data,
+                                        format="json")
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(PublicLink.objects.exists())
+
+    def test_links_are_revoked_one_at_a_time_by_the_owner(self):
+        _, first = PublicLink.create_for(self.file)
+        _, second = PublicLink.create_for(self.file)
+        revoke_url = reverse("revoke-public-link", args=[first])
+        self.assertIn(
+            self.client.post(revoke_url).status_code,
+            [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+        self.client.force_authenticate(user=User.objects.create_user(
+            username="stranger", password="strangerpass"))
+        self.assertEqual(
+            self.client.post(revoke_url).status_code,
+            status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(user=self.owner)
+        self.assertEqual(
+            self.client.post(revoke_url).status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            self.client.get(reverse("public-metadata",
+                                    args=[first])).status_code,
+            status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            self.client.get(reverse("public-metadata",
+                                    args=[second])).status_code,
+            status.HTTP_200_OK)
+
+
+class PublicLinkRaceTests(TransactionTestCase):
+
+    def test_concurrent_claims_never_exceed_the_limit(self):
+        owner = User.objects.create_user(username="racer", password="racer")
+        file_instance = EncryptedFile.objects.create(owner=owner,
+                                                     file_name="race.pdf",
+                                                     iv="iv")
+        link, _ = PublicLink.create_for(file_instance, max_downloads=3)
+        barrier = threading.Barrier(8)
+
+        def claim():
+            barrier.wait()
+            try:
+                return PublicLink.objects.get(pk=link.pk).claim()
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: claim(), range(8)))
+        self.assertEqual(results.count(True), 3)
+        link.refresh_from_db()
+        self.assertEqual(link.remaining_downloads, 0)
+
+
+class SQLiteTuningTests(TestCase):
+    databases = {"default", READ_ONLY_DATABASE}
+
+    def test_pragmas_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            for name, expected in (("synchronous", 1), ("busy_timeout", 5000),
+                                   ("cache_size", -64 * 1024)):
+                cursor.execute(f"PRAGMA {name}")
+                self.assertEqual(cursor.fetchone()[0], expected)
+
+    def test_read_only_connection_refuses_writes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, "db.sqlite3")
+        with sqlite3.connect(path) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE t (x INTEGER)")
+            db.execute("INSERT INTO t VALUES (1)")
+        reader = SQLiteDatabaseWrapper(
+            {
+                **connection.settings_dict, "NAME": f"file:{path}?mode=ro"
+            }, READ_ONLY_DATABASE)
+        self.addCleanup(reader.close)
+        with reader.cursor() as cursor:
+            cursor.execute("PRAGMA query_only")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("SELECT x FROM t")
+            self.assertEqual(cursor.fetchall(), [(1, )])
+            with self.assertRaises(OperationalError):
+                cursor.execute("INSERT INTO t VALUES (2)")
+
+    def test_router_sends_read_only_reads_to_the_reader(self):
+        router = ReadOnlyRouter()
+        file_instance = EncryptedFile(file_name="a.pdf")
+        file_instance._state.db = READ_ONLY_DATABASE
+        self.assertIsNone(router.db_for_read(EncryptedFile))
+        self.assertEqual(
+            router.db_for_write(EncryptedFile, instance=file_instance),
+            "default")
+        reader = connections[READ_ONLY_DATABASE]
+        name = reader.settings_dict["NAME"]
+        with read_only():
+            # The test mirror cannot see this test's transaction.
+            self.assertEqual(router.db_for_read(EncryptedFile), "default")
+            reader.settings_dict["NAME"] = "file:other.sqlite3?mode=ro"
+            try:
+                self.assertEqual(router.db_for_read(EncryptedFile),
+                                 READ_ONLY_DATABASE)
+            finally:
+                reader.settings_dict["NAME"] = name
+        self.assertFalse(
+            router.allow_migrate(READ_ONLY_DATABASE, "api", "encryptedfile"))
+
+
+class BlobDatabaseTests(TestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="blob-owner",
+                                             password="blobpass")
+        self.iv = base64.b64encode(os.urandom(12)).decode()
+        self.salt = base64.b64encode(os.urandom(16)).decode()
+
+    def _upload(self, content):
+        return _create_file_from_stream(self.user, "blob.pdf", self.iv,
+                                        self.salt, [content])
+
+    def test_payload_is_stored_in_the_blob_database(self):
+        content = os.urandom(SEGMENT_SIZE + 10)
+        file_obj = self._upload(content)
+        self.assertEqual(file_obj.storage_format, "segments")
+        self.assertEqual(
+            FileSegment.objects.using(BLOB_DATABASE).filter(
+                file_id=file_obj.pk).count(), 2)
+        self.assertEqual(b"".join(file_obj.iter_plaintext()), content)
+
+    def test_migrations_keep_blob_models_on_the_migrated_database(self):
+        """
+        Test that data migrations written before the blob database existed
+        still read and write the database they run on.
+        """
+        state = MigrationExecutor(connection).loader.project_state(
+            ("api", "0012_filepayload"))
+        historical = state.apps.get_model("api", "FilePayload")
+        self.assertEqual(router.db_for_write(historical), "default")
+        self.assertEqual(router.db_for_write(FilePayload), BLOB_DATABASE)
+
+    def test_failed_upload_leaves_no_file(self):
+
+        def chunks():
+            yield os.urandom(SEGMENT_SIZE)
+            raise OSError("client went away")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(OSError):
+                _create_file_from_stream(self.user, "broken.pdf", self.iv,
+                                         self.salt, chunks())
+        self.assertFalse(EncryptedFile.objects.exists())
+        self.assertFalse(FileSegment.objects.exists())
+
+    def test_pending_files_are_hidden(self):
+        pending = EncryptedFile.objects.create(owner=self.user,
+                                               file_name="partial.pdf",
+                                               iv=self.iv,
+                                               storage_format="pending")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("allFiles"))
+        self.assertEqual(response.json()["files"], [])
+        response = self.client.get(reverse("file-metadata",
+                                           args=[pending.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_deleting_a_file_deletes_its_blobs_after_commit(self):
+        file_obj = self._upload(b"payload")
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            file_obj.delete()
+            self.assertTrue(FileSegment.objects.exists())
+        self.assertTrue(callbacks)
+        self.assertFalse(FileSegment.objects.exists())
+
+    def test_sweep_removes_orphans_and_abandoned_uploads(self):
+        kept = self._upload(b"kept")
+        orphan = FileSegment.objects.create(file_id=kept.pk + 1000,
+                                            index=0,
+                                            data=b"orphan")
+        FilePayload.objects.create(file_id=kept.pk + 1001, data=b"orphan")
+        abandoned = EncryptedFile.objects.create(owner=self.user,
+                                                 file_name="abandoned.pdf",
+                                                 iv=self.iv,
+                                                 storage_format="pending")
+        FileSegment.objects.create(file=abandoned, index=0, data=b"partial")
+        EncryptedFile.objects.filter(pk=abandoned.pk).update(
+            uploaded_at=timezone.now() - settings.PENDING_FILE_TTL -
+            timedelta(minutes=1))
+        fresh = EncryptedFile.objects.create(owner=self.user,
+                                             file_name="uploading.pdf",
+                                             iv=self.iv,
+                                             storage_format="pending")
+        FileSegment.objects.create(file=fresh, index=0, data=b"partial")
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("sweep_orphan_blobs", stdout=out)
+
+        self.assertIn("EncryptedFile: 1 row(s) deleted", out.getvalue())
+        self.assertIn("FilePayload: 1 row(s) deleted", out.getvalue())
+        self.assertEqual(
+            set(FileSegment.objects.values_list("file_id", flat=True)),
+            {kept.pk, fresh.pk})
+        self.assertFalse(FileSegment.objects.filter(pk=orphan.pk).exists())
+        self.assertEqual(b"".join(kept.iter_plaintext()), b"kept")
+
+
+class MaintenanceTests(TransactionTestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="sweeper",
+                                             password="sweeperpass")
+        self.file = EncryptedFile.objects.create(owner=self.user,
+                                                 file_name="kept.pdf",
+                                                 iv="iv")
+
+    def _expire(self, link):
+        PublicLink.objects.filter(pk=link.pk).update(
+            expires_at=timezone.now() - timedelta(minutes=1))
+
+    def test_sweep_deletes_only_dead_rows(self):
+        live, _ = PublicLink.create_for(self.file)
+        expired, _ = PublicLink.create_for(self.file)
+        self._expire(expired)
+        used_up, _ = PublicLink.create_for(self.file)
+        self.assertTrue(used_up.claim())
+        PublicLink.objects.filter(pk=used_up.pk).update(resume_until=None)
+        resuming, _ = PublicLink.create_for(self.file)
+        self.assertTrue(resuming.claim())
+        now = timezone.now()
+        RevokedToken.objects.create(jti="gone",
+                                    expires_at=now - timedelta(minutes=1))
+        RevokedToken.objects.create(jti="live",
+                                    expires_at=now + timedelta(minutes=1))
+        session = UploadSession.objects.create(owner=self.user,
+                                               file_name="stale.pdf",
+                                               iv="iv",
+                                               size_bytes=4,
+                                               chunk_size=4,
+                                               expires_at=now -
+                                               timedelta(minutes=1))
+        UploadChunk.objects.create(session=session, index=0, data=b"data")
+        queued = OutboundEmail.queue("Subject", "Body", "from@example.com",
+                                     ["to@example.com"])
+        OutboundEmail.queue("Subject", "Code", "from@example.com",
+                            ["to@example.com"],
+                            discard_after=now - timedelta(minutes=1))
+        recent = OutboundEmail.queue("Subject", "", "from@example.com",
+                                     ["to@example.com"])
+        recent.status = "sent"
+        recent.save()
+        old = OutboundEmail.queue("Subject", "", "from@example.com",
+                                  ["to@example.com"])
+        OutboundEmail.objects.filter(pk=old.pk).update(
+            status="failed", created_at=now - timedelta(days=30))
+
+        out = StringIO()
+        call_command("run_maintenance", stdout=out)
+
+        self.assertIn("PublicLink: 2 row(s) deleted", out.getvalue())
+        self.assertIn("RevokedToken: 1 row(s) deleted", out.getvalue())
+        self.assertEqual(set(PublicLink.objects.all()), {live, resuming})
+        self.assertEqual(
+            list(RevokedToken.objects.values_list("jti", flat=True)),
+            ["live"])
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(UploadChunk.objects.exists())
+        self.assertIn("OutboundEmail: 2 row(s) deleted", out.getvalue())
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list("pk", flat=True)),
+            {queued.pk, recent.pk})
+
+    def test_each_batch_is_its_own_transaction(self):
+        for _ in range(5):
+            self._expire(PublicLink.create_for(self.file)[0])
+        with CaptureQueriesContext(connection) as queries:
+            deleted = delete_in_batches(PublicLink.objects.all(),
+                                        batch_size=2,
+                                        pause=0)
+        self.assertEqual(deleted, 5)
+        statements = [query["sql"] for query in queries]
+        self.assertEqual(
+            sum(sql.startswith("DELETE") for sql in statements), 3)
+        self.assertEqual(sum(sql.startswith("BEGIN") for sql in statements),
+                         3)
+
+    def test_freed_pages_are_returned_to_the_filesystem(self):
+        with connections[BLOB_DATABASE].cursor() as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            self.assertEqual(cursor.fetchone()[0], AUTO_VACUUM_INCREMENTAL)
+        FilePayload.objects.bulk_create(
+            FilePayload(file_id=self.file.pk + 1 + i, data=os.urandom(64 * 1024))
+            for i in range(16))
+
+        counts, space = run_maintenance(batch_size=4)
+
+        self.assertEqual(counts["FilePayload"], 16)
+        reclaimed, free = space[BLOB_DATABASE]
+        self.assertGreater(reclaimed, 16 * 64 * 1024)
+        self.assertEqual(free, 0)
+        self.assertNotIn(READ_ONLY_DATABASE, space)
+
+    def test_scheduler_waits_for_the_lock_held_by_another_process(self):
+        swept = threading.Event()
+        scheduler = MaintenanceScheduler()
+        with override_settings(MAINTENANCE={
+                **settings.MAINTENANCE, "INTERVAL": 0.2
+        }), mock.patch("api.maintenance.run_maintenance",
+                       side_effect=swept.set):
+            cache.set(LOCK_KEY, -1, timeout=0.5)
+            started = time.monotonic()
+            scheduler.ensure_running()
+            thread = scheduler._thread
+            scheduler.ensure_running()
+            self.assertIs(scheduler._thread, thread)
+            self.assertTrue(swept.wait(5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+
+
+class SegmentCodecTests(SimpleTestCase):
+
+    def setUp(self):
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.iv_bytes = os.urandom(12)
+
+    def _seal(self, plaintext, segment_size):
+        return list(
+            encrypt_segments([plaintext], self.key, self.iv_bytes,
+                             segment_size))
+
+    def test_round_trip(self):
+        """
+        Test that segments decrypt back to the original bytes, including the
+        empty and exact-multiple edge cases.
+        """
+        for plaintext in (b"", b"a" * 10, b"b" * 32, os.urandom(100)):
+            sealed = self._seal(plaintext, 16)
+            decrypted = b"".join(
+                decrypt_segments(sealed, self.key, self.iv_bytes,
+                                 len(sealed)))
+            self.assertEqual(decrypted, plaintext)
+
+    def test_truncation_is_detected(self):
+        """
+        Test that dropping the final segment makes decryption fail.
+        """
+        sealed = self._seal(os.urandom(40), 16)
+        with self.assertRaises(InvalidTag):
+            list(
+                decrypt_segments(sealed[:-1], self.key, self.iv_bytes,
+                                 len(sealed) - 1))
+
+    def test_reordering_is_detected(self):
+        """
+        Test that a segment stored under the wrong index fails to decrypt.
+        """
+        sealed = self._seal(os.urandom(40), 16)
+        swapped = [(0, sealed[1][1]), (1, sealed[0][1]), sealed[2]]
+        with self.assertRaises(InvalidTag):
+            list(
+                decrypt_segments(swapped, self.key, self.iv_bytes,
+                                 len(sealed)))
+
+
+class BackendKeyCacheTests(TestCase):
+
+    def setUp(self):
+        backend_key_cache.clear()
+
+    def test_hits_and_misses_are_counted(self):
+        """
+        Test that a repeated derivation is served from the cache.
+        """
+        salt_bytes = os.urandom(16)
+        before = backend_key_cache.stats()
+        first = derive_backend_key(salt_bytes)
+        second = derive_backend_key(salt_bytes)
+        after = backend_key_cache.stats()
+        self.assertEqual(first, second)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+    @override_settings(BACKEND_KEY_CACHE={"MAX_SIZE": 2, "TTL": 300})
+    def test_least_recently_used_entry_is_evicted_and_wiped(self):
+        """
+        Test that the cache stays within MAX_SIZE and zeroes evicted keys.
+        """
+        key_cache = BackendKeyCache()
+        key_cache.get_or_derive(("a", ), lambda: b"\x01" * 32)
+        wiped = key_cache._entries[("a", )][0]
+        key_cache.get_or_derive(("b", ), lambda: b"\x02" * 32)
+        key_cache.get_or_derive(("c", ), lambda: b"\x03" * 32)
+        self.assertNotIn(("a", ), key_cache._entries)
+        self.assertEqual(bytes(wiped), bytes(32))
+        self.assertEqual(key_cache.stats()["size"], 2)
+
+    @override_settings(BACKEND_KEY_CACHE={"TTL": -1})
+    def test_expired_entries_are_rederived(self):
+        """
+        Test that an entry past its TTL counts as a miss.
+        """
+        key_cache = BackendKeyCache()
+        key_cache.get_or_derive(("a", ), lambda: b"\x01" * 32)
+        key_cache.get_or_derive(("a", ), lambda: b"\x01" * 32)
+        self.assertEqual(key_cache.stats()["misses"], 2)
+        self.assertEqual(key_cache.stats()["hits"], 0)
+
+    @override_settings(BACKEND_KEY_CACHE={"ENABLED": False})
+    def test_cache_can_be_disabled(self):
+        """
+        Test that nothing is cached when the cache is switched off.
+        """
+        derive_backend_key(os.urandom(16))
+        self.assertEqual(backend_key_cache.stats()["size"], 0)
+
+    def test_deleting_a_file_evicts_its_key(self):
+        """
+        Test that deleting a file drops its cached key.
+        """
+        owner = User.objects.create_user(username="keyowner",
+                                         password="keypass")
+        salt_bytes = os.urandom(16)
+        file_instance = EncryptedFile.objects.create(
+            owner=owner,
+            file_name="cached.pdf",
+            salt=base64.b64encode(salt_bytes).decode(),
+            iv=base64.b64encode(os.urandom(12)).decode())
+        derive_backend_key(salt_bytes)
+        self.assertEqual(backend_key_cache.stats()["size"], 1)
+
+        file_instance.delete()
+        self.assertEqual(backend_key_cache.stats()["size"], 0)
+
+
+class RangeHeaderTests(SimpleTestCase):
+
+    def test_parse_range_header(self):
+        """
+        Test single, open-ended, suffix, merged and invalid range specs.
+        """
+        self.assertEqual(parse_range_header("bytes=0-9", 100), [(0, 10)])
+        self.assertEqual(parse_range_header("bytes=90-", 100), [(90, 100)])
+        self.assertEqual(parse_range_header("bytes=-5", 100), [(95, 100)])
+        self.assertEqual(parse_range_header("bytes=0-200", 100), [(0, 100)])
+        self.assertEqual(parse_range_header("bytes=0-9,5-19,50-59", 100),
+                         [(0, 20), (50, 60)])
+        self.assertEqual(parse_range_header("bytes=100-", 100), [])
+        self.assertIsNone(parse_range_header(None, 100))
+        self.assertIsNone(parse_range_header("items=0-9", 100))
+        self.assertIsNone(parse_range_header("bytes=9-0", 100))
+        self.assertIsNone(parse_range_header("bytes=a-b", 100))
+        for header in ("bytes=\u00b2-", "bytes=0-\u00b9", "bytes=-\u00b3",
+                       "bytes=\u0663-"):
+            self.assertIsNone(parse_range_header(header, 100))
+
+
+class UploadSessionTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="uploader",
+                                             password="uploadpass")
+        self.client.force_authenticate(user=self.user)
+
+    def _create_session(self, size):
+        response = self.client.post(reverse('upload-session-create'), {
+            "file_name": "resumable.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": size,
+        },
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def _put_chunk(self, session_id, index, data):
+        url = reverse('upload-chunk', args=[session_id, index])
+        return self.client.generic('PUT',
+                                   url,
+                                   data,
+                                   content_type='application/octet-stream')
+
+    def test_chunks_in_any_order_then_complete(self):
+        """
+        Test that chunks sent out of order are reported, completed into a file
+        and decrypt back to the original content.
+        """
+        content = os.urandom(SEGMENT_SIZE * 2 + 123)
+        session = self._create_session(len(content))
+        self.assertEqual(session["chunk_count"], 3)
+        chunk_size = session["chunk_size"]
+        chunks = [
+            content[i:i + chunk_size]
+            for i in range(0, len(content), chunk_size)
+        ]
+
+        for index in (2, 0):
+            response = self._put_chunk(session["session_id"], index,
+                                       chunks[index])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        status_url = reverse('upload-session', args=[session["session_id"]])
+        response = self.client.get(status_url)
+        self.assertEqual(response.data["received"], [[0, 0], [2, 2]])
+        self.assertEqual(response.data["missing_count"], 1)
+
+        complete_url = reverse('upload-session-complete',
+                               args=[session["session_id"]])
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self._put_chunk(session["session_id"], 1, chunks[1])
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file_obj = EncryptedFile.objects.get(id=response.data["file_id"])
+        self.assertEqual(file_obj.size_bytes, len(content))
+        self.assertEqual(b"".join(file_obj.iter_plaintext()), content)
+        self.assertFalse(
+            UploadSession.objects.filter(id=session["session_id"]).exists())
+
+    def test_parallel_parts_with_manifest(self):
+        """
+        Test that multi-segment parts can be sent out of order and committed
+        with a matching part manifest.
+        """
+        content = os.urandom(SEGMENT_SIZE * 3 + 7)
+        response = self.client.post(reverse('upload-session-create'), {
+            "file_name": "parts.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": len(content),
+            "part_size": SEGMENT_SIZE * 2,
+        },
+                                    format='json')
+        session = response.data
+        self.assertEqual(session["part_count"], 2)
+
+        manifest = []
+        for number in (1, 0):
+            part = content[number * SEGMENT_SIZE * 2:(number + 1) *
+                           SEGMENT_SIZE * 2]
+            url = reverse('upload-part', args=[session["session_id"], number])
+            response = self.client.generic(
+                'PUT', url, part, content_type='application/octet-stream')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            manifest.append({"part": number, "etag": response.data["etag"]})
+
+        complete_url = reverse('upload-session-complete',
+                               args=[session["session_id"]])
+        response = self.client.post(complete_url,
+                                    {"parts": manifest[:1]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.post(complete_url, {"parts": manifest},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        file_obj = EncryptedFile.objects.get(id=response.data["file_id"])
+        self.assertEqual(b"".join(file_obj.iter_plaintext()), content)
+
+    def test_part_with_wrong_length_leaves_nothing_behind(self):
+        """
+        Test that a part that ends early or runs long removes the chunks it
+        already stored and the part's earlier manifest entry.
+        """
+        content = os.urandom(SEGMENT_SIZE * 2)
+        response = self.client.post(reverse('upload-session-create'), {
+            "file_name": "parts.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": len(content),
+            "part_size": SEGMENT_SIZE * 2,
+        },
+                                    format='json')
+        session_id = response.data["session_id"]
+        url = reverse('upload-part', args=[session_id, 0])
+        self.assertEqual(
+            self.client.generic('PUT',
+                                url,
+                                content,
+                                content_type='application/octet-stream'
+                                ).status_code, status.HTTP_200_OK)
+
+        for body in (content[:SEGMENT_SIZE + 1], content + b"x"):
+            response = self.client.generic(
+                'PUT', url, body, content_type='application/octet-stream')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertFalse(
+                UploadChunk.objects.filter(session_id=session_id).exists())
+            self.assertFalse(
+                UploadPart.objects.filter(session_id=session_id).exists())
+
+    def test_claimed_session_refuses_writes(self):
+        """
+        Test that chunks cannot be written, the session aborted or completed
+        again once a completion has claimed it.
+        """
+        session = self._create_session(10)
+        session_id = session["session_id"]
+        self.assertTrue(UploadSession.objects.get(id=session_id).claim())
+
+        self.assertEqual(
+            self._put_chunk(session_id, 0, b"0123456789").status_code,
+            status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            self.client.delete(reverse('upload-session',
+                                       args=[session_id])).status_code,
+            status.HTTP_409_CONFLICT)
+        self.assertEqual(
+            self.client.post(reverse('upload-session-complete',
+                                     args=[session_id])).status_code,
+            status.HTTP_409_CONFLICT)
+        self.assertFalse(UploadChunk.objects.exists())
+
+    def test_write_racing_the_claim_is_reported(self):
+        """
+        Test that a chunk whose write finishes after the session was claimed
+        is answered with 409, since it may not be in the file.
+        """
+        session = self._create_session(10)
+        session_id = session["session_id"]
+        original_upsert = UploadSession._upsert_chunk
+
+        def claim_during_write(self, index, sealed):
+            original_upsert(self, index, sealed)
+            UploadSession.objects.get(pk=self.pk).claim()
+
+        with mock.patch.object(UploadSession, "_upsert_chunk",
+                               claim_during_write):
+            response = self._put_chunk(session_id, 0, b"0123456789")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_failed_finalize_releases_the_claim(self):
+        """
+        Test that a completion that fails removes its file and lets the
+        client complete again.
+        """
+        session = self._create_session(10)
+        session_id = session["session_id"]
+        self._put_chunk(session_id, 0, b"0123456789")
+        complete_url = reverse('upload-session-complete', args=[session_id])
+
+        with mock.patch.object(EncryptedFile,
+                               "store_segments",
+                               side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.client.post(complete_url)
+        self.assertFalse(UploadSession.objects.get(id=session_id).finalizing)
+        self.assertFalse(EncryptedFile.objects.exists())
+
+        response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            b"".join(EncryptedFile.objects.get().iter_plaintext()),
+            b"0123456789")
+
+    def test_chunk_with_wrong_length_is_rejected(self):
+        """
+        Test that a chunk that is not exactly the expected size is rejected.
+        """
+        session = self._create_session(10)
+        response = self._put_chunk(session["session_id"], 0, b"too short")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_sessions_are_purged(self):
+        """
+        Test that purge_upload_sessions removes expired sessions.
+        """
+        session = self._create_session(10)
+        UploadSession.objects.filter(id=session["session_id"]).update(
+            expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('purge_upload_sessions', stdout=StringIO())
+        self.assertFalse(
+            UploadSession.objects.filter(id=session["session_id"]).exists())
+
+
+class UploadSessionRaceTests(TransactionTestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def test_concurrent_completes_create_one_file(self):
+        user = User.objects.create_user(username="racer", password="racer")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        content = os.urandom(SEGMENT_SIZE * 3 + 5)
+        session_id = client.post(reverse('upload-session-create'), {
+            "file_name": "race.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": len(content),
+        },
+                                 format='json').data["session_id"]
+        for index in range(4):
+            client.generic('PUT',
+                           reverse('upload-chunk', args=[session_id, index]),
+                           content[index * SEGMENT_SIZE:(index + 1) *
+                                   SEGMENT_SIZE],
+                           content_type='application/octet-stream')
+        barrier = threading.Barrier(2)
+
+        def complete():
+            racer = APIClient()
+            racer.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                return racer.post(
+                    reverse('upload-session-complete',
+                            args=[session_id])).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(2) as pool:
+            codes = sorted(pool.map(lambda _: complete(), range(2)))
+
+        self.assertEqual(codes,
+                         [status.HTTP_201_CREATED, status.HTTP_409_CONFLICT])
+        file_obj = EncryptedFile.objects.get()
+        self.assertEqual(b"".join(file_obj.iter_plaintext()), content)
+        self.assertEqual(StorageUsage.objects.get(user=user).file_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(UploadChunk.objects.exists())
+
+
+class RawFileUploadTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="rawuploader",
+                                             password="rawpass")
+        self.client.force_authenticate(user=self.user)
+
+    def _put(self, content, **headers):
+        return self.client.generic('PUT',
+                                   reverse('upload-raw'),
+                                   content,
+                                   content_type='application/octet-stream',
+                                   **headers)
+
+    def _metadata_headers(self):
+        return {
+            "HTTP_X_FILE_NAME": "r%C3%A9sum%C3%A9.pdf",
+            "HTTP_X_FILE_IV": base64.b64encode(os.urandom(12)).decode(),
+            "HTTP_X_FILE_SALT": base64.b64encode(os.urandom(16)).decode(),
+        }
+
+    def test_raw_upload_round_trip(self):
+        """
+        Test that a raw body is stored in segments under the decoded name.
+        """
+        content = os.urandom(SEGMENT_SIZE + 42)
+        response = self._put(content, **self._metadata_headers())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        file_obj = EncryptedFile.objects.get(id=response.data["file_id"])
+        self.assertEqual(file_obj.file_name, "résumé.pdf")
+        self.assertEqual(file_obj.segment_count, 2)
+        self.assertEqual(b"".join(file_obj.iter_plaintext()), content)
+
+    def test_raw_upload_requires_metadata_headers(self):
+        """
+        Test that the metadata headers are required.
+        """
+        response = self._put(b"content")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(MAX_UPLOAD_SIZE=10)
+    def test_raw_upload_size_limit(self):
+        """
+        Test that an oversized body is rejected and nothing is stored.
+        """
+        response = self._put(b"x" * 11, **self._metadata_headers())
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(EncryptedFile.objects.filter(owner=self.user).exists())
+
+
+class StorageUsageTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="quota",
+                                             password="quotapass")
+        self.client.force_authenticate(user=self.user)
+
+    def _put(self, content):
+        return self.client.generic('PUT',
+                                   reverse('upload-raw'),
+                                   content,
+                                   content_type='application/octet-stream',
+                                   HTTP_X_FILE_NAME="quota.pdf",
+                                   HTTP_X_FILE_IV=base64.b64encode(
+                                       os.urandom(12)).decode(),
+                                   HTTP_X_FILE_SALT=base64.b64encode(
+                                       os.urandom(16)).decode())
+
+    def _usage(self):
+        usage = StorageUsage.objects.get(user=self.user)
+        return usage.bytes_used, usage.file_count
+
+    def test_uploads_and_deletes_update_usage_and_digest(self):
+        first, second = os.urandom(SEGMENT_SIZE + 5), b"second"
+        first_id = self._put(first).data["file_id"]
+        self._put(second)
+        self.assertEqual(self._usage(), (len(first) + len(second), 2))
+
+        file_obj = EncryptedFile.objects.get(pk=first_id)
+        self.assertEqual(file_obj.sha256, hashlib.sha256(first).hexdigest())
+        response = self.client.get(reverse("file-metadata", args=[first_id]))
+        self.assertEqual(response.json()["sha256"], file_obj.sha256)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            file_obj.delete()
+        self.assertEqual(self._usage(), (len(second), 1))
+
+    def test_resumable_upload_is_hashed_in_order(self):
+        content = os.urandom(SEGMENT_SIZE * 2 + 7)
+        session = self.client.post(reverse('upload-session-create'), {
+            "file_name": "resumable.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": len(content),
+        },
+                                   format='json').data
+        for index in (2, 0, 1):
+            self.client.generic(
+                'PUT',
+                reverse('upload-chunk', args=[session["session_id"], index]),
+                content[index * SEGMENT_SIZE:(index + 1) * SEGMENT_SIZE],
+                content_type='application/octet-stream')
+        response = self.client.post(
+            reverse('upload-session-complete', args=[session["session_id"]]))
+
+        file_obj = EncryptedFile.objects.get(pk=response.data["file_id"])
+        self.assertEqual(file_obj.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(self._usage(), (len(content), 1))
+
+    @override_settings(STORAGE_QUOTA=100)
+    def test_uploads_over_quota_are_refused_before_the_body_is_read(self):
+        self.assertEqual(self._put(b"x" * 60).status_code,
+                         status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as queries, mock.patch(
+                "api.views.iter_stream") as iter_stream:
+            response = self._put(b"x" * 41)
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(response.data["remaining_bytes"], 40)
+        self.assertEqual(len(queries), 1)
+        iter_stream.assert_not_called()
+
+        response = self.client.post(reverse('upload'), {
+            'file': SimpleUploadedFile('big.pdf', b"x" * 41),
+            'iv': 'iv',
+            'salt': 'salt',
+        })
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.post(reverse('upload-session-create'), {
+            "file_name": "big.pdf",
+            "iv": "iv",
+            "salt": "salt",
+            "size": 41,
+        },
+                                    format='json')
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self._usage(), (60, 1))
+
+    @override_settings(STORAGE_QUOTA=100)
+    def test_add_file_enforces_the_quota_in_its_update(self):
+        with self.assertRaises(StorageQuotaExceeded):
+            StorageUsage.add_file(self.user.id, 101)
+        self.assertFalse(StorageUsage.objects.exists())
+        StorageUsage.add_file(self.user.id, 60)
+        with self.assertRaises(StorageQuotaExceeded):
+            StorageUsage.add_file(self.user.id, 41)
+        StorageUsage.add_file(self.user.id, 40)
+        self.assertEqual(self._usage(), (100, 2))
+
+        StorageUsage.objects.filter(user=self.user).update(quota_bytes=150)
+        StorageUsage.add_file(self.user.id, 50)
+        self.assertEqual(self._usage(), (150, 3))
+
+    @override_settings(STORAGE_QUOTA=100)
+    def test_upload_racing_past_the_early_check_is_rolled_back(self):
+        self.assertEqual(self._put(b"x" * 60).status_code,
+                         status.HTTP_201_CREATED)
+        # As if another upload finished after this one was checked.
+        with mock.patch.object(StorageUsage, "remaining_for",
+                               side_effect=[None, 40]):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self._put(b"x" * 41)
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(response.data["remaining_bytes"], 40)
+        self.assertEqual(self._usage(), (60, 1))
+        self.assertEqual(EncryptedFile.objects.count(), 1)
+        self.assertEqual(FileSegment.objects.count(), 1)
+
+    @override_settings(STORAGE_QUOTA=100)
+    def test_completion_over_quota_keeps_the_session(self):
+        session = self.client.post(reverse('upload-session-create'), {
+            "file_name": "late.pdf",
+            "iv": base64.b64encode(os.urandom(12)).decode(),
+            "salt": base64.b64encode(os.urandom(16)).decode(),
+            "size": 50,
+        },
+                                   format='json').data
+        self.client.generic('PUT',
+                            reverse('upload-chunk',
+                                    args=[session["session_id"], 0]),
+                            b"x" * 50,
+                            content_type='application/octet-stream')
+        StorageUsage.objects.create(user=self.user, bytes_used=60)
+        with mock.patch.object(StorageUsage, "remaining_for",
+                               side_effect=[None, 40]):
+            response = self.client.post(
+                reverse('upload-session-complete',
+                        args=[session["session_id"]]))
+        self.assertEqual(response.status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(EncryptedFile.objects.exists())
+        self.assertFalse(
+            UploadSession.objects.get(pk=session["session_id"]).finalizing)
+        self.assertEqual(self._usage(), (60, 0))
+
+    @override_settings(STORAGE_QUOTA=100)
+    def test_raw_body_is_limited_to_the_remaining_quota(self):
+        with mock.patch("api.views.limit_size",
+                        wraps=limit_size) as limited:
+            self.assertEqual(self._put(b"x" * 30).status_code,
+                             status.HTTP_201_CREATED)
+        self.assertEqual(limited.call_args.args[1], 100)
+
+    @override_settings(STORAGE_QUOTA=None)
+    def test_per_user_quota_overrides_the_default(self):
+        self.assertIsNone(StorageUsage.remaining_for(self.user))
+        StorageUsage.objects.create(user=self.user, quota_bytes=10)
+        self.assertEqual(self._put(b"x" * 11).status_code,
+                         status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self._put(b"x" * 10).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(StorageUsage.remaining_for(self.user), 0)
+
+    def test_reconcile_fixes_drift_and_missing_digests(self):
+        content = b"reconciled"
+        file_id = self._put(content).data["file_id"]
+        StorageUsage.objects.filter(user=self.user).update(bytes_used=999,
+                                                           file_count=7)
+        EncryptedFile.objects.filter(pk=file_id).update(sha256='')
+        other = User.objects.create_user(username="untracked",
+                                         password="untrackedpass")
+        EncryptedFile.objects.create(owner=other,
+                                     file_name="old.pdf",
+                                     iv="iv",
+                                     storage_format="pending")
+
+        out = StringIO()
+        call_command("reconcile_storage_usage", "--digests", stdout=out)
+
+        self.assertIn(f"user {self.user.pk}: -989 byte(s), -6 file(s)",
+                      out.getvalue())
+        self.assertIn("Computed 1 missing digest(s).", out.getvalue())
+        self.assertEqual(self._usage(), (len(content), 1))
+        self.assertEqual(
+            StorageUsage.objects.get(user=other).bytes_used, 0)
+        self.assertEqual(
+            EncryptedFile.objects.get(pk=file_id).sha256,
+            hashlib.sha256(content).hexdigest())
+
+
+class PassthroughStorageTests(APITestCase):
+    databases = {"default", BLOB_DATABASE}
+
+    def setUp(self):
+        self.storage_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.storage_root, True)
+        self.user = User.objects.create_user(username="passthrough",
+                                             password="passpass")
+        self.client.force_authenticate(user=self.user)
+        cache.clear()  # no access decisions left over from other tests
+
+    def _upload(self, content):
+        with self.settings(FILE_STORAGE_MODE="passthrough",
+                           PASSTHROUGH_STORAGE_ROOT=self.storage_root):
+            response = self.client.generic(
+                'PUT',
+                reverse('upload-raw'),
+                content,
+                content_type='application/octet-stream',
+                HTTP_X_FILE_NAME="cipher.pdf",
+                HTTP_X_FILE_IV=base64.b64encode(os.urandom(12)).decode(),
+                HTTP_X_FILE_SALT=base64.b64encode(os.urandom(16)).decode())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return EncryptedFile.objects.get(id=response.data["file_id"])
+
+    def test_upload_writes_client_ciphertext_to_disk(self):
+        """
+        Test that passthrough uploads are stored on disk exactly as received.
+        """
+        content = os.urandom(5000)
+        file_obj = self._upload(content)
+        self.assertEqual(file_obj.storage_format, "passthrough")
+        self.assertEqual(file_obj.size_bytes, len(content))
+        self.assertFalse(FileSegment.objects.filter(file=file_obj).exists())
+        with self.settings(PASSTHROUGH_STORAGE_ROOT=self.storage_root):
+            with open(file_obj.passthrough_path(), 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_download_hands_off_to_nginx(self):
+        """
+        Test that FileView only checks access and returns X-Accel-Redirect.
+        """
+        file_obj = self._upload(b"ciphertext")
+        with self.settings(PASSTHROUGH_STORAGE_ROOT=self.storage_root,
+                           PASSTHROUGH_ACCEL_PREFIX="/protected-blobs/"):
+            response = self.client.get(reverse('filesView',
+                                               args=[file_obj.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"],
+                         "/protected-blobs/" + file_obj.storage_path)
+        self.assertEqual(response.content, b"")
+
+    def test_download_without_nginx_streams_from_disk(self):
+        """
+        Test that without an accel prefix Django serves the stored bytes,
+        including ranges.
+        """
+        content = os.urandom(100)
+        file_obj = self._upload(content)
+        with self.settings(PASSTHROUGH_STORAGE_ROOT=self.storage_root,
+                           PASSTHROUGH_ACCEL_PREFIX=""):
+            response = self.client.get(reverse('filesView',
+                                               args=[file_obj.id]),
+                                       HTTP_RANGE="bytes=10-19")
+            body = b"".join(response.streaming_content)
+        self.assertEqual(response.status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(body, content[10:20])
+
+    def test_delete_removes_file_from_disk(self):
+        """
+        Test that deleting a passthrough file removes its ciphertext.
+        """
+        file_obj = self._upload(b"to be deleted")
+        with self.settings(PASSTHROUGH_STORAGE_ROOT=self.storage_root):
+            path = file_obj.passthrough_path()
+            file_obj.delete()
+        self.assertFalse(path.exists())
+
+    def test_file_is_written_outside_any_transaction(self):
+        """
+        Test that the row is committed as pending before the stream is read
+        and that no transaction is open while the file is written.
+        """
+        depth = len(connection.atomic_blocks)
+        seen = []
+
+        def chunks():
+            seen.append((len(connection.atomic_blocks),
+                         EncryptedFile.objects.get().storage_format))
+            yield b"ciphertext"
+
+        with self.settings(FILE_STORAGE_MODE="passthrough",
+                           PASSTHROUGH_STORAGE_ROOT=self.storage_root):
+            file_obj = _create_file_from_stream(self.user, "cipher.pdf",
+                                                "aXY=", "c2FsdA==", chunks())
+        self.assertEqual(seen, [(depth, "pending")])
+        file_obj.refresh_from_db()
+        self.assertEqual(file_obj.storage_format, "passthrough")
+        self.assertEqual(StorageUsage.objects.get(user=self.user).bytes_used,
+                         len(b"ciphertext"))
+
+    def test_failed_upload_leaves_nothing_behind(self):
+        """
+        Test that an upload failing after the file was written removes both
+        the row and the file, and is not counted against the owner.
+        """
+        with self.settings(FILE_STORAGE_MODE="passthrough",
+                           PASSTHROUGH_STORAGE_ROOT=self.storage_root), \
+                mock.patch.object(StorageUsage, "add_file",
+                                  side_effect=OperationalError("locked")):
+            with self.assertRaises(OperationalError):
+                _create_file_from_stream(self.user, "cipher.pdf", "aXY=",
+                                         "c2FsdA==", iter([b"ciphertext"]))
+        self.assertFalse(EncryptedFile.objects.exists())
+        self.assertEqual(
+            [files for _, _, files in os.walk(self.storage_root) if files],
+            [])
+        self.assertFalse(StorageUsage.objects.filter(user=self.user,
+                                                     bytes_used__gt=0).exists())
+
+
+@skipUnless(shutil.which("nginx"), "nginx is not installed")
+class PassthroughNginxIntegrationTests(LiveServerTestCase):
+    """
+    Runs a local nginx in front of the live server with the same internal
+    location as default.conf and checks that downloads are served by nginx.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.storage_root = tempfile.mkdtemp()
+        cls.nginx_dir = tempfile.mkdtemp()
+        cls._settings = override_settings(
+            FILE_STORAGE_MODE="passthrough",
+            PASSTHROUGH_STORAGE_ROOT=cls.storage_root,
+            PASSTHROUGH_ACCEL_PREFIX="/protected-blobs/")
+        cls._settings.enable()
+        super().setUpClass()
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            cls.nginx_port = sock.getsockname()[1]
+        conf_path = os.path.join(cls.nginx_dir, "nginx.conf")
+        with open(conf_path, "w") as f:
+            f.write(f"""
+daemon off;
+pid {cls.nginx_dir}/nginx.pid;
+error_log {cls.nginx_dir}/error.log;
+events {{}}
+http {{
+    access_log off;
+    client_body_temp_path {cls.nginx_dir};
+    proxy_temp_path {cls.nginx_dir};
+    fastcgi_temp_path {cls.nginx_dir};
+    uwsgi_temp_path {cls.nginx_dir};
+    scgi_temp_path {cls.nginx_dir};
+    server {{
+        listen 127.0.0.1:{cls.nginx_port};
+        location /protected-blobs/ {{
+            internal;
+            alias {cls.storage_root}/;
+            sendfile on;
+        }}
+        location / {{
+            client_max_body_size 0;
+            proxy_pass {cls.live_server_url};
+        }}
+    }}
+}}
+""")
+        cls.nginx = subprocess.Popen(
+            ["nginx", "-p", cls.nginx_dir, "-c", conf_path],
+            stderr=subprocess.DEVNULL)
+        for _ in range(50):
+            try:
+                socket.create_connection(("127.0.0.1", cls.nginx_port),
+                                         timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.nginx.terminate()
+        cls.nginx.wait()
+        super().tearDownClass()
+        cls._settings.disable()
+        shutil.rmtree(cls.storage_root, True)
+        shutil.rmtree(cls.nginx_dir, True)
+
+    def _request(self, method, path, data=None, headers=None):
+        user = User.objects.get(username="nginxuser")
+        request = Request(f"http://127.0.0.1:{self.nginx_port}{path}",
+                          data=data,
+                          method=method,
+                          headers={
+                              "Cookie":
+                              "access_token=" +
+                              str(RefreshToken.for_user(user).access_token),
+                              **(headers or {}),
+                          })
+        return urlopen(request)
+
+    def test_download_is_served_by_nginx(self):
+        """
+        Test that an upload through nginx can be downloaded, whole and by
+        range, from the internal location.
+        """
+        User.objects.create_user(username="nginxuser", password="nginxpass")
+        content = os.urandom(300000)
+        with self._request(
+                "PUT", "/api/upload/raw/", content, {
+                    "Content-Type": "application/octet-stream",
+                    "X-File-Name": "nginx.pdf",
+                    "X-File-IV": base64.b64encode(os.urandom(12)).decode(),
+                    "X-File-Salt": base64.b64encode(os.urandom(16)).decode(),
+                }) as response:
+            file_id = json.loads(response.read())["file_id"]
+
+        with self._request("GET", f"/api/files/{file_id}/") as response:
+            self.assertEqual(response.read(), content)
+            self.assertIn("attachment", response.headers["Content-Disposition"])
+
+        with self._request("GET", f"/api/files/{file_id}/",
+                           headers={"Range": "bytes=100-199"}) as response:
+            self.assertEqual(response.status, 206)
+            self.assertEqual(response.read(), content[100:200])
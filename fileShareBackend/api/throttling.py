@@ -0,0 +1,68 @@
+"""
+Token-bucket rate limits for expensive endpoints, shared by every worker
+through the default cache.
+
+settings.RATE_LIMITS maps a URL name to the limits of that endpoint: a mapping
+of what to key the limit on ('ip', 'username' or 'public_token') to a rate
+"N/period", with period one of s, min, h or d. Each key gets a bucket of N
+tokens refilled at N per period, so bursts of N are allowed. The check runs in
+APIView.initial(), before the view does any hashing or decryption, and a
+rejected request costs one cache transaction. The 'ip' key is the address
+the proxy saw (REST_FRAMEWORK['NUM_PROXIES']), never a client-supplied
+X-Forwarded-For entry.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'min': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse "N/period" into (N, tokens per second).
+    """
+    count, _, period = rate.partition('/')
+    try:
+        return int(count), int(count) / PERIODS[period]
+    except (KeyError, ValueError):
+        raise ImproperlyConfigured(f"Invalid rate limit {rate!r}")
+
+
+class RateLimit(BaseThrottle):
+
+    def allow_request(self, request, view):
+        self.retry_after = 0
+        resolver_match = request.resolver_match
+        endpoint = resolver_match.url_name if resolver_match else None
+        limits = getattr(settings, 'RATE_LIMITS', {}).get(endpoint)
+        if not limits:
+            return True
+        for kind, rate in limits.items():
+            ident = self.get_key(kind, request, view)
+            if not ident:
+                continue
+            capacity, per_second = parse_rate(rate)
+            # Hashed, since usernames and tokens are arbitrary client input.
+            digest = hashlib.blake2b(ident.encode(),
+                                     digest_size=16).hexdigest()
+            self.retry_after = cache.take_token(
+                f"ratelimit:{endpoint}:{kind}:{digest}", per_second, capacity)
+            if self.retry_after:
+                return False
+        return True
+
+    def get_key(self, kind, request, view):
+        if kind == 'ip':
+            return self.get_ident(request)
+        if kind == 'username':
+            username = getattr(request.data, 'get', lambda key: None)(kind)
+            return username if isinstance(username, str) else None
+        if kind == 'public_token':
+            return view.kwargs.get('public_token')
+        raise ImproperlyConfigured(f"Unknown rate limit key {kind!r}")
+
+    def wait(self):
+        return self.retry_after
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import LoginView, RegisterView, ProfileView, LogoutView, FileUploadView, GetFileList, FileView, FileMetadataView, GeneratePublicLinkView, PublicFileRetrieveView, RevokePublicLinkView, PublicViewMetaData, ShareFileView, AdminLoginView, AdminFilesView
+from .views import LoginView, RegisterView, ProfileView, LogoutView, TokenRefreshView, FileUploadView, GetFileList, FileView, FileMetadataView, GeneratePublicLinkView, PublicFileRetrieveView, RevokePublicLinkView, PublicViewMetaData, ShareFileView, BulkShareFileView, AdminLoginView, AdminFilesView, RawFileUploadView, UploadSessionCreateView, UploadSessionView, UploadChunkView, UploadPartView, UploadSessionCompleteView
 
 urlpatterns = [
     path("login/", LoginView.as_view(), name="login"),
@@ -8,7 +8,25 @@ urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),
     path('profile/', ProfileView.as_view(), name='profile'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('upload/', FileUploadView.as_view(), name='upload'),
+    path('upload/raw/', RawFileUploadView.as_view(), name='upload-raw'),
+    # Resumable upload sessions
+    path('uploads/',
+         UploadSessionCreateView.as_view(),
+         name='upload-session-create'),
+    path('uploads/<uuid:session_id>/',
+         UploadSessionView.as_view(),
+         name='upload-session'),
+    path('uploads/<uuid:session_id>/chunks/<int:index>/',
+         UploadChunkView.as_view(),
+         name='upload-chunk'),
+    path('uploads/<uuid:session_id>/parts/<int:part_number>/',
+         UploadPartView.as_view(),
+         name='upload-part'),
+    path('uploads/<uuid:session_id>/complete/',
+         UploadSessionCompleteView.as_view(),
+         name='upload-session-complete'),
     path('files/', GetFileList.as_view(), name='allFiles'),
     path('files/<int:pk>/', FileView.as_view(), name='filesView'),
     path('files/<int:pk>/metadata/',
@@ -32,4 +50,7 @@ urlpatterns = [
     path('files/<int:pk>/userShare/',
          ShareFileView.as_view(),
          name='share-file'),
+    path('files/userShare/',
+         BulkShareFileView.as_view(),
+         name='share-files'),
 ]
@@ -1,18 +1,380 @@
 import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import cache
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Plaintext bytes sealed into each stored segment. Every segment except the
+# last one holds exactly this many bytes, so byte offsets map to segments.
+SEGMENT_SIZE = 1024 * 1024
+# AES-GCM appends a 16 byte authentication tag to every sealed segment.
+SEGMENT_TAG_SIZE = 16
+
+# Requests asking for more byte ranges than this are served in full.
+MAX_RANGES = 16
+
+# key_version of files whose key is still derived from their salt with PBKDF2.
+LEGACY_KEY_VERSION = 0
+
+
+class BackendKeyCache:
+    """
+    Bounded, thread-safe LRU cache for PBKDF2-derived backend keys.
+    Size, TTL and the on/off switch are read from settings.BACKEND_KEY_CACHE
+    on every call. Evicted key material is zeroed in place.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'BACKEND_KEY_CACHE', {})
+
+    @property
+    def enabled(self):
+        return self.config.get('ENABLED', True)
+
+    def get_or_derive(self, cache_key, derive):
+        """
+        Return the cached key for `cache_key`, calling `derive()` on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                key_material, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return bytes(key_material)
+                self._discard(cache_key)
+            self.misses += 1
+
+        # Derive outside the lock so a slow KDF never blocks cache hits.
+        key = derive()
+        with self._lock:
+            if cache_key in self._entries:
+                self._discard(cache_key)
+            self._entries[cache_key] = (bytearray(key),
+                                        now + self.config.get('TTL', 300))
+            while len(self._entries) > self.config.get('MAX_SIZE', 1024):
+                self._discard(next(iter(self._entries)))
+        return key
+
+    def evict_salt(self, salt_bytes):
+        """
+        Drop every cached key derived from `salt_bytes`.
+        """
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == salt_bytes]:
+                self._discard(cache_key)
+
+    def clear(self):
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._discard(cache_key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _discard(self, cache_key):
+        key_material, _ = self._entries.pop(cache_key)
+        key_material[:] = bytes(len(key_material))  # wipe before release
+        self.evictions += 1
+
+
+backend_key_cache = BackendKeyCache()
 
 
 def derive_backend_key(salt_bytes, iterations=100000):
     """
     Derive an AES-256 key using PBKDF2 with the given salt and the secret from settings.
+    Results are served from backend_key_cache unless it is disabled.
+    """
+
+    def derive():
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,  # 32 bytes = 256 bits
+            salt=salt_bytes,
+            iterations=iterations,
+            backend=default_backend())
+        return kdf.derive(settings.BACKEND_ENCRYPTION_SECRET)
+
+    if not backend_key_cache.enabled:
+        return derive()
+    cache_key = (bytes(salt_bytes), iterations,
+                 settings.BACKEND_ENCRYPTION_SECRET_VERSION)
+    return backend_key_cache.get_or_derive(cache_key, derive)
+
+
+def current_key_version():
+    """
+    Version of the master key that new data keys are wrapped with.
+    """
+    return settings.BACKEND_MASTER_KEY_VERSION
+
+
+@cache
+def master_key(version):
+    """
+    Derive the key-wrapping master key of `version` from its secret in
+    BACKEND_MASTER_KEYS. The result is cached, so this runs once per process
+    rather than once per request; api.signals clears the cache when the
+    setting changes.
+    """
+    secret = settings.BACKEND_MASTER_KEYS.get(version)
+    if secret is None:
+        raise ImproperlyConfigured(
+            f"BACKEND_MASTER_KEYS has no secret for version {version}.")
+    hkdf = HKDF(algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=f"fileshare-master-key-v{version}".encode(),
+                backend=default_backend())
+    return hkdf.derive(secret)
+
+
+def new_data_key():
+    """
+    Generate a random per-file data key wrapped with the current master key.
+    Returns (key, wrapped_key, key_version).
+    """
+    version = current_key_version()
+    key = AESGCM.generate_key(bit_length=256)
+    return key, aes_key_wrap(master_key(version), key), version
+
+
+def unwrap_data_key(wrapped_key, version):
+    """
+    Recover a data key wrapped with the given master key version.
+    """
+    return aes_key_unwrap(master_key(version), bytes(wrapped_key))
+
+
+def segment_nonce(iv_bytes, index):
+    """
+    Derive the nonce of segment `index` by XOR-ing the index into the file IV,
+    so no two segments of a file are ever sealed under the same nonce.
+    """
+    counter = int.from_bytes(iv_bytes, 'big') ^ index
+    return counter.to_bytes(len(iv_bytes), 'big')
+
+
+def segment_aad(index, final):
+    """
+    Associated data binding a segment to its position and to whether it is the
+    last one, so segments cannot be reordered, dropped or truncated unnoticed.
+    """
+    return index.to_bytes(8, 'big') + (b'\x01' if final else b'\x00')
+
+
+def iter_segments(chunks, segment_size=SEGMENT_SIZE):
+    """
+    Re-slice an iterable of byte chunks into fixed-size segments.
+    Yields (index, data, final) tuples. At most one segment plus one incoming
+    chunk is buffered; an empty input yields a single empty final segment.
+    """
+    buffer = bytearray()
+    index = 0
+    for chunk in chunks:
+        buffer.extend(chunk)
+        # Only emit once more data follows, so the last segment is flagged final.
+        while len(buffer) > segment_size:
+            yield index, bytes(buffer[:segment_size]), False
+            del buffer[:segment_size]
+            index += 1
+    yield index, bytes(buffer), True
+
+
+class SegmentCipher:
+    """
+    Seals and opens the individual AES-GCM segments of one file.
+    """
+
+    def __init__(self, key, iv_bytes):
+        self._aesgcm = AESGCM(key)
+        self._iv = iv_bytes
+
+    def seal(self, index, data, final):
+        return self._aesgcm.encrypt(segment_nonce(self._iv, index), data,
+                                    segment_aad(index, final))
+
+    def open(self, index, sealed, final):
+        return self._aesgcm.decrypt(segment_nonce(self._iv, index), sealed,
+                                    segment_aad(index, final))
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised while streaming an upload once it exceeds the size limit.
+    """
+
+
+def iter_stream(stream, chunk_size=SEGMENT_SIZE):
+    """
+    Yield successive reads of up to `chunk_size` bytes until the stream ends.
+    """
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+def limit_size(chunks, max_bytes):
+    """
+    Pass chunks through, raising UploadTooLarge once more than `max_bytes`
+    have been seen.
+    """
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes.")
+        yield chunk
+
+
+def hash_chunks(chunks, digest):
+    """
+    Pass chunks through, feeding each one to `digest`.
+    """
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def read_exactly(stream, size):
+    """
+    Read `size` bytes from a file-like object, looping over short reads.
+    Returns fewer bytes only if the stream ends first.
+    """
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+
+def encrypt_segments(chunks, key, iv_bytes, segment_size=SEGMENT_SIZE):
+    """
+    Encrypt a stream of plaintext chunks, yielding (index, sealed) tuples.
+    """
+    cipher = SegmentCipher(key, iv_bytes)
+    for index, data, final in iter_segments(chunks, segment_size):
+        yield index, cipher.seal(index, data, final)
+
+
+def decrypt_segments(sealed_segments, key, iv_bytes, segment_count, first=0):
+    """
+    Decrypt (index, sealed) tuples in order, yielding one plaintext segment at a
+    time. `first` is the index the iterable is expected to start at.
+    """
+    cipher = SegmentCipher(key, iv_bytes)
+    expected = first
+    for index, sealed in sealed_segments:
+        if index != expected:
+            raise ValueError(f"Segment {expected} is missing.")
+        yield cipher.open(index, bytes(sealed), index == segment_count - 1)
+        expected += 1
+
+
+def parse_range_header(header, size):
+    """
+    Parse a `Range: bytes=...` header against a resource of `size` bytes.
+    Returns None when the whole resource should be served, [] when no range
+    is satisfiable, otherwise a sorted list of merged (start, stop) tuples.
+    """
+    if not header or size == 0:
+        return None
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+
+    def is_number(value):
+        # ASCII digits only: isdigit() alone also accepts superscripts,
+        # which int() rejects, and other scripts' digits, which RFC 9110
+        # does not allow.
+        return value.isascii() and value.isdigit()
+
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if (not sep or not (first or last) or (first and not is_number(first))
+                or (last and not is_number(last))):
+            return None
+        if not first:
+            # Suffix range: the last N bytes.
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None  # Syntactically invalid, so the header is ignored.
+        if start >= size:
+            continue
+        stop = int(last) + 1 if last else size
+        ranges.append((start, min(stop, size)))
+
+    if not ranges:
+        return []
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, stop in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def encode_cursor(position):
+    """
+    Encode a keyset position (a JSON-serialisable dict) as an opaque,
+    URL-safe cursor string.
+    """
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor. Raises ValueError if it is
+    malformed.
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,  # 32 bytes = 256 bits
-        salt=salt_bytes,
-        iterations=iterations,
-        backend=default_backend())
-    return kdf.derive(settings.BACKEND_ENCRYPTION_SECRET)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor.") from exc
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor.")
+    return position
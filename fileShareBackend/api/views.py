@@ -3,7 +3,8 @@ from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from django.contrib.auth.models import User
 from .serializers import UserSerializer, FileShareSerializer, EncryptedFileListSerializer, AdminFileSerializer
 from rest_framework import generics, permissions
@@ -11,18 +12,238 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import EncryptedFile, FileShare
-from django.http import HttpResponse, JsonResponse
+from .acl import access_cache, get_accessible_file
+from .hashers import PasswordHashingBusy
+from .revocation import revocation_list
+from .routers import ReadOnlyViewMixin
+from .models import EncryptedFile, FileShare, OutboundEmail, PublicLink, StorageQuotaExceeded, StorageUsage, UploadSession, UploadSessionFinalizing, UploadPart
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import http_date
 import mimetypes
-from urllib.parse import quote
+import itertools
+import secrets
+import time
+from urllib.parse import quote, unquote
 import random
 from django.core.cache import cache
-from django.core.mail import send_mail
-from django.db.models import Q, Case, When, Value, CharField, Subquery, OuterRef
-from .utlis import derive_backend_key
+from django.db.models import Q
+from django.db import transaction
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from .utlis import encrypt_segments, hash_chunks, new_data_key, parse_range_header, iter_stream, limit_size, UploadTooLarge, SEGMENT_SIZE, encode_cursor, decode_cursor
 import base64
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from datetime import timedelta
+import hashlib
+
+# Rows per INSERT ... ON CONFLICT statement when upserting shares.
+SHARE_BATCH_SIZE = 500
+# Seconds an emailed MFA code stays valid.
+MFA_CODE_TIMEOUT = 300
+# Wrong guesses allowed against one MFA code before it is thrown away.
+MFA_MAX_ATTEMPTS = 5
+
+
+def _create_file_from_stream(owner, file_name, iv, salt, chunks):
+    """
+    Create an EncryptedFile from a stream of client-encrypted chunks. In the
+    default 'database' mode the stream is sealed into segments under a fresh
+    data key; in 'passthrough' mode it is written to disk as received.
+    """
+    if settings.FILE_STORAGE_MODE == 'passthrough':
+        # As below, the row is committed as 'pending' so no write lock is
+        # held while the file is written to disk.
+        encrypted_file = EncryptedFile.objects.create(owner=owner,
+                                                      iv=iv,
+                                                      file_name=file_name,
+                                                      salt=salt,
+                                                      storage_format='pending')
+        try:
+            encrypted_file.store_passthrough(chunks)
+        except BaseException:
+            encrypted_file.delete()
+            raise
+        return encrypted_file
+
+    iv_bytes = base64.b64decode(iv)
+    # Each file gets its own random data key; only the wrapped form is stored.
+    key, wrapped_key, key_version = new_data_key()
+    # The row is committed as 'pending' first, so the segments written to
+    # the blob database always have a file to belong to and the metadata
+    # write lock is never held while they are written.
+    encrypted_file = EncryptedFile.objects.create(
+        owner=owner,
+        iv=iv,  # store as provided (Base64 string)
+        file_name=file_name,
+        salt=salt,  # store as provided (Base64 string)
+        storage_format='pending',
+        wrapped_key=wrapped_key,
+        key_version=key_version)
+    # Encrypt and store the upload segment by segment so the whole file is
+    # never held in memory, hashing it on the way.
+    digest = hashlib.sha256()
+    try:
+        encrypted_file.store_segments(
+            encrypt_segments(hash_chunks(chunks, digest), key, iv_bytes),
+            digest)
+    except BaseException:
+        # Deleting the row also removes the segments written so far.
+        encrypted_file.delete()
+        raise
+    return encrypted_file
+
+
+def _fits_quota(remaining, size):
+    # `remaining` is StorageUsage.remaining_for(), None for no quota.
+    return remaining is None or size <= remaining
+
+
+def _quota_exceeded_response(remaining):
+    """
+    413 response for an upload that does not fit in the `remaining` bytes of
+    its owner's quota. These early checks only spare reading the body;
+    StorageUsage.add_file enforces the quota when the file is stored.
+    """
+    return Response(
+        {
+            'message': 'Storage quota exceeded.',
+            'remaining_bytes': remaining,
+        },
+        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+def _session_finalizing_response():
+    return Response({'message': 'Upload is already being completed.'},
+                    status=status.HTTP_409_CONFLICT)
+
+
+def _start_decrypted_stream(file_instance, start=0, stop=None):
+    """
+    Decrypt the first segment eagerly so key or integrity errors can still be
+    reported as a 500, then decrypt the rest lazily while it is sent.
+    """
+    chunks = file_instance.iter_plaintext(start, stop)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return iter(())
+    return itertools.chain([first_chunk], chunks)
+
+
+def _multipart_byteranges(file_instance, ranges, part_headers, closing,
+                          first_chunks):
+    """
+    Yield a multipart/byteranges body, decrypting one range at a time.
+    """
+    for index, ((start, stop), header) in enumerate(zip(ranges,
+                                                        part_headers)):
+        yield header
+        if index == 0:
+            yield from first_chunks
+        else:
+            yield from file_instance.iter_plaintext(start, stop)
+    yield closing
+
+
+def _file_download_response(request, file_instance, claim=None):
+    """
+    Build the streaming download response for `file_instance`, honouring
+    Range and If-Range. `claim` is called before anything is read, with the
+    number of bytes about to be served if the request resumes a download
+    (its ranges start past the first byte) and 0 otherwise; if it returns
+    False the response is a 410 instead.
+    """
+    file_name = file_instance.file_name
+    content_type, _ = mimetypes.guess_type(file_name)
+    if not content_type:
+        content_type = "application/octet-stream"
+    encoded_filename = quote(file_name)
+
+    if (file_instance.storage_format == 'passthrough'
+            and settings.PASSTHROUGH_ACCEL_PREFIX):
+        # nginx serves the stored ciphertext (including Range requests) via
+        # sendfile, so every hand-off is claimed.
+        if claim and not claim():
+            return _link_used_up_response()
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = (settings.PASSTHROUGH_ACCEL_PREFIX +
+                                        file_instance.storage_path)
+        response["Access-Control-Expose-Headers"] = "Content-Disposition"
+        response[
+            "Content-Disposition"] = f'attachment; filename="{encoded_filename}"'
+        return response
+
+    size = file_instance.size_bytes
+    etag = f'"{file_instance.pk}-{file_instance.uploaded_at.timestamp():.0f}"'
+    last_modified = http_date(file_instance.uploaded_at.timestamp())
+
+    # A stale If-Range validator means the client gets the whole file.
+    ranges = None
+    if_range = request.headers.get("If-Range")
+    if if_range is None or if_range in (etag, last_modified):
+        ranges = parse_range_header(request.headers.get("Range"), size)
+    if ranges == []:
+        response = Response(
+            {"error": "Requested range not satisfiable."},
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    resumed = 0
+    if ranges is not None and ranges[0][0] > 0:
+        resumed = sum(stop - start for start, stop in ranges)
+    if claim and not claim(resumed):
+        return _link_used_up_response()
+
+    try:
+        if ranges is None:
+            response_status = status.HTTP_200_OK
+            chunks = _start_decrypted_stream(file_instance)
+            content_length = size
+        else:
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+            start, stop = ranges[0]
+            chunks = _start_decrypted_stream(file_instance, start, stop)
+            content_length = stop - start
+    except Exception as e:
+        return Response({'error': 'Decryption failed: ' + str(e)},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    response_content_type = content_type
+    if ranges is not None and len(ranges) > 1:
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+             ).encode() for start, stop in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        content_length = sum(len(header) for header in part_headers) + sum(
+            stop - start for start, stop in ranges) + len(closing)
+        chunks = _multipart_byteranges(file_instance, ranges, part_headers,
+                                       closing, chunks)
+        response_content_type = f"multipart/byteranges; boundary={boundary}"
+
+    response = StreamingHttpResponse(chunks,
+                                     status=response_status,
+                                     content_type=response_content_type)
+    response["Content-Length"] = str(content_length)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    if ranges is not None and len(ranges) == 1:
+        start, stop = ranges[0]
+        response["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+    response["Access-Control-Expose-Headers"] = (
+        "Content-Disposition, Content-Range, Accept-Ranges, ETag")
+    response[
+        "Content-Disposition"] = f'attachment; filename="{encoded_filename}"'
+    return response
+
+
+def _link_used_up_response():
+    return Response(
+        {"error": "This public link has expired or has been used up."},
+        status=status.HTTP_410_GONE)
 
 
 # Register View
@@ -58,6 +279,10 @@ class RegisterView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        except PasswordHashingBusy:
+            # A 503 with Retry-After from DRF's exception handler.
+            raise
+
         except Exception as e:
             # Handle other exceptions like database errors
 
@@ -95,15 +320,24 @@ class LoginView(APIView):
         if not email_code:
             # Generate a 6-digit numeric code
             mfa_code = random.randint(100000, 999999)
-            # Store the code in the cache for 5 minutes (300 seconds)
-            cache.set(cache_key, mfa_code, timeout=300)
-            # Send the code to the user's email
-            send_mail(
+            # Store the code in the cache for 5 minutes (300 seconds), with
+            # its expiry and the number of wrong guesses made against it.
+            cache.set(cache_key, {
+                'code': mfa_code,
+                'expires_at': time.time() + MFA_CODE_TIMEOUT,
+                'failures': 0,
+            },
+                      timeout=MFA_CODE_TIMEOUT)
+            # Queue the code for the send_queued_email worker, so SMTP
+            # latency never reaches the login response. A code that could
+            # not be delivered before it expires is never sent.
+            OutboundEmail.queue(
                 subject="Your MFA Code",
                 message=f"Your multi-factor authentication code is: {mfa_code}",
                 from_email="no-reply@yourdomain.com",
                 recipient_list=[user.email],
-                fail_silently=False,
+                discard_after=timezone.now() +
+                timedelta(seconds=MFA_CODE_TIMEOUT),
             )
             return Response(
                 {
@@ -112,15 +346,26 @@ class LoginView(APIView):
                 },
                 status=status.HTTP_202_ACCEPTED)
 
-        # If an email_code is provided, verify it.
-        cached_code = cache.get(cache_key)
-        if not cached_code or str(cached_code) != str(email_code):
+        # If an email_code is provided, verify it. The code is taken out of
+        # the cache atomically before it is compared, so of two requests
+        # racing with the same code only one logs in.
+        entry = cache.pop(cache_key, None)
+        if entry is None or not secrets.compare_digest(
+                str(entry['code']).encode(),
+                str(email_code).encode()):
+            if entry is not None:
+                # Put the code back for another try until too many wrong
+                # guesses were made, without extending its lifetime or
+                # replacing a newer code.
+                failures = entry['failures'] + 1
+                timeout = entry['expires_at'] - time.time()
+                if failures < MFA_MAX_ATTEMPTS and timeout > 0:
+                    cache.add(cache_key,
+                              dict(entry, failures=failures),
+                              timeout=timeout)
             return Response({"error": "Invalid MFA code."},
                             status=status.HTTP_401_UNAUTHORIZED)
 
-        # If the MFA code is valid, delete it from the cache
-        cache.delete(cache_key)
-
         # Generate JWT tokens
         refresh = RefreshToken.for_user(user)
         response = Response(
@@ -132,26 +377,85 @@ class LoginView(APIView):
             },
             status=status.HTTP_200_OK)
 
-        # Set tokens in HTTP-only cookies
-        response.set_cookie(
-            key="access_token",
-            value=str(refresh.access_token),
-            httponly=True,
-            secure=True,  # Set True in production
-            samesite="None",
-            max_age=86400)
-        response.set_cookie(
-            key="refresh_token",
-            value=str(refresh),
-            httponly=True,
-            secure=True,  # Set True in production
-            samesite="None",
-            max_age=86400)
+        _set_token_cookies(response, refresh)
+        return response
 
+
+def _set_token_cookies(response, refresh):
+    """
+    Set the access and refresh tokens of `refresh` in HTTP-only cookies.
+    """
+    response.set_cookie(
+        key="access_token",
+        value=str(refresh.access_token),
+        httponly=True,
+        secure=True,  # Set True in production
+        samesite="None",
+        max_age=86400)
+    response.set_cookie(
+        key="refresh_token",
+        value=str(refresh),
+        httponly=True,
+        secure=True,  # Set True in production
+        samesite="None",
+        max_age=86400)
+
+
+class TokenRefreshView(APIView):
+    """
+    Exchange the refresh token cookie (or a "refresh" field) for a new access
+    token. With ROTATE_REFRESH_TOKENS a new refresh token is issued as well,
+    and with BLACKLIST_AFTER_ROTATION the old one is revoked, so a refresh
+    token can only be used once.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        raw_token = (request.COOKIES.get("refresh_token")
+                     or request.data.get("refresh"))
+        if not raw_token:
+            return Response({"error": "Refresh token is required."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            refresh = RefreshToken(raw_token)
+        except TokenError:
+            return Response({"error": "Invalid or expired refresh token."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+        if revocation_list.is_revoked(refresh[jwt_settings.JTI_CLAIM]):
+            return Response({"error": "Refresh token has been revoked."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+        user = User.objects.filter(
+            **{
+                jwt_settings.USER_ID_FIELD:
+                refresh.get(jwt_settings.USER_ID_CLAIM)
+            }).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            return Response({"error": "User is inactive or does not exist."},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            # Revoking is the claim: of two requests racing with the same
+            # token only one gets a new pair.
+            if (jwt_settings.BLACKLIST_AFTER_ROTATION
+                    and not revocation_list.revoke(refresh)):
+                return Response(
+                    {"error": "Refresh token has been revoked."},
+                    status=status.HTTP_401_UNAUTHORIZED)
+            refresh = RefreshToken.for_user(user)
+
+        response = Response(
+            {
+                "message": "Token refreshed",
+                "access": str(refresh.access_token),
+                "refresh": str(refresh),
+            },
+            status=status.HTTP_200_OK)
+        _set_token_cookies(response, refresh)
         return response
 
 
-class ProfileView(APIView):
+class ProfileView(ReadOnlyViewMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
@@ -172,6 +476,17 @@ class ProfileView(APIView):
 class LogoutView(APIView):
 
     def get(self, request):
+        # Revoke both tokens, so copies of the cookies stop working too.
+        for cookie, token_class in (("access_token", AccessToken),
+                                    ("refresh_token", RefreshToken)):
+            raw_token = request.COOKIES.get(cookie)
+            if not raw_token:
+                continue
+            try:
+                revocation_list.revoke(token_class(raw_token))
+            except TokenError:
+                pass  # already invalid
+
         response = Response({"message": "Logout successful"})
 
         response.set_cookie(
@@ -196,37 +511,344 @@ class FileUploadView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def post(self, request):
+        # Checked before the multipart body is parsed. Content-Length also
+        # counts the form fields, so it slightly overestimates the file; a
+        # request without one is checked once the file's size is known.
+        remaining = StorageUsage.remaining_for(request.user)
+        try:
+            content_length = int(request.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = 0
+        if not _fits_quota(remaining, content_length):
+            return _quota_exceeded_response(remaining)
+
         file = request.FILES.get('file')
         iv = request.data.get('iv')
         salt = request.data.get('salt')
         if not file or not iv or not salt:
             return Response({'message': 'File, IV, and salt are required.'},
                             status=status.HTTP_400_BAD_REQUEST)
+        if file.size > settings.MAX_UPLOAD_SIZE:
+            return Response({'message': 'File is too large.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if not _fits_quota(remaining, file.size):
+            return _quota_exceeded_response(remaining)
 
         try:
+            encrypted_file = _create_file_from_stream(request.user, file.name,
+                                                      iv, salt, file.chunks())
+        except StorageQuotaExceeded:
+            return _quota_exceeded_response(
+                StorageUsage.remaining_for(request.user))
+        except Exception as e:
+            return Response({'message': 'Encryption failed: ' + str(e)},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            raw_data = file.read()
+        return Response(
+            {
+                'message': 'File uploaded successfully',
+                'file_id': encrypted_file.id,
+            },
+            status=status.HTTP_201_CREATED)
 
-            salt_bytes = base64.b64decode(salt)
-            iv_bytes = base64.b64decode(iv)
 
-            key = derive_backend_key(salt_bytes)
+class RawFileUploadView(APIView):
+    """
+    Single-pass upload: PUT the file as an application/octet-stream body with
+    the metadata in headers:
+    - X-File-Name (percent-encoded original file name)
+    - X-File-IV (Base64 encoded)
+    - X-File-Salt (Base64 encoded)
+    The body is read straight from the socket, encrypted and stored segment by
+    segment, without multipart parsing or spooling to a temp file.
+    """
+    permission_classes = [IsAuthenticated]
 
-            aesgcm = AESGCM(key)
-            encrypted_data = aesgcm.encrypt(iv_bytes, raw_data, None)
+    def put(self, request):
+        file_name = unquote(request.headers.get('X-File-Name', ''))
+        iv = request.headers.get('X-File-IV')
+        salt = request.headers.get('X-File-Salt')
+        if not file_name or not iv or not salt:
+            return Response(
+                {
+                    'message':
+                    'X-File-Name, X-File-IV and X-File-Salt are required.'
+                },
+                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            content_length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response({'message': 'Content-Length is required.'},
+                            status=status.HTTP_411_LENGTH_REQUIRED)
+        if content_length > settings.MAX_UPLOAD_SIZE:
+            return Response({'message': 'File is too large.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        remaining = StorageUsage.remaining_for(request.user)
+        if not _fits_quota(remaining, content_length):
+            return _quota_exceeded_response(remaining)
+
+        # The limits are enforced again while streaming, in case the body
+        # does not match its Content-Length.
+        limit = settings.MAX_UPLOAD_SIZE
+        if remaining is not None and remaining < limit:
+            limit = remaining
+        try:
+            chunks = limit_size(iter_stream(request), limit)
+            encrypted_file = _create_file_from_stream(request.user, file_name,
+                                                      iv, salt, chunks)
+        except UploadTooLarge:
+            if limit == remaining:
+                return _quota_exceeded_response(remaining)
+            return Response({'message': 'File is too large.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except StorageQuotaExceeded:
+            return _quota_exceeded_response(
+                StorageUsage.remaining_for(request.user))
         except Exception as e:
             return Response({'message': 'Encryption failed: ' + str(e)},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Create and store the EncryptedFile instance
-        encrypted_file = EncryptedFile.objects.create(
+        return Response(
+            {
+                'message': 'File uploaded successfully',
+                'file_id': encrypted_file.id,
+            },
+            status=status.HTTP_201_CREATED)
+
+
+class UploadSessionCreateView(APIView):
+    """
+    Start a resumable upload. Expects JSON:
+    {"file_name": "...", "iv": "...", "salt": "...", "size": <bytes>,
+     "part_size": <bytes, optional>}
+    The client then PUTs each chunk of `chunk_size` bytes by index, or, for a
+    parallel upload, each part of `part_size` bytes by part number.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        file_name = request.data.get('file_name')
+        iv = request.data.get('iv')
+        salt = request.data.get('salt')
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if not file_name or not iv or not salt or size < 0:
+            return Response(
+                {'message': 'File name, IV, salt and size are required.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        if size > settings.MAX_UPLOAD_SIZE:
+            return Response({'message': 'File is too large.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        remaining = StorageUsage.remaining_for(request.user)
+        if not _fits_quota(remaining, size):
+            return _quota_exceeded_response(remaining)
+
+        try:
+            part_size = int(request.data.get('part_size', SEGMENT_SIZE))
+        except (TypeError, ValueError):
+            part_size = 0
+        if (part_size <= 0 or part_size % SEGMENT_SIZE
+                or part_size > settings.MAX_UPLOAD_PART_SIZE):
+            return Response(
+                {
+                    'message':
+                    f'Part size must be a multiple of {SEGMENT_SIZE} bytes '
+                    f'and at most {settings.MAX_UPLOAD_PART_SIZE} bytes.'
+                },
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Opportunistically clear out abandoned sessions.
+        UploadSession.purge_expired()
+
+        _, wrapped_key, key_version = new_data_key()
+        session = UploadSession.objects.create(
             owner=request.user,
-            file_data=encrypted_data,
-            iv=iv,  # store as provided (Base64 string)
-            file_name=file.name,
-            salt=salt  # store as provided (Base64 string)
-        )
+            file_name=file_name,
+            iv=iv,
+            salt=salt,
+            size_bytes=size,
+            part_size=part_size,
+            wrapped_key=wrapped_key,
+            key_version=key_version,
+            expires_at=timezone.now() + settings.UPLOAD_SESSION_TTL)
 
+        return Response(
+            {
+                'session_id': session.id,
+                'chunk_size': session.chunk_size,
+                'chunk_count': session.chunk_count,
+                'part_size': session.part_size,
+                'part_count': session.part_count,
+                'expires': session.expires_at,
+            },
+            status=status.HTTP_201_CREATED)
+
+
+class UploadSessionView(APIView):
+    """
+    GET reports which chunk ranges have arrived; DELETE aborts the upload.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(UploadSession,
+                                    id=session_id,
+                                    owner=request.user,
+                                    expires_at__gte=timezone.now())
+        received = session.received_ranges()
+        received_count = sum(last - first + 1 for first, last in received)
+        return Response(
+            {
+                'session_id': session.id,
+                'chunk_size': session.chunk_size,
+                'chunk_count': session.chunk_count,
+                'received': received,
+                'missing_count': session.chunk_count - received_count,
+                'expires': session.expires_at,
+            },
+            status=status.HTTP_200_OK)
+
+    def delete(self, request, session_id):
+        sessions = UploadSession.objects.filter(id=session_id,
+                                                owner=request.user)
+        # A session being completed still has its chunks read, so the
+        # delete is conditional on it not being claimed.
+        if not sessions.filter(finalizing=False).delete()[0]:
+            if sessions.exists():
+                return _session_finalizing_response()
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(APIView):
+    """
+    PUT the raw bytes of one chunk. Chunks may arrive in any order and may be
+    re-sent; only the last copy is kept.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, session_id, index):
+        session = get_object_or_404(UploadSession,
+                                    id=session_id,
+                                    owner=request.user,
+                                    expires_at__gte=timezone.now())
+        if session.finalizing:
+            return _session_finalizing_response()
+        if index >= session.chunk_count:
+            return Response({'message': 'Chunk index out of range.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        expected = session.expected_chunk_length(index)
+        # Read at most one byte past the expected length to detect oversize
+        # chunks without buffering an arbitrarily large body.
+        data = request.read(expected + 1)
+        if len(data) != expected:
+            return Response(
+                {'message': f'Chunk {index} must be {expected} bytes.'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            session.store_chunk(index, data)
+        except UploadSessionFinalizing:
+            return _session_finalizing_response()
+        return Response({'index': index}, status=status.HTTP_200_OK)
+
+
+class UploadPartView(APIView):
+    """
+    PUT the raw bytes of one part of a parallel upload. Parts of the same
+    session can be sent concurrently over separate connections; each one is
+    streamed through the cipher a chunk at a time.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, session_id, part_number):
+        session = get_object_or_404(UploadSession,
+                                    id=session_id,
+                                    owner=request.user,
+                                    expires_at__gte=timezone.now())
+        if session.finalizing:
+            return _session_finalizing_response()
+        if part_number >= session.part_count:
+            return Response({'message': 'Part number out of range.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            part = session.store_part(part_number, request)
+        except UploadSessionFinalizing:
+            return _session_finalizing_response()
+        if part is None:
+            return Response(
+                {'message': f'Part {part_number} has the wrong length.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {
+                'part': part.number,
+                'size': part.size_bytes,
+                'etag': part.etag,
+            },
+            status=status.HTTP_200_OK)
+
+
+class UploadSessionCompleteView(APIView):
+    """
+    Turn a fully received session into an EncryptedFile.
+    Parallel uploads may send their part manifest,
+    {"parts": [{"part": 0, "etag": "..."}, ...]}, which must match the parts
+    the server stored.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, session_id):
+        session = get_object_or_404(UploadSession,
+                                    id=session_id,
+                                    owner=request.user,
+                                    expires_at__gte=timezone.now())
+        if session.finalizing:
+            return _session_finalizing_response()
+        received = session.received_ranges()
+        if received != [[0, session.chunk_count - 1]]:
+            return Response(
+                {
+                    'message': 'Upload is incomplete.',
+                    'received': received,
+                },
+                status=status.HTTP_409_CONFLICT)
+
+        manifest = request.data.get('parts')
+        if manifest is not None:
+            try:
+                expected = {(int(p['part']), p['etag']) for p in manifest}
+            except (TypeError, KeyError, ValueError):
+                return Response({'message': 'Invalid part manifest.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            stored = set(
+                UploadPart.objects.filter(session=session).values_list(
+                    'number', 'etag'))
+            if expected != stored or len(stored) != session.part_count:
+                return Response(
+                    {'message': 'Part manifest does not match the upload.'},
+                    status=status.HTTP_409_CONFLICT)
+
+        # Checked again: other uploads may have finished since the session
+        # was created.
+        remaining = StorageUsage.remaining_for(request.user)
+        if not _fits_quota(remaining, session.size_bytes):
+            return _quota_exceeded_response(remaining)
+
+        # Only one of several concurrent requests gets to copy the chunks;
+        # chunk and part writes are refused from here on.
+        if not session.claim():
+            return _session_finalizing_response()
+        try:
+            encrypted_file = session.finalize()
+        except StorageQuotaExceeded:
+            # The session is kept, so the upload can be completed once
+            # space has been freed.
+            return _quota_exceeded_response(
+                StorageUsage.remaining_for(request.user))
         return Response(
             {
                 'message': 'File uploaded successfully',
@@ -235,93 +857,141 @@ class FileUploadView(APIView):
             status=status.HTTP_201_CREATED)
 
 
-class GetFileList(ListAPIView):
+class GetFileList(ReadOnlyViewMixin, ListAPIView):
+    """
+    Keyset-paginated listing of the files a user owns or has been shared.
+
+    Query parameters:
+      sort       uploaded_at (default), file_name or size_bytes; prefix with
+                 '-' for descending order. Default is '-uploaded_at'.
+      scope      all (default), owned or shared.
+      page_size  number of files per page, capped at FILE_LIST_MAX_PAGE_SIZE.
+      cursor     the next_cursor value of the previous page.
+
+    Each page seeks past the last (value, id) pair with at most two indexed
+    queries (owned and shared), so deep pages cost the same as the first one.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = EncryptedFileListSerializer
+    sort_fields = ('uploaded_at', 'file_name', 'size_bytes')
+    scopes = ('all', 'owned', 'shared')
 
-    def get_queryset(self):
+    def get_queryset(self, scope='all'):
         user = self.request.user
-        # Return files where the owner is the user or the file is shared with the user.
-        # distinct() avoids duplicate results if a file is both owned and shared.
-        queryset = EncryptedFile.objects.filter(
-            Q(owner=user) | Q(shared_with=user)).distinct().select_related(
-                'owner').prefetch_related('shared_with')
-        return queryset
+        # A subquery on FileShare(user, file) instead of a join keeps each
+        # file to one row, so no DISTINCT is needed.
+        shared = FileShare.objects.filter(user=user).values('file')
+        if scope == 'owned':
+            queryset = EncryptedFile.objects.filter(owner=user)
+        elif scope == 'shared':
+            queryset = EncryptedFile.objects.filter(pk__in=shared).exclude(
+                owner=user)
+        else:
+            queryset = EncryptedFile.objects.filter(
+                Q(owner=user) | Q(pk__in=shared))
+        # Files still being uploaded are not listed.
+        return queryset.exclude(storage_format='pending').select_related(
+            'owner').only(*self.serializer_class.Meta.fields,
+                          'owner__username')
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        sort = request.query_params.get('sort', '-uploaded_at')
+        field = sort.lstrip('-')
+        descending = sort.startswith('-')
+        scope = request.query_params.get('scope', 'all')
+        if field not in self.sort_fields:
+            return Response(
+                {"error": f"sort must be one of {', '.join(self.sort_fields)}."},
+                status=status.HTTP_400_BAD_REQUEST)
+        if scope not in self.scopes:
+            return Response(
+                {"error": f"scope must be one of {', '.join(self.scopes)}."},
+                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page_size = int(
+                request.query_params.get('page_size',
+                                         settings.FILE_LIST_PAGE_SIZE))
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            return Response({"error": "page_size must be a positive integer."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page_size = min(page_size, settings.FILE_LIST_MAX_PAGE_SIZE)
+
+        seek = Q()
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+                if position.get('sort') != sort:
+                    raise ValueError("Cursor belongs to another sort order.")
+                value = EncryptedFile._meta.get_field(field).to_python(
+                    position['value'])
+                last_id = int(position['id'])
+            except (KeyError, TypeError, ValueError, DjangoValidationError):
+                return Response({"error": "Invalid cursor."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            after = 'lt' if descending else 'gt'
+            seek = (Q(**{f'{field}__{after}': value}) |
+                    Q(**{field: value, f'id__{after}': last_id}))
+
+        prefix = '-' if descending else ''
+        ordering = (prefix + field, prefix + 'id')
+        # Owned and shared files are read with one index-ordered query each
+        # and merged here, rather than sorting the union in the database.
+        parts = ['owned', 'shared'] if scope == 'all' else [scope]
+        files = [
+            f for part in parts for f in self.get_queryset(part).filter(
+                seek).order_by(*ordering)[:page_size + 1]
+        ]
+        files.sort(key=lambda f: (getattr(f, field), f.id), reverse=descending)
+        files = files[:page_size + 1]
+
+        next_cursor = None
+        if len(files) > page_size:
+            files = files[:page_size]
+            last = files[-1]
+            value = getattr(last, field)
+            next_cursor = encode_cursor({
+                'sort': sort,
+                'value': value.isoformat() if field == 'uploaded_at' else value,
+                'id': last.id,
+            })
+
+        serializer = self.get_serializer(files, many=True)
         # Wrap the serialized data in a "files" key, similar to your original response.
-        return Response({"files": serializer.data}, status=200)
+        return Response({
+            "files": serializer.data,
+            "next_cursor": next_cursor
+        },
+                        status=200)
 
 
-class FileView(APIView):
+class FileView(ReadOnlyViewMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        # Optimize query: allow if owner or shared with the user
-        qs = EncryptedFile.objects.select_related('owner').prefetch_related(
-            'shared_with').annotate(access_type=Case(
-                When(owner=request.user, then=Value("owner")),
-                default=Subquery(
-                    FileShare.objects.filter(file=OuterRef('pk'),
-                                             user=request.user).values(
-                                                 'access_type')[:1]),
-                output_field=CharField())).filter(id=pk,
-                                                  access_type__isnull=False)
-
-        file_instance = get_object_or_404(qs)
-
-        file_name = file_instance.file_name
-        content_type, _ = mimetypes.guess_type(file_name)
-        if not content_type:
-            content_type = "application/octet-stream"
-        encoded_filename = quote(file_name)
-
-        # Decrypt the file data:
-        try:
-            salt_bytes = base64.b64decode(file_instance.salt)
-            iv_bytes = base64.b64decode(file_instance.iv)
-            key = derive_backend_key(salt_bytes)
-            aesgcm = AESGCM(key)
-            decrypted_data = aesgcm.decrypt(iv_bytes, file_instance.file_data,
-                                            None)
-        except Exception as e:
-            return Response({'error': 'Decryption failed: ' + str(e)},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Allowed for the owner and for users the file is shared with.
+        file_instance = get_accessible_file(request.user, pk)
 
-        response = HttpResponse(decrypted_data, content_type=content_type)
-        response["Access-Control-Expose-Headers"] = "Content-Disposition"
-        response[
-            "Content-Disposition"] = f'attachment; filename="{encoded_filename}"'
-        return response
+        return _file_download_response(request, file_instance)
 
 
-class FileMetadataView(APIView):
+class FileMetadataView(ReadOnlyViewMixin, APIView):
     """
     Returns metadata for the requested file:
     - file_name (original file name)
     - salt (Base64 encoded)
     - iv (Base64 encoded)
     - mimeType (guessed from the file name, defaults to application/pdf)
+    - size_bytes
+    - sha256 (hex digest of the uploaded bytes; empty for older files)
     """
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        # Retrieve the file instance ensuring it is owned by the authenticated user.
-        qs = EncryptedFile.objects.select_related('owner').prefetch_related(
-            'shared_with').annotate(access_type=Case(
-                When(owner=request.user, then=Value("owner")),
-                default=Subquery(
-                    FileShare.objects.filter(file=OuterRef('pk'),
-                                             user=request.user).values(
-                                                 'access_type')[:1]),
-                output_field=CharField())).filter(id=pk,
-                                                  access_type__isnull=False)
-
-        file_instance = get_object_or_404(qs)
-        # file_share = FileShare.objects.filter(file=file_instance,
-        #                                       user=request.user).first()
+        # Retrieve the file instance ensuring the user owns it or it is shared with them.
+        file_instance = get_accessible_file(request.user, pk)
         # Guess MIME type; if unknown, default to PDF since we only allow PDFs.
         mime_type, _ = mimetypes.guess_type(file_instance.file_name)
         if not mime_type:
@@ -332,6 +1002,8 @@ class FileMetadataView(APIView):
             "salt": file_instance.salt,
             "iv": file_instance.iv,
             "mimeType": mime_type,
+            "size_bytes": file_instance.size_bytes,
+            "sha256": file_instance.sha256,
             "access_type": file_instance.access_type
         }
         return JsonResponse(data)
@@ -342,22 +1014,33 @@ class GeneratePublicLinkView(APIView):
 
     def post(self, request, pk):
         # Retrieve the file ensuring that the user is the owner.
-        file_instance = get_object_or_404(EncryptedFile,
-                                          id=pk,
-                                          owner=request.user)
+        file_instance = get_object_or_404(
+            EncryptedFile.objects.exclude(storage_format='pending'),
+            id=pk,
+            owner=request.user)
 
-        # Optional: Check if a public token already exists and if it's still valid.
-        if file_instance.public_token and not file_instance.is_public_link_expired(
-        ):
-            # Optionally, you can update the expiration or return the existing link.
-            public_token = file_instance.public_token
-            expires = file_instance.public_token_expires
-        else:
-            # Generate a new public link valid for the given hours (default 24)
+        limits = settings.PUBLIC_LINKS
+        try:
             hours_valid = int(request.data.get('hours_valid', 24))
-            file_instance.generate_public_link(hours_valid=hours_valid)
-            public_token = file_instance.public_token
-            expires = file_instance.public_token_expires
+            max_downloads = int(request.data.get('max_downloads', 1))
+        except (TypeError, ValueError):
+            hours_valid = max_downloads = 0
+        if not (1 <= hours_valid <= limits['MAX_HOURS_VALID']
+                and 1 <= max_downloads <= limits['MAX_DOWNLOADS']):
+            return Response(
+                {
+                    "error":
+                    "hours_valid must be between 1 and "
+                    f"{limits['MAX_HOURS_VALID']} and max_downloads between "
+                    f"1 and {limits['MAX_DOWNLOADS']}."
+                },
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Every call creates a new link; the token is only shown here.
+        link, public_token = PublicLink.create_for(
+            file_instance,
+            hours_valid=hours_valid,
+            max_downloads=max_downloads)
 
         # Build the public URL. In production, you might include the full domain.
         public_url = public_token
@@ -365,29 +1048,30 @@ class GeneratePublicLinkView(APIView):
             {
                 "message": "Public link generated successfully",
                 "public_url": public_url,
-                "expires": expires,
+                "expires": link.expires_at,
+                "remaining_downloads": link.remaining_downloads,
             },
             status=status.HTTP_200_OK)
 
 
-class PublicViewMetaData(APIView):
+class PublicViewMetaData(ReadOnlyViewMixin, APIView):
     """
     Returns metadata for the requested file:
     - file_name (original file name)
     - salt (Base64 encoded)
     - iv (Base64 encoded)
     - mimeType (guessed from the file name, defaults to application/pdf)
+    - size_bytes
+    - sha256 (hex digest of the uploaded bytes; empty for older files)
     """
 
     def get(self, request, public_token):
-        # Retrieve the file instance ensuring it is owned by the authenticated user.
-        file_instance = get_object_or_404(
-            EncryptedFile,
-            public_token=public_token,
-        )
-        if file_instance.is_public_link_expired():
-            return Response({"error": "This public link has expired."},
-                            status=status.HTTP_410_GONE)
+        link = PublicLink.lookup(public_token)
+        if link is None:
+            raise Http404
+        if not link.is_usable():
+            return _link_used_up_response()
+        file_instance = link.file
         # Guess MIME type; if unknown, default to PDF since we only allow PDFs.
         mime_type, _ = mimetypes.guess_type(file_instance.file_name)
         if not mime_type:
@@ -402,57 +1086,109 @@ class PublicViewMetaData(APIView):
         return JsonResponse(data)
 
 
-class PublicFileRetrieveView(APIView):
+class PublicFileRetrieveView(ReadOnlyViewMixin, APIView):
     permission_classes = []  # No authentication required for public links
 
     def get(self, request, public_token):
-        # Retrieve the file by public token
-        file_instance = get_object_or_404(EncryptedFile,
-                                          public_token=public_token)
-
-        # Check expiration
-        if file_instance.is_public_link_expired():
-            return Response({"error": "This public link has expired."},
-                            status=status.HTTP_410_GONE)
+        link = PublicLink.lookup(public_token)
+        if link is None:
+            raise Http404
+        if not link.is_usable():
+            return _link_used_up_response()
 
-        # Determine content type (default to PDF)
-        file_name = file_instance.file_name
-        content_type, _ = mimetypes.guess_type(file_name)
-        if not content_type:
-            content_type = "application/octet-stream"
-
-        # Encode filename for Content-Disposition
-        encoded_filename = quote(file_name)
-
-        try:
-            salt_bytes = base64.b64decode(file_instance.salt)
-            iv_bytes = base64.b64decode(file_instance.iv)
-            key = derive_backend_key(salt_bytes)
-            aesgcm = AESGCM(key)
-            decrypted_data = aesgcm.decrypt(iv_bytes, file_instance.file_data,
-                                            None)
-        except Exception as e:
-            return Response({'error': 'Decryption failed: ' + str(e)},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        response = HttpResponse(decrypted_data, content_type=content_type)
-        file_instance.revoke_public_link()
-        response["Access-Control-Expose-Headers"] = "Content-Disposition"
-        response[
-            "Content-Disposition"] = f'attachment; filename="{encoded_filename}"'
-        return response
+        # The first request uses up a download; resuming it shortly after is
+        # covered by the same one (see PublicLink.claim).
+        return _file_download_response(request, link.file, claim=link.claim)
 
 
 class RevokePublicLinkView(APIView):
+    permission_classes = [IsAuthenticated]
 
     def post(self, request, public_token):
-        file_instance = get_object_or_404(EncryptedFile,
-                                          public_token=public_token)
-        file_instance.revoke_public_link()
+        deleted, _ = PublicLink.objects.filter(
+            token_hash=PublicLink.hash_token(public_token),
+            file__owner=request.user).delete()
+        if not deleted:
+            raise Http404
         return Response({"message": "Public link revoked successfully."},
                         status=status.HTTP_200_OK)
 
 
+def _share_files(file_ids, shares):
+    """
+    Share every file in `file_ids` with every recipient in `shares`, a list of
+    {"user": <username>, "access_type": "view" | "download"} dicts. Recipients
+    are resolved with one IN query and all grants are upserted with batched
+    INSERT ... ON CONFLICT statements. Returns (results, errors): one result
+    per recipient, and the error details of the rejected ones.
+    """
+    usernames = {
+        share.get("user")
+        for share in shares if isinstance(share, dict) and share.get("user")
+    }
+    user_ids = dict(
+        User.objects.filter(username__in=usernames).values_list(
+            'username', 'pk'))
+
+    results, errors, grants = [], [], {}
+    for share_data in shares:
+        if not isinstance(share_data, dict):
+            share_data = {}
+        username = share_data.get("user")
+        access_type = share_data.get("access_type")
+        if not username:
+            error = {"user": "Username is required."}
+        elif username not in user_ids:
+            error = {"user": f"User '{username}' does not exist."}
+        elif access_type not in ['view', 'download']:
+            error = {
+                "access_type": "Access type must be 'view' or 'download'."
+            }
+        else:
+            # A repeated recipient keeps the access type given last.
+            grants[user_ids[username]] = access_type
+            results.append({
+                "user": username,
+                "access_type": access_type,
+                "status": "shared"
+            })
+            continue
+        errors.append(error)
+        results.append({
+            "user": username,
+            "status": "error",
+            "error": next(iter(error.values()))
+        })
+
+    FileShare.objects.bulk_create(
+        [
+            FileShare(file_id=file_id, user_id=user_id, access_type=access)
+            for file_id in file_ids for user_id, access in grants.items()
+        ],
+        batch_size=SHARE_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['file', 'user'],
+        update_fields=['access_type'])
+    # bulk_create sends no post_save signals, so drop the cached decisions here.
+    access_cache.invalidate(
+        (user_id, file_id) for file_id in file_ids for user_id in grants)
+    return results, errors
+
+
+def _share_response(results, errors, message):
+    if errors:
+        return Response({
+            "error": errors,
+            "results": results
+        },
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "message": message,
+        "results": results
+    },
+                    status=status.HTTP_200_OK)
+
+
 class ShareFileView(APIView):
     """
     Share a file with specific users by accepting a JSON payload:
@@ -462,7 +1198,8 @@ class ShareFileView(APIView):
           {"user": "username2", "access_type": "download"}
       ]
     }
-    Only the file owner can share the file.
+    Only the file owner can share the file. The response lists a result per
+    recipient; valid recipients are shared with even if others are rejected.
     """
     permission_classes = [IsAuthenticated]
 
@@ -473,43 +1210,70 @@ class ShareFileView(APIView):
                                           owner=request.user)
         shares = request.data.get("shares", [])
 
-        if not shares:
+        if not shares or not isinstance(shares, list):
             return Response({"error": "No share data provided."},
                             status=status.HTTP_400_BAD_REQUEST)
+        if len(shares) > settings.MAX_SHARES_PER_REQUEST:
+            return Response(
+                {
+                    "error":
+                    f"At most {settings.MAX_SHARES_PER_REQUEST} shares per "
+                    "request."
+                },
+                status=status.HTTP_400_BAD_REQUEST)
 
-        errors = []
-        for share_data in shares:
-            username = share_data.get("user")
-            if not username:
-                errors.append({"user": "Username is required."})
-                continue
-
-            # Look up the user by username
-            try:
-                target_user = User.objects.get(username=username)
-            except User.DoesNotExist:
-                errors.append({"user": f"User '{username}' does not exist."})
-                continue
+        results, errors = _share_files([file_instance.pk], shares)
+        return _share_response(results, errors, "File shared successfully.")
 
-            access_type = share_data.get("access_type")
-            if access_type not in ['view', 'download']:
-                errors.append({
-                    "access_type":
-                    "Access type must be 'view' or 'download'."
-                })
-                continue
 
-            # Create or update the share record
-            FileShare.objects.update_or_create(
-                file=file_instance,
-                user=target_user,
-                defaults={'access_type': access_type})
+class BulkShareFileView(APIView):
+    """
+    Share several files with several users in one call:
+    {
+      "files": [1, 2, 3],
+      "shares": [{"user": "username1", "access_type": "view"}, ...]
+    }
+    Every file must be owned by the caller; otherwise nothing is shared.
+    """
+    permission_classes = [IsAuthenticated]
 
-        if errors:
-            return Response({"error": errors},
+    def post(self, request):
+        file_ids = request.data.get("files", [])
+        shares = request.data.get("shares", [])
+        if (not file_ids or not isinstance(file_ids, list) or not shares
+                or not isinstance(shares, list)):
+            return Response({"error": "Files and share data are required."},
                             status=status.HTTP_400_BAD_REQUEST)
-        return Response({"message": "File shared successfully."},
-                        status=status.HTTP_200_OK)
+        try:
+            file_ids = {int(file_id) for file_id in file_ids}
+        except (TypeError, ValueError):
+            return Response({"error": "File ids must be integers."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(file_ids) * len(shares) > settings.MAX_SHARES_PER_REQUEST:
+            return Response(
+                {
+                    "error":
+                    f"At most {settings.MAX_SHARES_PER_REQUEST} shares per "
+                    "request."
+                },
+                status=status.HTTP_400_BAD_REQUEST)
+
+        owned = set(
+            EncryptedFile.objects.filter(pk__in=file_ids,
+                                         owner=request.user).values_list(
+                                             'pk', flat=True))
+        missing = sorted(file_ids - owned)
+        if missing:
+            return Response(
+                {
+                    "error": "Files not found.",
+                    "files": missing
+                },
+                status=status.HTTP_404_NOT_FOUND)
+
+        with transaction.atomic():
+            results, errors = _share_files(sorted(owned), shares)
+        return _share_response(results, errors, "Files shared successfully.")
 
 
 class AdminLoginView(APIView):
@@ -562,14 +1326,15 @@ class AdminLoginView(APIView):
         return response
 
 
-class AdminFilesView(APIView):
+class AdminFilesView(ReadOnlyViewMixin, APIView):
     # Only superusers can access this view
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
         # Use select_related and prefetch_related for efficient querying.
-        files = EncryptedFile.objects.select_related('owner').prefetch_related(
-            'shared_with').all()
+        files = EncryptedFile.objects.exclude(
+            storage_format='pending').select_related(
+                'owner').prefetch_related('shared_with')
         print(files)
         serializer = AdminFileSerializer(files, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
+import re
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -81,9 +83,95 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Connections are kept per thread between requests.
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts rather than on
+            # its first write, so concurrent writers wait out busy_timeout
+            # instead of failing with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    # The same file opened read-only. Views marked ReadOnlyViewMixin read
+    # through it (see api.routers); with WAL those reads never wait for a
+    # writer.
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+    # Payload bytes (file segments, legacy blobs and upload chunks) live in
+    # their own database, so writing a large upload never holds the metadata
+    # write lock (see api.routers). Any engine can be used here.
+    'blobs': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get("BLOB_DB_PATH", BASE_DIR / 'blobs.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['api.routers.BlobRouter', 'api.routers.ReadOnlyRouter']
+
+# PRAGMAs run on every new SQLite connection (api.signals). WAL lets readers
+# run alongside the single writer; synchronous=NORMAL is durable in WAL mode
+# except for the last commits on power loss; mmap serves reads straight from
+# the page cache; busy_timeout is in ms; a negative cache_size is in KiB.
+# auto_vacuum only takes effect on a new file or after a VACUUM; it must come
+# first so it is set before journal_mode writes the header of a new file.
+SQLITE_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 5000,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
 }
 
+# The cache holds MFA codes and access decisions, so it must be shared by all
+# worker processes: Redis when REDIS_URL is set, otherwise a WAL-mode SQLite
+# file on this node. The test runner gets a per-process memory cache, so
+# cache.clear() in tests never touches the live one.
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache_backends.LocMemCache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 1_000_000,
+            },
+        }
+    }
+elif os.environ.get("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache_backends.RedisCache',
+            'LOCATION': os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'api.cache_backends.SQLiteCache',
+            'LOCATION': os.environ.get("CACHE_PATH",
+                                       BASE_DIR / 'cache.sqlite3'),
+            # Culling drops the entries expiring soonest, which are MFA
+            # codes, so the limit is far above what the site keeps (Django's
+            # default is 300).
+            'OPTIONS': {
+                'MAX_ENTRIES': 1_000_000,
+            },
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -123,14 +211,60 @@ USE_TZ = True
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         "api.authentication.CookieJWTAuthentication",
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.RevocableJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    'DEFAULT_THROTTLE_CLASSES': ['api.throttling.RateLimit'],
+    # Requests arrive through the one nginx in default.conf, which appends
+    # the peer address to X-Forwarded-For. Only that last entry identifies
+    # the client; anything before it is whatever the client sent.
+    'NUM_PROXIES': 1,
+}
+
+# Token-bucket limits per URL name, shared by all workers through the default
+# cache and checked before any password hashing or decryption. Each maps what
+# to key the limit on ('ip', 'username' or 'public_token') to "N/period":
+# bursts of N, refilled at N per period (s, min, h or d).
+RATE_LIMITS = {
+    'login': {
+        'ip': '30/min',
+        'username': '10/min',
+    },
+    'admin-login': {
+        'ip': '10/min',
+        'username': '5/min',
+    },
+    'public-file': {
+        'ip': '60/min',
+        'public_token': '120/min',
+    },
 }
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.Argon2PasswordHasher',  # Argon2 as the default hasher
+    'api.hashers.BoundedArgon2PasswordHasher',  # Argon2 as the default hasher
     'django.contrib.auth.hashers.PBKDF2PasswordHasher',  # Fallback
 ]
+
+# Argon2 cost parameters; run the calibrate_argon2 command on the host to
+# tune them. Hashes made with other parameters are upgraded at next login.
+ARGON2 = {
+    "TIME_COST": 2,
+    "MEMORY_COST": 102400,  # KiB
+    "PARALLELISM": 8,
+}
+
+# Request threads per gunicorn process; dockerfile.django_prod runs
+# WEB_WORKERS gthread workers with WEB_THREADS threads each.
+WEB_THREADS = int(os.environ.get("WEB_THREADS", 8))
+# Argon2 runs on at most MAX_WORKERS threads per process with up to
+# QUEUE_SIZE more calls waiting; further logins get a 503 with Retry-After
+# (seconds) instead of tying up a worker. The limits are per process, so
+# together they take at most half of its request threads and a burst of
+# logins always leaves the other half for everything else.
+PASSWORD_HASHING = {
+    "MAX_WORKERS": 2,
+    "QUEUE_SIZE": max(WEB_THREADS // 2 - 2, 0),
+    "RETRY_AFTER": 1,
+}
 STATIC_URL = 'static/'
 
 # Default primary key field type
@@ -186,6 +320,128 @@ EMAIL_HOST_USER = 'dummydummycompany@gmail.com'
 EMAIL_HOST_PASSWORD = 'fsoq cahn kisq qtsv'
 EMAIL_USE_TLS = True
 EMAIL_USE_SSL = False
+# Emails queued in the OutboundEmail table and delivered by the
+# send_queued_email worker over one SMTP connection per batch.
+EMAIL_OUTBOX = {
+    "BATCH_SIZE": 100,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_DELAY": timedelta(seconds=10),  # doubled after every failure
+    "MAX_RETRY_DELAY": timedelta(hours=1),
+    "CLAIM_TIMEOUT": timedelta(minutes=5),
+    "POLL_INTERVAL": 1,  # seconds between polls of an empty queue
+    # Sent and failed rows (bodies already blanked) are kept this long for
+    # delivery stats, then removed by the maintenance sweep.
+    "KEEP_FINISHED": timedelta(days=7),
+}
 
 BACKEND_ENCRYPTION_SECRET = os.environ.get("BACKEND_ENCRYPTION_SECRET",
                                            "default-secret-key").encode()
+# Bump whenever BACKEND_ENCRYPTION_SECRET changes so cached keys are not reused.
+BACKEND_ENCRYPTION_SECRET_VERSION = int(
+    os.environ.get("BACKEND_ENCRYPTION_SECRET_VERSION", 1))
+
+# Secrets the per-file data keys are wrapped with, by key_version, taken from
+# BACKEND_MASTER_KEY_<version> variables. Version 1 falls back to
+# BACKEND_ENCRYPTION_SECRET, which wrapped every key before versions were
+# configurable. To rotate, add a new version, point BACKEND_MASTER_KEY_VERSION
+# at it and run `manage.py migrate_file_keys`; drop the old secret once no
+# file uses it.
+BACKEND_MASTER_KEYS = {1: BACKEND_ENCRYPTION_SECRET}
+BACKEND_MASTER_KEYS.update({
+    int(name.rsplit('_', 1)[1]): value.encode()
+    for name, value in os.environ.items()
+    if re.fullmatch(r'BACKEND_MASTER_KEY_\d+', name)
+})
+# Version new data keys are wrapped with; the newest one by default.
+BACKEND_MASTER_KEY_VERSION = int(
+    os.environ.get("BACKEND_MASTER_KEY_VERSION", max(BACKEND_MASTER_KEYS)))
+
+# Largest plaintext upload accepted, in bytes.
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024 * 1024
+# Largest part accepted by a parallel multi-part upload, in bytes.
+MAX_UPLOAD_PART_SIZE = 256 * 1024 * 1024
+# Resumable upload sessions expire after this long without a new chunk.
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+# Files whose payload is still being written are removed by
+# sweep_orphan_blobs once they are this old.
+PENDING_FILE_TTL = timedelta(hours=6)
+# Upper limits for a public link's lifetime and download count; requests
+# asking for more are rejected with a 400. Every request starting at the
+# first byte uses up a download and opens a RESUME_WINDOW in which ranges
+# resuming it, up to one more copy of the file in total, are served without
+# using another.
+PUBLIC_LINKS = {
+    "MAX_HOURS_VALID": 24 * 30,
+    "MAX_DOWNLOADS": 1000,
+    "RESUME_WINDOW": timedelta(minutes=15),
+}
+
+# Bytes each user may store, unless StorageUsage.quota_bytes overrides it for
+# them; None (STORAGE_QUOTA set to "" or "none") for no limit. Uploads over
+# it are refused before their body is read.
+STORAGE_QUOTA = os.environ.get("STORAGE_QUOTA", str(10 * 1024 * 1024 * 1024))
+STORAGE_QUOTA = (None if STORAGE_QUOTA.strip().lower() in ("", "none") else
+                 int(STORAGE_QUOTA))
+
+# Sweeps of expired links, tokens, upload sessions and orphaned blobs (see
+# api.maintenance). Each batch of deletes is one short write transaction, and
+# free pages are handed back VACUUM_PAGES at a time. With IN_PROCESS the web
+# processes run the sweep every INTERVAL seconds themselves; otherwise run
+# `manage.py run_maintenance` from cron or with --loop.
+MAINTENANCE = {
+    "BATCH_SIZE": 500,
+    "BATCH_PAUSE": 0.05,  # seconds between batches
+    "VACUUM_PAGES": 1000,
+    "INTERVAL": 3600,
+    "IN_PROCESS": os.environ.get("MAINTENANCE_IN_PROCESS", "") == "1",
+}
+
+# How uploads are stored: 'database' seals them into database segments under a
+# server-side key; 'passthrough' writes the browser's ciphertext to disk as-is
+# so downloads can be handed off to nginx.
+FILE_STORAGE_MODE = os.environ.get("FILE_STORAGE_MODE", "database")
+PASSTHROUGH_STORAGE_ROOT = os.environ.get("PASSTHROUGH_STORAGE_ROOT",
+                                          BASE_DIR / "blobs")
+# Internal nginx location aliased to PASSTHROUGH_STORAGE_ROOT (see
+# default.conf). Leave empty to have Django stream passthrough files itself.
+PASSTHROUGH_ACCEL_PREFIX = os.environ.get("PASSTHROUGH_ACCEL_PREFIX",
+                                          "/protected-blobs/")
+
+# Files returned per page by the file listing, and the most a client may ask for.
+FILE_LIST_PAGE_SIZE = 50
+FILE_LIST_MAX_PAGE_SIZE = 200
+
+# Most (file, recipient) pairs one share request may create or update.
+MAX_SHARES_PER_REQUEST = 20000
+
+# Per-(user, file) access decisions for FileView and FileMetadataView, kept in
+# the default cache. STRICT re-checks every request against the database.
+ACL_CACHE = {
+    "ENABLED": True,
+    "TTL": 300,  # seconds
+    "STRICT": False,
+}
+
+# Users resolved from access tokens, kept in the default cache so requests
+# skip the auth_user query. Saving or deleting a User evicts its entry;
+# queryset .update() calls do not, and are picked up after TTL seconds.
+USER_CACHE = {
+    "ENABLED": True,
+    "TTL": 60,  # seconds
+}
+
+# Revoked JWTs (logout, refresh token rotation). Each worker keeps the revoked
+# jtis in memory, checks the shared cache for revocations made by other
+# workers at most every SYNC_INTERVAL seconds, and rebuilds the list without
+# expired tokens every RELOAD_INTERVAL seconds.
+TOKEN_REVOCATION = {
+    "SYNC_INTERVAL": 2,  # seconds
+    "RELOAD_INTERVAL": 3600,  # seconds
+}
+
+# In-process cache of PBKDF2-derived keys for files on salt-derived keys.
+BACKEND_KEY_CACHE = {
+    "ENABLED": True,
+    "MAX_SIZE": 1024,  # entries
+    "TTL": 300,  # seconds
+}
@@ -70,7 +70,7 @@ const FileUpload = () => {
   const [showCopy, setShowCopy] = useState([])
 
   const dispatch = useDispatch()
-  const { loading, error, files } = useSelector((state) => state.file)
+  const { loading, error, files, nextCursor } = useSelector((state) => state.file)
   const { user, email } = useSelector((state) => state.auth)
 
   // Handle file input change
@@ -254,6 +254,16 @@ const FileUpload = () => {
           ) : (
             <Typography variant='body1'>No files uploaded yet.</Typography>
           )}
+          {nextCursor && (
+            <Button
+              variant='outlined'
+              fullWidth
+              disabled={loading}
+              onClick={() => dispatch(fetchFiles({ cursor: nextCursor }))}
+            >
+              Load more
+            </Button>
+          )}
         </Paper>
       </Container>
     </Box>
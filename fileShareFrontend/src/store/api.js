@@ -6,4 +6,36 @@ const api = axios.create({
   withCredentials: true,
 })
 
+// A 401 from these means bad credentials, not an expired access token.
+const AUTH_URLS = ['/login/', '/admin/login/', '/token/refresh/']
+
+// Refresh tokens are single use, so concurrent 401s share one refresh.
+let refreshing = null
+
+// On a 401, exchange the refresh token cookie for new tokens once and retry.
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const request = error.config
+    if (
+      error.response?.status !== 401 ||
+      !request ||
+      request._retried ||
+      AUTH_URLS.includes(request.url)
+    ) {
+      return Promise.reject(error)
+    }
+    request._retried = true
+    try {
+      refreshing = refreshing || api.post('/token/refresh/')
+      await refreshing
+    } catch {
+      return Promise.reject(error)
+    } finally {
+      refreshing = null
+    }
+    return api(request)
+  }
+)
+
 export default api
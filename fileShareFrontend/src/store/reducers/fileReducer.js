@@ -21,12 +21,19 @@ export const uploadFile = createAsyncThunk(
   }
 )
 
+// Fetch one page of the file list. Without a cursor the list is reloaded
+// from the first page; pass the stored nextCursor to append the next page.
 export const fetchFiles = createAsyncThunk(
   'files/fetchFiles',
-  async (_, { rejectWithValue }) => {
+  async ({ cursor, sort, scope, pageSize } = {}, { rejectWithValue }) => {
     try {
-      const response = await api.get('/files/')
-      return response.data.files
+      const params = { sort, scope, page_size: pageSize, cursor }
+      const response = await api.get('/files/', { params })
+      return {
+        files: response.data.files,
+        nextCursor: response.data.next_cursor,
+        append: Boolean(cursor),
+      }
     } catch (error) {
       return rejectWithValue(error.response?.data || 'Error fetching files')
     }
@@ -66,6 +73,7 @@ export const shareFile = createAsyncThunk(
 // Initial state
 const initialState = {
   files: [],
+  nextCursor: null,
   loading: false,
   error: null,
 }
@@ -94,7 +102,9 @@ const fileSlice = createSlice({
       })
       .addCase(fetchFiles.fulfilled, (state, action) => {
         state.loading = false
-        state.files = action.payload
+        const { files, nextCursor, append } = action.payload
+        state.files = append ? [...state.files, ...files] : files
+        state.nextCursor = nextCursor
       })
       .addCase(fetchFiles.rejected, (state, action) => {
         state.loading = false